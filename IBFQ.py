@@ -1,53 +1,44 @@
-import smtplib
-import ib_insync
-import pandas as pd
-import sqlite3 as sq
 import sys
-from datetime import datetime
-import os
-# Ujistěte se, že váš konfigurační soubor se jmenuje config.py
-import config 
+import config
+import flex_ingest
+from db_access import get_database
 
 if __name__ == '__main__':
-    print("Spouštím stahování a ukládání FlexReportu...")
+    # Volitelný argument: cesta k již staženému XML reportu, který se jen načte do databáze,
+    # nebo --reingest: znovu načte obchody z archivu stažených reportů (bez stahování),
+    # nebo --rebuild: tabulku nejdřív vyprázdní, takže bude obsahovat jen archivované obchody
+    argument = sys.argv[1] if len(sys.argv) > 1 else None
+    rebuild = argument == '--rebuild'
+    reingest = argument == '--reingest' or rebuild
+    report_path = None if reingest else argument
+    if rebuild:
+        print(f"Sestavuji tabulku 'IBFlexQueryCZK' znovu jen z archivu {config.FLEX_ARCHIVE_DIR} "
+              f"(obchody mimo archivované reporty budou smazány)...")
+    elif reingest:
+        print(f"Znovu načítám FlexReporty z archivu {config.FLEX_ARCHIVE_DIR}...")
+    else:
+        print("Spouštím stahování a ukládání FlexReportu..." if not report_path else f"Načítám FlexReport ze souboru {report_path}...")
     try:
-        # Získání hodnot z konfiguračního souboru
-        token = config.TOKEN
-        queryid = config.QUERY_ID
         database_path = config.DATABASE_PATH
 
-        # Krok 1: Připojení k databázi SQLite
-        # Používáme sqlite3 a cestu z konfiguračního souboru
-        conn = sq.connect(database_path)
-        cur = conn.cursor()
-        print(f"Úspěšně připojeno k databázi na cestě: {database_path}")
+        if reingest:
+            counts = flex_ingest.reingest_archive(database_path, rebuild=rebuild)
+            print(f"Načteno {counts['reports']} archivovaných FlexReportů.")
+        elif report_path:
+            counts = get_database(database_path).write_sync(flex_ingest.ingest_file, report_path)
+        else:
+            # Získání hodnot z konfiguračního souboru
+            token = config.TOKEN.strip()
+            queryid = config.QUERY_ID.strip()
+            # Stažení FlexReportu do souboru, archivace a postupné vložení/aktualizace obchodů podle tradeId
+            counts = flex_ingest.run_flex_report(token, queryid, database_path)
+            if counts['duplicate']:
+                print("FlexReport je shodný s již načteným reportem, databáze se nemění.")
+
+        print(f"Zpracováno {counts['downloaded']} záznamů z FlexReportu.")
+        print(f"Tabulka 'IBFlexQueryCZK' ({database_path}): vloženo {counts['inserted']}, "
+              f"aktualizováno {counts['updated']}, beze změny {counts['unchanged']}, "
+              f"přeskočeno {counts['skipped']}.")
 
-        # Krok 2: Smazání všech stávajících dat z hlavní tabulky
-        cur.execute('''DELETE FROM IBFlexQueryCZK''')
-        conn.commit()
-        print("Všechna data z tabulky 'IBFlexQueryCZK' byla smazána.")
-
-        # Krok 3: Stažení nových dat z FlexReportu
-        fr = ib_insync.FlexReport(token, queryid)
-        pdtrades = fr.df('Trade')
-        print(f"Úspěšně staženo {len(pdtrades)} záznamů z FlexReportu.")
-
-        # Krok 4: Vložení nových dat do dočasné tabulky
-        pdtrades.to_sql('IBFlexQueryCZK_Temp', conn, if_exists='replace', index=False)
-
-        # Krok 5: Přesunutí dat z dočasné tabulky do hlavní tabulky
-        cur.execute('''INSERT INTO IBFlexQueryCZK SELECT * FROM IBFlexQueryCZK_Temp''')
-        conn.commit()
-        print("Nová data byla úspěšně vložena do tabulky 'IBFlexQueryCZK'.")
-
-        # Krok 6: Smazání dočasné tabulky
-        cur.execute('''DROP TABLE IF EXISTS IBFlexQueryCZK_Temp''')
-        conn.commit()
-        
     except Exception as e:
         print(f"Chyba při spouštění FlexReport skriptu: {e}")
-    finally:
-        if conn:
-            conn.close()
-            print("Připojení k databázi uzavřeno.")
-
@@ -0,0 +1,143 @@
+# async_tasks.py
+import asyncio
+import functools
+from PyQt6.QtCore import QObject, pyqtSignal
+from request_scheduler import SharedPriority, current_priority, shared_priority
+
+
+def run_in_thread(func, *args, **kwargs):
+    """
+    Runs a blocking function (DB query, HTTP call) in the default thread pool
+    of the running event loop and returns an awaitable with its result.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+class AsyncTask(QObject):
+    """
+    Wraps a coroutine scheduled on the asyncio loop that is integrated with Qt
+    (ib_insync util.useQt). The result or error is delivered through signals on
+    the GUI thread, like OpenAIWorker does for its thread.
+    """
+    result_signal = pyqtSignal(object)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, coro):
+        super().__init__()
+        self._coro = coro
+        self._future = None
+
+    def start(self):
+        """Schedules the coroutine; returns immediately."""
+        self._future = asyncio.ensure_future(self._coro)
+        self._future.add_done_callback(self._on_done)
+
+    def cancel(self):
+        """Cancels the task; no signal is emitted for a cancelled task."""
+        if self._future and not self._future.done():
+            self._future.cancel()
+
+    def _on_done(self, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.error_signal.emit(str(error))
+        else:
+            self.result_signal.emit(future.result())
+
+
+class AsyncTaskRunner:
+    """
+    Starts AsyncTasks by key. Starting a task cancels the still-running task
+    with the same key, so a quick second click never gets overwritten by the
+    late result of the first one.
+    """
+    def __init__(self):
+        self._tasks = {} # key -> AsyncTask (also keeps a reference until done)
+
+    def run(self, key, coro, on_result, on_error=None):
+        """
+        Runs a coroutine and connects its signals.
+
+        Args:
+            key (str): Task key; a running task with the same key is cancelled.
+            coro (coroutine): The coroutine to run.
+            on_result (callable): Slot receiving the result.
+            on_error (callable, optional): Slot receiving the error message.
+
+        Returns:
+            AsyncTask: The started task.
+        """
+        previous = self._tasks.get(key)
+        if previous is not None:
+            previous.cancel()
+
+        task = AsyncTask(coro)
+        task.result_signal.connect(on_result)
+        if on_error is not None:
+            task.error_signal.connect(on_error)
+        self._tasks[key] = task
+        task.start()
+        return task
+
+
+async def _run_shared(shared, coro):
+    shared_priority.set(shared) # Only in the context of the task running the shared request
+    return await coro
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests: callers asking for the same key
+    while a request is in flight share that request and its result instead
+    of issuing a duplicate. A caller that is cancelled (e.g. by
+    AsyncTaskRunner) does not cancel the shared request for the others.
+    The shared request runs at the priority of its most urgent caller, so a
+    user action joining a background request is not queued behind other
+    background requests.
+    """
+    def __init__(self):
+        self._in_flight = {} # key -> (asyncio.Task, SharedPriority)
+
+    async def do(self, key, coro_factory):
+        """
+        Args:
+            key (hashable): Identity of the request.
+            coro_factory (callable): Returns the coroutine to run if no request with the key is in flight.
+
+        Returns:
+            The result of the (shared) request.
+        """
+        priority = current_priority()
+        entry = self._in_flight.get(key)
+        if entry is None:
+            shared = SharedPriority(priority, shared_priority.get())
+            task = asyncio.ensure_future(_run_shared(shared, coro_factory()))
+            self._in_flight[key] = (task, shared)
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            task, shared = entry
+            print(f"DEBUG: Single-flight: joining the in-flight request {key}.")
+            shared.raise_to(priority)
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        """Number of requests currently in flight."""
+        return len(self._in_flight)
+
+
+class ThreadSafeLog(QObject):
+    """
+    Drop-in replacement for a QTextEdit used as a log (only append is supported)
+    that may be called from worker threads; the text is appended on the GUI thread.
+    """
+    append_signal = pyqtSignal(str)
+
+    def __init__(self, text_edit):
+        super().__init__()
+        self.append_signal.connect(text_edit.append)
+
+    def append(self, text):
+        self.append_signal.emit(text)
@@ -0,0 +1,172 @@
+# bar_store.py
+import math
+import sqlite3 as sq
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+import config
+from request_scheduler import get_request_scheduler, HISTORICAL
+from db_access import get_database
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def missing_days(last, max_days, today=None):
+    """
+    Number of calendar days to request so that a daily series ending at
+    `last` becomes current, or 0 if it already is. The last stored day is
+    requested again because it may have been partial.
+
+    Args:
+        last (date or None): Last stored day; None requests max_days.
+        max_days (int): Upper bound (depth of the first backfill).
+        today (date, optional): Defaults to date.today().
+    """
+    today = today or date.today()
+    if last is None:
+        return max_days
+    if last >= today or (today.weekday() >= 5 and last >= today - timedelta(days=today.weekday() - 4)):
+        return 0 # Current, or nothing new over the weekend
+    return min((today - last).days + 1, max_days)
+
+
+class BarStore:
+    """
+    On-disk OHLCV bars keyed by (conId, barSize, date) in SQLite.
+
+    An update asks IB only for the missing tail of a series, and at most
+    once per config.BAR_STORE_REFRESH_SECONDS, so closes, returns and
+    historical volatility are served locally without using historical data
+    pacing slots.
+    """
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path (str): Path to the SQLite database holding the Bars table.
+        """
+        self.db_path = db_path
+        self.db = None
+        self._checked = {} # (conId, barSize) -> time.monotonic() of the last update
+        try:
+            self.db = get_database(self.db_path)
+            self.db.execute_write('''
+                CREATE TABLE IF NOT EXISTS Bars (
+                    conId INTEGER NOT NULL,
+                    barSize TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    open REAL,
+                    high REAL,
+                    low REAL,
+                    close REAL,
+                    volume REAL,
+                    PRIMARY KEY (conId, barSize, date)
+                )
+            ''')
+        except sq.Error as e:
+            print(f"WARNING: Bar store is not available, database error: {e}")
+            self.db = None
+
+    def get_bars(self, con_id, bar_size='1 day', since=None):
+        """
+        Reads stored bars.
+
+        Args:
+            con_id (int): Contract ID.
+            bar_size (str): IB bar size, e.g. '1 day'.
+            since (str, optional): First date ('YYYY-MM-DD') to read.
+
+        Returns:
+            list[tuple]: (date, open, high, low, close, volume) ordered by date.
+        """
+        if not self.db:
+            return []
+        return self.db.query(
+            "SELECT date, open, high, low, close, volume FROM Bars "
+            "WHERE conId = ? AND barSize = ? AND date >= ? ORDER BY date",
+            (con_id, bar_size, since or '')
+        )
+
+    def _last_date(self, con_id, bar_size):
+        row = self.db.query_one(
+            "SELECT MAX(date) FROM Bars WHERE conId = ? AND barSize = ?", (con_id, bar_size)
+        )
+        return datetime.strptime(row[0][:10], '%Y-%m-%d').date() if row and row[0] else None
+
+    def closes(self, con_id, days, bar_size='1 day'):
+        """Closes of the last `days` bars as a float array (oldest first)."""
+        if not self.db:
+            return np.array([], dtype=np.float64)
+        rows = self.db.query(
+            "SELECT close FROM (SELECT date, close FROM Bars WHERE conId = ? AND barSize = ? "
+            "ORDER BY date DESC LIMIT ?) ORDER BY date",
+            (con_id, bar_size, days)
+        )
+        return np.array([r[0] for r in rows], dtype=np.float64)
+
+    def last_close(self, con_id, bar_size='1 day'):
+        """Last stored close, or None."""
+        closes = self.closes(con_id, 1, bar_size)
+        return float(closes[-1]) if len(closes) and closes[-1] > 0 else None
+
+    def log_returns(self, con_id, days, bar_size='1 day'):
+        """Log returns of the last `days` bars (one fewer value than closes)."""
+        closes = self.closes(con_id, days + 1, bar_size)
+        closes = closes[closes > 0]
+        return np.diff(np.log(closes))
+
+    def historical_volatility(self, con_id, days=30):
+        """Annualized close-to-close volatility of the last `days` daily returns, or None."""
+        returns = self.log_returns(con_id, days)
+        if len(returns) < 2:
+            return None
+        return float(np.std(returns, ddof=1) * math.sqrt(TRADING_DAYS_PER_YEAR))
+
+    async def update_async(self, ib, contract, bar_size='1 day', what_to_show='TRADES'):
+        """
+        Downloads only the missing tail of a series and stores it.
+
+        Args:
+            ib (IB): The connected ib_insync IB instance.
+            contract (Contract): A qualified contract (conId is the key).
+            bar_size (str): IB bar size.
+            what_to_show (str): IB data type.
+
+        Returns:
+            int: Number of bars written (0 if the series was current).
+        """
+        if not self.db or not contract.conId:
+            return 0
+        key = (contract.conId, bar_size)
+        checked = self._checked.get(key)
+        if checked is not None and time.monotonic() - checked < config.BAR_STORE_REFRESH_SECONDS:
+            return 0
+        days = missing_days(self._last_date(*key), config.BAR_STORE_BACKFILL_DAYS)
+        if days == 0:
+            self._checked[key] = time.monotonic()
+            return 0
+
+        await get_request_scheduler().acquire(HISTORICAL)
+        bars = await ib.reqHistoricalDataAsync(
+            contract, endDateTime='', durationStr=f'{days} D', barSizeSetting=bar_size,
+            whatToShow=what_to_show, useRTH=True, formatDate=1
+        )
+        self._checked[key] = time.monotonic()
+        print(f"DEBUG: Bar store: {contract.symbol} ({contract.conId}, {bar_size}) requested {days} days, received {len(bars or [])} bars.")
+        if not bars:
+            return 0
+        try:
+            rows = [(contract.conId, bar_size, bar.date.isoformat(), bar.open, bar.high, bar.low, bar.close, bar.volume)
+                    for bar in bars]
+            await self.db.write_async(lambda conn: conn.executemany(
+                "INSERT OR REPLACE INTO Bars (conId, barSize, date, open, high, low, close, volume) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            ))
+        except sq.Error as e:
+            print(f"WARNING: Could not store bars of {contract.symbol}: {e}")
+            return 0
+        return len(bars)
+
+    async def last_close_async(self, ib, contract, bar_size='1 day'):
+        """Updates the series if needed and returns its last close, or None."""
+        await self.update_async(ib, contract, bar_size)
+        return self.last_close(contract.conId, bar_size)
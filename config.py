@@ -4,12 +4,74 @@
 OPENAI_API_KEY = 'xxx' # Remember to replace this with your actual key!
 
 # Interactive Brokers connection details
-# These are used for ib_insync.IB().connect() directly
+# All components share one connection (ib_session.IBSession) configured from these values
 IB_HOST = '127.0.0.1'
-IB_PORT = 7497
+IB_PORT = 7497 # 7496 for live trading, 7497 for paper
+IB_CLIENT_ID = 11 # First client ID tried; the next ones are used if it is already in use
+IB_CLIENT_ID_ATTEMPTS = 5
+IB_CONNECT_TIMEOUT = 5
+# Reconnect backoff (seconds): starts at MIN_DELAY and doubles up to MAX_DELAY
+IB_RECONNECT_MIN_DELAY = 1
+IB_RECONNECT_MAX_DELAY = 60
+IB_HEALTH_CHECK_INTERVAL = 30
+
+# Shared deadline (seconds) for one batch of market data snapshots
+MARKET_DATA_TIMEOUT = 2.0
+# Seconds a quote stays valid after its contract leaves the view (streaming quotes are always fresh)
+QUOTE_TTL_SECONDS = 60
+# Concurrent streaming market data lines the app may use (IB's default quota is 100 lines)
+MARKET_DATA_LINES = 90
+# Deadline (seconds) for resolving all leg prices through the fallback sources when the market is closed
+PRICE_FALLBACK_DEADLINE = 4.0
+
+# Risk-free rate (continuous, annualized) used by the local IV/greeks engine
+RISK_FREE_RATE = 0.04
+
+# Historical IV shown in the detail view (calendar days), the depth of the first backfill from IB
+# and the minimum interval (seconds) between two backfill requests for the same symbol
+IV_HISTORY_DAYS = 30
+IV_HISTORY_BACKFILL_DAYS = 365
+IV_HISTORY_REFRESH_SECONDS = 900
+
+# Local bar store: depth of the first backfill (calendar days) and the minimum
+# interval (seconds) between two update requests for the same series
+BAR_STORE_BACKFILL_DAYS = 365
+BAR_STORE_REFRESH_SECONDS = 900
+
+# IB request pacing (token buckets per request class): 'rate' requests per second, bursts of up to 'burst'.
+# IB allows about 50 messages per second in total; historical data requests are paced more strictly.
+IB_MAX_MESSAGES_PER_SECOND = 45
+IB_PACING = {
+    'market_data': {'rate': 40, 'burst': 40},
+    'contract_details': {'rate': 10, 'burst': 20},
+    'historical': {'rate': 0.5, 'burst': 10},
+    'general': {'rate': 10, 'burst': 10}
+}
+# Pause (seconds) of a request class after IB reported a pacing violation
+IB_PACING_PENALTY_SECONDS = 15
 
 # Path to the database
 DATABASE_PATH = 'data/IBFlexQuery.db'
+# Read connections in the pool (writes go through a single writer thread, see db_access.py)
+DB_READER_CONNECTIONS = 4
+# Seconds a connection waits for a lock before "database is locked"
+DB_BUSY_TIMEOUT = 30
+# Rows read from SQLite per page when a table view scrolls to its end
+TABLE_PAGE_SIZE = 200
+# Compressed copies of the downloaded Flex reports (see flex_archive.py)
+FLEX_ARCHIVE_DIR = 'data/flex_archive'
+# Databases with older trades in their own IBFlexQueryCZK table, attached to the live
+# database for the trade history (see trade_archives.py). Paths or glob patterns; one file
+# per year or one file over several years (e.g. IBFlexQuery_OLD.db with 2022-2025), the
+# range of each file is read from its trades. The archives are only ever read.
+TRADE_ARCHIVE_DATABASES = ['Data/IBFlexQuery_*.db']
+# Read-optimized copies of the archives (normalized dates, index), rebuilt when an archive changes
+TRADE_ARCHIVE_CACHE_DIR = 'data/archive_cache'
+# Parquet export for offline analysis (see parquet_export.py, needs the optional pyarrow package):
+# trades and position snapshots partitioned by year and underlying
+PARQUET_EXPORT_DIR = 'data/parquet'
+# Append the position snapshots of every portfolio overview refresh to the export
+PARQUET_EXPORT_SNAPSHOTS = True
 
 # Email parameters
 # SendMail - False / True - determines if the system sends emails
@@ -0,0 +1,208 @@
+# contract_cache.py
+import sqlite3 as sq
+from datetime import datetime
+from ib_insync import Contract, Stock
+from request_scheduler import get_request_scheduler, CONTRACT_DETAILS
+from db_access import get_database
+
+# Contract fields persisted for every qualified contract
+CONTRACT_FIELDS = (
+    'secType', 'symbol', 'localSymbol', 'tradingClass', 'exchange', 'primaryExchange',
+    'currency', 'strike', 'right', 'multiplier', 'lastTradeDateOrContractMonth'
+)
+
+
+class ContractCache:
+    """
+    Cache of qualified contracts keyed by conId, kept in memory and in SQLite.
+
+    Qualification of a contract that was seen before (even in a previous run)
+    is a cache hit and needs no IB request. Entries are dropped once the
+    contract has expired.
+    """
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path (str): Path to the SQLite database holding the ContractCache table.
+        """
+        self.db_path = db_path
+        self._contracts = {} # conId -> dict of CONTRACT_FIELDS
+        self._underlyings = {} # conId of an option on a future -> conId of the future
+        self.db = None
+        try:
+            self.db = get_database(self.db_path)
+            self.db.execute_write('''
+                CREATE TABLE IF NOT EXISTS ContractCache (
+                    conId INTEGER PRIMARY KEY,
+                    secType TEXT,
+                    symbol TEXT,
+                    localSymbol TEXT,
+                    tradingClass TEXT,
+                    exchange TEXT,
+                    primaryExchange TEXT,
+                    currency TEXT,
+                    strike REAL,
+                    right TEXT,
+                    multiplier TEXT,
+                    lastTradeDateOrContractMonth TEXT,
+                    updated TEXT
+                )
+            ''')
+            self._load()
+        except sq.Error as e:
+            print(f"WARNING: Contract cache is memory-only, database error: {e}")
+            self.db = None
+
+    def _load(self):
+        """Loads all non-expired entries from SQLite and purges the expired ones."""
+        columns = ', '.join(CONTRACT_FIELDS)
+        expired = []
+        for row in self.db.query(f"SELECT conId, {columns} FROM ContractCache"):
+            fields = dict(zip(CONTRACT_FIELDS, row[1:]))
+            if self._is_expired(fields['lastTradeDateOrContractMonth']):
+                expired.append((row[0],))
+            else:
+                self._contracts[row[0]] = fields
+        if expired:
+            self.db.write_sync(lambda conn: conn.executemany("DELETE FROM ContractCache WHERE conId = ?", expired))
+        print(f"DEBUG: Contract cache loaded {len(self._contracts)} contracts.")
+
+    @staticmethod
+    def _is_expired(expiry):
+        """Checks if an expiry ('YYYYMMDD' or 'YYYYMM') lies in the past."""
+        if not expiry:
+            return False
+        today = datetime.now().strftime('%Y%m%d')
+        expiry = expiry[:8]
+        if len(expiry) == 6: # Monthly contracts expire at the end of the month
+            return expiry < today[:6]
+        return expiry < today
+
+    def get(self, con_id):
+        """
+        Returns the cached contract for a conId, or None on a miss or expired entry.
+        """
+        fields = self._contracts.get(con_id)
+        if fields is None:
+            return None
+        if self._is_expired(fields['lastTradeDateOrContractMonth']):
+            self.invalidate(con_id)
+            return None
+        return Contract.create(conId=con_id, **fields)
+
+    def put(self, contract):
+        """Stores a qualified contract in memory and in SQLite."""
+        if not contract.conId:
+            return
+        fields = {field: getattr(contract, field) for field in CONTRACT_FIELDS}
+        self._contracts[contract.conId] = fields
+        if self.db:
+            # Persisted in the background by the writer thread; the memory cache is already current
+            columns = ', '.join(CONTRACT_FIELDS)
+            params = (contract.conId, *fields.values(), datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            self.db.write(lambda conn: conn.execute(
+                f"INSERT OR REPLACE INTO ContractCache (conId, {columns}, updated) "
+                f"VALUES (?, {', '.join('?' * len(CONTRACT_FIELDS))}, ?)", params
+            )).add_done_callback(lambda f: self._report_write_error(f, f"persist contract {contract.conId} to"))
+
+    def invalidate(self, con_id):
+        """Removes a contract from the cache."""
+        self._contracts.pop(con_id, None)
+        if self.db:
+            self.db.write(lambda conn: conn.execute("DELETE FROM ContractCache WHERE conId = ?", (con_id,))
+                          ).add_done_callback(lambda f: self._report_write_error(f, f"remove contract {con_id} from"))
+
+    @staticmethod
+    def _report_write_error(future, action):
+        """Done callback of a background write (runs on the writer thread)."""
+        if future.exception() is not None:
+            print(f"WARNING: Could not {action} the cache: {future.exception()}")
+
+    def _qualify_from_cache(self, contracts):
+        """
+        Fills cached contracts in place.
+
+        Returns:
+            tuple: (set of id() of the contracts filled from the cache, list of misses)
+        """
+        qualified_ids = set()
+        misses = []
+        for contract in contracts:
+            fields = self._contracts.get(contract.conId) if contract.conId else None
+            if fields is not None and not self._is_expired(fields['lastTradeDateOrContractMonth']):
+                for field, value in fields.items():
+                    setattr(contract, field, value)
+                qualified_ids.add(id(contract))
+            else:
+                misses.append(contract)
+        if misses:
+            print(f"DEBUG: Contract cache: qualifying {len(misses)} of {len(contracts)} contracts via IB.")
+        return qualified_ids, misses
+
+    def qualify(self, ib, contracts):
+        """
+        Drop-in replacement for ib.qualifyContracts: fills the given contracts in
+        place and returns the successfully qualified ones. Only contracts missing
+        from the cache are sent to IB.
+
+        Args:
+            ib (IB): The connected ib_insync IB instance.
+            contracts (list[Contract]): Contracts to qualify.
+
+        Returns:
+            list[Contract]: The qualified contracts (a subset of the input objects).
+        """
+        qualified_ids, misses = self._qualify_from_cache(contracts)
+        if misses:
+            for contract in ib.qualifyContracts(*misses):
+                self.put(contract)
+                qualified_ids.add(id(contract))
+        return [c for c in contracts if id(c) in qualified_ids]
+
+    async def qualify_async(self, ib, contracts):
+        """Async variant of qualify (uses ib.qualifyContractsAsync, paced by the request scheduler)."""
+        qualified_ids, misses = self._qualify_from_cache(contracts)
+        if misses:
+            for _ in misses: # One contract details request per contract
+                await get_request_scheduler().acquire(CONTRACT_DETAILS)
+            for contract in await ib.qualifyContractsAsync(*misses):
+                self.put(contract)
+                qualified_ids.add(id(contract))
+        return [c for c in contracts if id(c) in qualified_ids]
+
+    def _find(self, **fields):
+        """Returns the conId of a cached, non-expired contract with the given field values, or None."""
+        for con_id, cached in self._contracts.items():
+            if all(cached.get(field) == value for field, value in fields.items()) \
+                    and not self._is_expired(cached['lastTradeDateOrContractMonth']):
+                return con_id
+        return None
+
+    async def qualify_stock_async(self, ib, symbol, exchange='SMART', currency='USD'):
+        """
+        Returns the qualified stock contract of a symbol (e.g. the underlying
+        whose quote the option greeks need), or None if IB does not know it.
+        A stock qualified before, also in a previous run, is found by its
+        symbol, so it keeps its conId and needs no IB request.
+        """
+        con_id = self._find(secType='STK', symbol=symbol, exchange=exchange, currency=currency)
+        if con_id is not None:
+            return self.get(con_id)
+        qualified = await self.qualify_async(ib, [Stock(symbol, exchange, currency)])
+        return qualified[0] if qualified else None
+
+    async def qualify_underlying_async(self, ib, option):
+        """
+        Returns the qualified underlying contract of an option on a future
+        (FOP), or None. The underlying conId comes from the option's contract
+        details, requested once per option and session.
+        """
+        under_con_id = self._underlyings.get(option.conId)
+        if under_con_id is None:
+            await get_request_scheduler().acquire(CONTRACT_DETAILS)
+            details = await ib.reqContractDetailsAsync(option)
+            if not details or not details[0].underConId:
+                return None
+            under_con_id = self._underlyings[option.conId] = details[0].underConId
+        qualified = await self.qualify_async(ib, [Contract(conId=under_con_id)])
+        return qualified[0] if qualified else None
@@ -3,7 +3,47 @@ import sqlite3 as sq
 from datetime import datetime
 from PyQt6.QtWidgets import QTableWidgetItem
 from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QColor
+import config
+from async_tasks import run_in_thread
+from db_access import get_database
+import db_migrations
+from trade_archives import TradeArchives
+
+# Dotazy detailu strategie; db_migrations.TRADE_HISTORY_INDEX slouží oběma.
+# Historie se čte po stránkách, řazení podle sloupců indexu (až po unikátní
+# tradeId) dává stránkám stabilní pořadí bez třídění mimo index.
+# Datum obchodu se čte z tradeDay (YYYY-MM-DD), uložené tradeDate zůstává
+# ve formátu tabulky (viz db_migrations.TRADE_DAY_SQL).
+TRADE_HISTORY_COLUMNS = "tradeDay, symbol, putCall, strike, quantity, fifoPnlRealized, tradePrice, tradeId"
+TRADE_WINDOW = "underlyingSymbol = ? AND tradeDay BETWEEN ? AND ?"
+TRADE_HISTORY_ORDER = "ORDER BY tradeDay, tradeId"
+TRADE_HISTORY_SQL = f"""
+    SELECT {TRADE_HISTORY_COLUMNS}
+    FROM IBFlexQueryCZK
+    WHERE {TRADE_WINDOW}
+    {TRADE_HISTORY_ORDER}
+    LIMIT ? OFFSET ?
+"""
+
+# Předpočítaný souhrn strategie (tabulka udržovaná triggery, viz db_migrations)
+STRATEGY_SUMMARY_SQL = """
+    SELECT ticker, realizedPnL, netCash, fxPnL, tradeCount, date_close
+    FROM StrategyPnLSummary
+    WHERE ticker = ? AND date_open = ?
+"""
+
+TRADE_SUMMARY_SQL = f"""
+    SELECT underlyingSymbol, SUM(fifoPnlRealized), SUM(netCash), SUM(fxPnL)
+    FROM IBFlexQueryCZK
+    WHERE {TRADE_WINDOW}
+    GROUP BY underlyingSymbol
+"""
+
+# Souhrn obchodů, které jsou jen v archivních databázích (viz trade_archives)
+ARCHIVE_SUMMARY_SQL = """
+    SELECT COUNT(*), SUM(fifoPnlRealized), SUM(netCash), SUM(fxPnL)
+    FROM ({})
+"""
 
 class DatabaseManager:
     """
@@ -12,216 +52,312 @@ class DatabaseManager:
     def __init__(self, db_path, log_output):
         self.db_path = db_path
         self.log_output = log_output
-        self.conn = self.get_connection()
-        self.cursor = self.conn.cursor()
+        self.archives = None
+        self.db = self.get_connection()
         self.init_db()
 
     def get_connection(self):
+        """Vrací sdílený přístup k databázi (WAL, jeden zapisující thread, pool čtecích spojení)."""
         try:
-            return sq.connect(self.db_path)
+            return get_database(self.db_path)
         except sq.Error as e:
             self.log_output.append(f"<span style='color:red;'>Chyba databáze: {e}</span>")
             return None
 
     def init_db(self):
         """
-        Inicializuje databázové tabulky.
+        Inicializuje databázové tabulky a indexy postupným použitím migrací (db_migrations).
         """
-        if self.conn:
+        if self.db:
             try:
-                self.cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS DeltaNeutralStrategies (
-                        date_open TEXT NOT NULL,
-                        ticker TEXT NOT NULL,
-                        date_close TEXT,
-                        PRIMARY KEY (date_open, ticker)
-                    )
-                ''')
-                self.conn.commit()
-                self.log_output.append("<span style='color:green;'>Tabulka 'DeltaNeutralStrategies' připravena.</span>")
-                
-                self.cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS IBFlexQueryCZK (
-                        tradeDate TEXT,
-                        symbol TEXT,
-                        conid INTEGER,
-                        assetCategory TEXT,
-                        strike REAL,
-                        fifoPnlRealized REAL, 
-                        realizedPnL_Ccy TEXT,
-                        netCash REAL,
-                        netCash_Ccy TEXT,
-                        fxPnL REAL,
-                        fxPnL_Ccy TEXT,
-                        tradeId REAL,
-                        multiplier REAL,
-                        code TEXT,
-                        underlyingSymbol TEXT,
-                        buySell TEXT,
-                        putCall TEXT,
-                        openClose TEXT,
-                        tradePrice REAL,
-                        quantity INTEGER,
-                        PRIMARY KEY (tradeId)
-                    )
-                ''')
-                self.conn.commit()
-                self.log_output.append("<span style='color:green;'>Tabulka 'IBFlexQueryCZK' připravena.</span>")
+                version = self.db.write_sync(db_migrations.current_version)
+                applied = self.db.write_sync(db_migrations.migrate)
+                if applied:
+                    self.log_output.append(f"<span style='color:green;'>Databáze převedena ze schématu verze {version} na verzi {applied[-1]}.</span>")
+                self.log_output.append("<span style='color:green;'>Tabulky 'DeltaNeutralStrategies' a 'IBFlexQueryCZK' připraveny.</span>")
+                self.archives = TradeArchives(self.db_path)
+                try:
+                    self.db.for_each_reader(self.archives.attach)
+                except sq.Error as e:
+                    self.log_output.append(f"<span style='color:red;'>Archivní databáze obchodů nelze připojit: {e}</span>")
+                    self.archives = None
+                if self.archives:
+                    first = min(a['first_date'] for a in self.archives.archives)[:4]
+                    last = max(a['last_date'] for a in self.archives.archives)[:4]
+                    self.log_output.append(f"<span style='color:green;'>Připojeno {len(self.archives.archives)} archivních databází obchodů ({first}-{last}).</span>")
+                self.check_query_plans()
             
             except sq.Error as e:
                 self.log_output.append(f"<span style='color:red;'>Chyba při inicializaci DB: {e}</span>")
-                self.conn.close()
-                self.conn = None
+                self.db = None
+
+    def check_query_plans(self):
+        """
+        Ověří přes EXPLAIN QUERY PLAN, že dotazy historie obchodů hledají
+        v indexu a netřídí přes dočasný B-strom. Dotaz, který by procházel
+        celou tabulku, se ohlásí jako chyba v logu.
+
+        Returns:
+            bool: True, pokud všechny dotazy index používají.
+        """
+        params = ('AAPL', '2024-01-01', '2024-12-31')
+        plans = []
+        for name, sql, query_params in (('historie', TRADE_HISTORY_SQL, params + (config.TABLE_PAGE_SIZE, 0)),
+                                        ('souhrn', TRADE_SUMMARY_SQL, params)):
+            with self.db.reader() as conn:
+                plan = db_migrations.query_plan(conn, sql, query_params)
+            plans.append((name, plan, db_migrations.uses_index(plan)))
+        if self.archives:
+            # Dotaz přes všechny archivy: každá větev musí hledat ve svém indexu
+            first = min(a['first_date'] for a in self.archives.archives)
+            sql, query_params = self.trade_page_query('AAPL', first, '2099-12-31', config.TABLE_PAGE_SIZE, 0)
+            with self.db.reader() as conn:
+                plan = db_migrations.query_plan(conn, sql, query_params)
+            searches = [step for step in plan if step.startswith('SEARCH') and db_migrations.TRADE_HISTORY_INDEX in step]
+            plans.append(('historie přes archivy', plan,
+                          len(searches) >= len(self.archives.archives) + 1 and db_migrations.uses_index(plan)))
+
+        ok = True
+        for name, plan, uses_index in plans:
+            if uses_index:
+                continue
+            ok = False
+            print(f"WARNING: Dotaz '{name}' nepoužívá index {db_migrations.TRADE_HISTORY_INDEX}: {plan}")
+            self.log_output.append(f"<span style='color:red;'>Chyba: Dotaz '{name}' nepoužívá index "
+                                   f"{db_migrations.TRADE_HISTORY_INDEX} (prochází celou tabulku nebo třídí mimo index): {'; '.join(plan)}</span>")
+        return ok
+
+    def trade_page_query(self, ticker, date_from, date_to, limit, offset):
+        """
+        Vrací (sql, parametry) stránky historie obchodů. Pokud okno strategie
+        zasahuje do let v archivních databázích, čte se UNION ALL jen přes ty archivy.
+        """
+        params = (ticker, date_from, date_to)
+        if not self.archives or not self.archives.overlapping(date_from, date_to):
+            return TRADE_HISTORY_SQL, params + (limit, offset)
+        sql, params = self.archives.union_sql(TRADE_HISTORY_COLUMNS, TRADE_WINDOW, params, date_from, date_to)
+        return f"{sql} {TRADE_HISTORY_ORDER} LIMIT ? OFFSET ?", params + (limit, offset)
+
+    def _add_archive_summary(self, cursor, summary, ticker, date_from, date_to):
+        """Přičte k souhrnu (symbol, PnL, netCash, fxPnL) obchody, které jsou jen v archivech."""
+        if not self.archives or not self.archives.overlapping(date_from, date_to):
+            return summary
+        sql, params = self.archives.union_sql(
+            "fifoPnlRealized, netCash, fxPnL", TRADE_WINDOW, (ticker, date_from, date_to),
+            date_from, date_to, include_main=False
+        )
+        cursor.execute(ARCHIVE_SUMMARY_SQL.format(sql), params)
+        count, realized_pnl, net_cash, fx_pnl = cursor.fetchone()
+        if not count:
+            return summary
+        if summary is None:
+            return (ticker, realized_pnl, net_cash, fx_pnl)
+        return (summary[0],) + tuple((a or 0) + (b or 0) for a, b in zip(summary[1:], (realized_pnl, net_cash, fx_pnl)))
 
     def add_dn_entry(self, ticker, date_open):
         """Přidá nový záznam Delta Neutral strategie do databáze."""
-        if not self.conn:
+        if not self.db:
             self.log_output.append("<span style='color:red;'>Chyba: Databázové spojení není aktivní.</span>")
             return
         
         try:
-            self.cursor.execute('''
+            self.db.execute_write('''
                 INSERT OR IGNORE INTO DeltaNeutralStrategies (ticker, date_open, date_close)
                 VALUES (?, ?, '')
             ''', (ticker, date_open))
-            self.conn.commit()
         except sq.Error as e:
             self.log_output.append(f"<span style='color:red;'>Chyba při přidávání záznamu: {e}</span>")
 
     def get_all_dn_entries(self,):
         """Získává všechny záznamy z tabulky DeltaNeutralStrategies."""
-        if not self.conn:
+        if not self.db:
             self.log_output.append("<span style='color:red;'>Chyba: Databázové spojení není aktivní.</span>")
             return []
         
         try:
-            self.cursor.execute('''
+            return self.db.query('''
                 SELECT date_open, ticker, date_close FROM DeltaNeutralStrategies
             ''')
-            return self.cursor.fetchall()
         except sq.Error as e:
             self.log_output.append(f"<span style='color:red;'>Chyba při načítání strategií: {e}</span>")
             return []
 
+    def get_open_dn_entries(self):
+        """Získává otevřené strategie (bez data uzavření) z tabulky DeltaNeutralStrategies."""
+        if not self.db:
+            self.log_output.append("<span style='color:red;'>Chyba: Databázové spojení není aktivní.</span>")
+            return []
+
+        try:
+            return self.db.query('''
+                SELECT date_open, ticker, date_close FROM DeltaNeutralStrategies
+                WHERE date_close IS NULL OR date_close = ''
+                ORDER BY ticker, date_open
+            ''')
+        except sq.Error as e:
+            self.log_output.append(f"<span style='color:red;'>Chyba při načítání otevřených strategií: {e}</span>")
+            return []
+
     def update_dn_strategy(self, ticker, date_open, old_date_close, column_name, new_value):
         """
         Aktualizuje záznam v tabulce DeltaNeutralStrategies na základě tickeru a původního data otevření.
         """
-        if not self.conn:
+        if not self.db:
             self.log_output.append("<span style='color:red;'>Chyba: Databázové spojení není aktivní.</span>")
             return
 
         try:
             sql = f"UPDATE DeltaNeutralStrategies SET {column_name} = ? WHERE ticker = ? AND date_open = ?"
-            self.cursor.execute(sql, (new_value, ticker, date_open))
-            self.conn.commit()
+            self.db.execute_write(sql, (new_value, ticker, date_open))
             self.log_output.append(f"<span style='color:green;'>Úspěšně aktualizováno {column_name} pro {ticker} ({date_open}).</span>")
         except sq.Error as e:
             self.log_output.append(f"<span style='color:red;'>Chyba při aktualizaci záznamu: {e}</span>")
 
     def delete_dn_entry(self, ticker, date_open):
         """Smaže záznam Delta Neutral strategie z databáze."""
-        if not self.conn:
+        if not self.db:
             self.log_output.append("<span style='color:red;'>Chyba: Databázové spojení není aktivní.</span>")
             return
         try:
-            self.cursor.execute('''
+            self.db.execute_write('''
                 DELETE FROM DeltaNeutralStrategies
                 WHERE ticker = ? AND date_open = ?
             ''', (ticker, date_open))
-            self.conn.commit()
             self.log_output.append(f"<span style='color:green;'>Záznam pro {ticker} s datem {date_open} úspěšně smazán.</span>")
         except sq.Error as e:
             self.log_output.append(f"<span style='color:red;'>Chyba při mazání záznamu: {e}</span>")
 
-    def load_trade_history_and_summary(self, position_data, summary_table, trade_history_table):
+    async def delete_trade_async(self, trade_id):
         """
-        Načte a zobrazí historii obchodů a souhrn PnL pro danou strategii.
+        Smaže obchod z tabulky IBFlexQueryCZK podle tradeId (zápis proběhne
+        v zapisujícím threadu databáze).
+
+        Returns:
+            int: Počet smazaných řádků.
+
+        Raises:
+            sq.Error: Chyba databáze.
         """
-        if not self.conn:
-            self.log_output.append("<span style='color:red;'>Chyba: Databázové spojení není aktivní.</span>")
-            return
+        if not self.db:
+            raise sq.OperationalError("Databázové spojení není aktivní.")
+        return await self.db.write_async(
+            lambda conn: conn.execute("DELETE FROM IBFlexQueryCZK WHERE tradeId = ?", (trade_id,)).rowcount
+        )
+
+    def fetch_trade_history_and_summary(self, position_data):
+        """
+        Načte historii obchodů a souhrn PnL pro danou strategii, bez práce s GUI.
+        Čte přes spojení z poolu, takže ji lze volat i z pracovního vlákna.
 
+        Returns:
+            dict: 'ticker', 'date_open', 'date_close', 'end_date', 'trades' (první stránka řádků)
+                  a 'summary' (řádek souhrnu nebo None).
+
+        Raises:
+            ValueError: Chybí ticker nebo datum otevření.
+            sq.Error: Chyba databáze.
+        """
         ticker = position_data.get('ticker')
         date_open_str = position_data.get('date_open')
         date_close_str = position_data.get('date_close')
-        
+
         if not ticker or not date_open_str:
-            self.log_output.append("<span style='color:red;'>Chyba: Ticker a datum otevření jsou povinné pro načtení historie.</span>")
-            return
-        
+            raise ValueError("Ticker a datum otevření jsou povinné pro načtení historie.")
+
         # Určení koncového data pro dotaz.
         # Pokud je strategie otevřená, použije se dnešní datum.
         end_date = date_close_str if date_close_str else datetime.now().strftime('%Y-%m-%d')
-        
-        self.log_output.append(f"Načítám historii obchodů pro ticker: {ticker} v rozmezí {date_open_str} až {end_date}.")
-        
-        # Načtení historie obchodů
-        try:
-            # ZMĚNA: Používáme 'underlyingSymbol' místo 'symbol'
-            # NOVINKA: Přidáno řazení podle tradeDate
-            query = """
-                SELECT tradeDate, symbol, putCall, strike, quantity, fifoPnlRealized, tradePrice, tradeId
-                FROM IBFlexQueryCZK
-                WHERE underlyingSymbol = ? AND tradeDate BETWEEN ? AND ?
-                ORDER BY tradeDate
-            """
-            self.cursor.execute(query, (ticker, date_open_str, end_date))
-            trades = self.cursor.fetchall()
-            
-            trade_history_table.setRowCount(len(trades))
-            for i, trade in enumerate(trades):
-                trade_date, symbol, put_call, strike, quantity, realized_pnl, trade_price, trade_id = trade
-                
-                trade_history_table.setItem(i, 0, QTableWidgetItem(str(trade_date)))
-                trade_history_table.setItem(i, 1, QTableWidgetItem(str(symbol)))
-                trade_history_table.setItem(i, 2, QTableWidgetItem(str(put_call)))
-                trade_history_table.setItem(i, 3, QTableWidgetItem(str(strike)))
-                trade_history_table.setItem(i, 4, QTableWidgetItem(str(quantity)))
-                
-                realized_pnl_item = QTableWidgetItem(f"{realized_pnl:.2f}" if realized_pnl is not None else "0.00")
-                if realized_pnl is not None:
-                    color = QColor('red') if realized_pnl < 0 else QColor('green')
-                    realized_pnl_item.setForeground(color)
-                trade_history_table.setItem(i, 5, realized_pnl_item)
-                
-                trade_history_table.setItem(i, 6, QTableWidgetItem(f"{trade_price:.2f}" if trade_price is not None else "0.00"))
-                trade_id_item = QTableWidgetItem(str(trade_id))
-                trade_history_table.setItem(i, 7, trade_id_item)
-
-            self.log_output.append(f"<span style='color:green;'>Historie obchodů načtena.</span>")
 
-        except sq.Error as e:
-            self.log_output.append(f"<span style='color:red;'>Chyba při načítání historie obchodů: {e}</span>")
-            return
+        if not self.db:
+            raise sq.OperationalError("Databázové spojení není aktivní.")
 
-        # Načtení souhrnu PnL
-        try:
-            # Souhrn se nyní počítá vždy, ať je strategie otevřená, nebo uzavřená
+        with self.db.reader() as conn:
+            # Oba dotazy čtou ze stejného snímku databáze, i když zrovna běží zápis (WAL)
+            conn.execute("BEGIN")
+            cursor = conn.cursor()
             # ZMĚNA: Používáme 'underlyingSymbol' místo 'symbol'
-            query = """
-                SELECT underlyingSymbol, SUM(fifoPnlRealized), SUM(netCash), SUM(fxPnL)
-                FROM IBFlexQueryCZK
-                WHERE underlyingSymbol = ? AND tradeDate BETWEEN ? AND ?
-                GROUP BY underlyingSymbol
-            """
-            self.cursor.execute(query, (ticker, date_open_str, end_date))
-            summary = self.cursor.fetchone()
-            
-            summary_table.setRowCount(1)
-            if summary:
-                symbol, realized_pnl, net_cash, fx_pnl = summary
-                summary_table.setItem(0, 0, QTableWidgetItem(str(symbol)))
-                summary_table.setItem(0, 1, QTableWidgetItem(f"{realized_pnl:.2f}" if realized_pnl is not None else "0.00"))
-                summary_table.setItem(0, 2, QTableWidgetItem(f"{net_cash:.2f}" if net_cash is not None else "0.00"))
-                summary_table.setItem(0, 3, QTableWidgetItem(f"{fx_pnl:.2f}" if fx_pnl is not None else "0.00"))
-            else:
-                summary_table.clearContents()
+            # NOVINKA: Přidáno řazení podle tradeDate
+            # Jen první stránka, další načte model tabulky při posunu (fetch_trade_page)
+            cursor.execute(*self.trade_page_query(ticker, date_open_str, end_date, config.TABLE_PAGE_SIZE, 0))
+            trades = cursor.fetchall()
 
-            if date_close_str:
-                self.log_output.append(f"<span style='color:green;'>Souhrn PnL pro uzavřenou strategii načten.</span>")
+            # Souhrn se nyní počítá vždy, ať je strategie otevřená, nebo uzavřená.
+            # Uložená strategie má souhrn předpočítaný, jinak se sčítají obchody.
+            cursor.execute(STRATEGY_SUMMARY_SQL, (ticker, date_open_str))
+            stored = cursor.fetchone()
+            if stored is not None and (stored[5] or '') == (date_close_str or ''):
+                summary = stored[:4] if stored[4] else None # Bez obchodů není co zobrazit (jako dříve GROUP BY)
             else:
-                self.log_output.append(f"<span style='color:orange;'>Zobrazen průběžný souhrn PnL pro otevřenou strategii.</span>")
+                cursor.execute(TRADE_SUMMARY_SQL, (ticker, date_open_str, end_date))
+                summary = cursor.fetchone()
+            # Předpočítaný souhrn zná jen živou tabulku, obchody z archivů se přičtou
+            summary = self._add_archive_summary(cursor, summary, ticker, date_open_str, end_date)
+
+        return {
+            'ticker': ticker,
+            'date_open': date_open_str,
+            'date_close': date_close_str,
+            'end_date': end_date,
+            'trades': trades,
+            'summary': summary
+        }
+
+    def fetch_trade_page(self, ticker, date_open, end_date, offset, limit):
+        """Načte další stránku historie obchodů (volá ji TradeHistoryModel.fetchMore)."""
+        if not self.db:
+            return []
+        return self.db.query(*self.trade_page_query(ticker, date_open, end_date, limit, offset))
+
+    async def fetch_trade_history_and_summary_async(self, position_data):
+        """Asynchronní varianta fetch_trade_history_and_summary (běží v pracovním vlákně)."""
+        return await run_in_thread(self.fetch_trade_history_and_summary, position_data)
 
+    def render_trade_history_and_summary(self, data, summary_table, trade_history_table):
+        """
+        Zobrazí historii obchodů a souhrn PnL načtené přes fetch_trade_history_and_summary.
+        trade_history_table je QTableView s modelem TradeHistoryModel.
+        """
+        # Model tabulky formátuje jen viditelné řádky a další stránky si načte sám
+        ticker, date_open, end_date = data['ticker'], data['date_open'], data['end_date']
+        trade_history_table.model().set_first_page(
+            data['trades'],
+            lambda offset, limit: self.fetch_trade_page(ticker, date_open, end_date, offset, limit)
+        )
+
+        self.log_output.append(f"<span style='color:green;'>Historie obchodů načtena.</span>")
+
+        summary = data['summary']
+        summary_table.setRowCount(1)
+        if summary:
+            symbol, realized_pnl, net_cash, fx_pnl = summary
+            summary_table.setItem(0, 0, QTableWidgetItem(str(symbol)))
+            summary_table.setItem(0, 1, QTableWidgetItem(f"{realized_pnl:.2f}" if realized_pnl is not None else "0.00"))
+            summary_table.setItem(0, 2, QTableWidgetItem(f"{net_cash:.2f}" if net_cash is not None else "0.00"))
+            summary_table.setItem(0, 3, QTableWidgetItem(f"{fx_pnl:.2f}" if fx_pnl is not None else "0.00"))
+        else:
+            summary_table.clearContents()
+
+        if data['date_close']:
+            self.log_output.append(f"<span style='color:green;'>Souhrn PnL pro uzavřenou strategii načten.</span>")
+        else:
+            self.log_output.append(f"<span style='color:orange;'>Zobrazen průběžný souhrn PnL pro otevřenou strategii.</span>")
+
+    def load_trade_history_and_summary(self, position_data, summary_table, trade_history_table):
+        """
+        Načte a zobrazí historii obchodů a souhrn PnL pro danou strategii.
+        """
+        if not self.db:
+            self.log_output.append("<span style='color:red;'>Chyba: Databázové spojení není aktivní.</span>")
+            return
+
+        try:
+            data = self.fetch_trade_history_and_summary(position_data)
+        except ValueError as e:
+            self.log_output.append(f"<span style='color:red;'>Chyba: {e}</span>")
+            return
         except sq.Error as e:
-            self.log_output.append(f"<span style='color:red;'>Chyba při načítání souhrnu PnL: {e}</span>")
+            self.log_output.append(f"<span style='color:red;'>Chyba při načítání historie obchodů: {e}</span>")
+            return
+
+        self.log_output.append(f"Načítám historii obchodů pro ticker: {data['ticker']} v rozmezí {data['date_open']} až {data['end_date']}.")
+        self.render_trade_history_and_summary(data, summary_table, trade_history_table)
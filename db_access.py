@@ -0,0 +1,179 @@
+# db_access.py
+import asyncio
+import concurrent.futures
+import contextlib
+import os
+import queue
+import sqlite3 as sq
+import threading
+from urllib.request import pathname2url
+import config
+
+_STOP = object()
+
+
+def read_only_uri(db_path):
+    """SQLite URI of a database file opened read-only (for connect(..., uri=True) or ATTACH)."""
+    return f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+
+
+def connect_read_only(db_path):
+    """
+    Opens a connection that cannot change the database. Other databases can
+    be attached to it read-only by their read_only_uri. Like the pooled
+    connections it may be used from another thread, one at a time (e.g. by
+    pyarrow reading a cursor).
+
+    Raises:
+        sq.Error: The database does not exist or cannot be opened.
+    """
+    return sq.connect(read_only_uri(db_path), timeout=config.DB_BUSY_TIMEOUT, check_same_thread=False, uri=True)
+
+
+def _connect(db_path):
+    # uri=True lets ATTACH open other databases read-only (read_only_uri); a plain path is still a path
+    conn = sq.connect(db_path, timeout=config.DB_BUSY_TIMEOUT, check_same_thread=False, uri=True)
+    conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL, avoids an fsync per commit
+    return conn
+
+
+class DatabaseAccess:
+    """
+    Access to one SQLite file from several threads.
+
+    The database runs in WAL mode, so readers never block the writer and the
+    writer never blocks readers. All writes are executed one after another
+    by a single writer thread owning the only write connection (no two
+    writers ever compete for the lock, so there is no "database is locked").
+    Reads use a small pool of connections and run concurrently, also while
+    a long write such as a Flex ingest is in progress.
+    """
+    def __init__(self, db_path, readers=None):
+        """
+        Args:
+            db_path (str): Path to the SQLite database.
+            readers (int, optional): Size of the read connection pool.
+                                     Defaults to config.DB_READER_CONNECTIONS.
+
+        Raises:
+            sq.Error: The database cannot be opened.
+        """
+        self.db_path = db_path
+        readers = config.DB_READER_CONNECTIONS if readers is None else readers
+
+        self._writer_conn = _connect(db_path)
+        mode = self._writer_conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode.lower() != 'wal':
+            print(f"WARNING: SQLite WAL mode is not available for {db_path} (journal mode {mode}).")
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='sqlite-writer', daemon=True)
+        self._writer.start()
+
+        self._readers = queue.Queue()
+        self._reader_count = max(1, readers)
+        for _ in range(self._reader_count):
+            self._readers.put(_connect(db_path))
+
+    def _write_loop(self):
+        while True:
+            job = self._writes.get()
+            if job is _STOP:
+                break
+            function, args, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(self._writer_conn, *args)
+                self._writer_conn.commit()
+            except BaseException as e:
+                self._writer_conn.rollback()
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        self._writer_conn.close()
+
+    def write(self, function, *args):
+        """
+        Queues a write for the writer thread; it runs as function(conn, *args)
+        and is committed afterwards (rolled back if it raises).
+
+        Returns:
+            concurrent.futures.Future: Result of the function.
+        """
+        future = concurrent.futures.Future()
+        self._writes.put((function, args, future))
+        return future
+
+    def write_sync(self, function, *args):
+        """Runs a write on the writer thread and waits for its result."""
+        return self.write(function, *args).result()
+
+    async def write_async(self, function, *args):
+        """Awaitable variant of write for coroutines on the asyncio loop."""
+        return await asyncio.wrap_future(self.write(function, *args))
+
+    def execute_write(self, sql, params=()):
+        """Executes one statement on the writer thread and returns its rowcount."""
+        return self.write_sync(lambda conn: conn.execute(sql, params).rowcount)
+
+    @contextlib.contextmanager
+    def reader(self):
+        """Checks out a read connection from the pool (waits if all are in use)."""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction: # Do not keep an old snapshot open in the pool
+                conn.rollback()
+            self._readers.put(conn)
+
+    def for_each_reader(self, function):
+        """
+        Runs function(conn) on every pooled read connection, e.g. to ATTACH a
+        database or create a TEMP view, which exist per connection. Waits
+        until all read connections are free.
+
+        Returns:
+            list: The results, one per connection.
+        """
+        connections = [self._readers.get() for _ in range(self._reader_count)]
+        try:
+            return [function(conn) for conn in connections]
+        finally:
+            for conn in connections:
+                self._readers.put(conn)
+
+    def query(self, sql, params=()):
+        """Executes a SELECT on a pooled read connection and returns all rows."""
+        with self.reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        """Executes a SELECT on a pooled read connection and returns the first row, or None."""
+        with self.reader() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def close(self):
+        """Finishes the queued writes and closes all connections."""
+        self._writes.put(_STOP)
+        self._writer.join()
+        while not self._readers.empty():
+            self._readers.get().close()
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(db_path):
+    """
+    Returns the DatabaseAccess shared by all components using the given
+    database file (there must be only one writer per file). The components
+    (caches and stores) write only through its writer thread and read
+    through its pool, never through connections of their own.
+    """
+    with _databases_lock:
+        database = _databases.get(db_path)
+        if database is None:
+            database = _databases[db_path] = DatabaseAccess(db_path)
+        return database
@@ -0,0 +1,329 @@
+# db_migrations.py
+from datetime import datetime
+
+VERSION_TABLE = 'SchemaVersion'
+
+# tradeDate as 'YYYY-MM-DD'. Tables of the former to_sql(if_exists='replace')
+# store 20240131, and views or tools of the user may rely on that, so the
+# stored values are never rewritten; the application reads this expression,
+# as the generated column tradeDay (migration 7) and in the archive copies.
+TRADE_DAY_COLUMN = 'tradeDay'
+TRADE_DAY_SQL = """
+    CASE WHEN CAST({column} AS TEXT) GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]*'
+         THEN substr(CAST({column} AS TEXT), 1, 4) || '-' || substr(CAST({column} AS TEXT), 5, 2) || '-' ||
+              substr(CAST({column} AS TEXT), 7, 2)
+         ELSE {column} END
+"""
+
+# Query shapes of DatabaseManager.fetch_trade_history_and_summary: equality on
+# underlyingSymbol, range on tradeDay, pages ordered by (tradeDay, tradeId).
+# The index serves the filter and the order; only the rows of the requested
+# page are read from the table.
+TRADE_HISTORY_INDEX = 'idx_IBFlexQueryCZK_underlying_day_id'
+TRADE_HISTORY_INDEX_COLUMNS = ('underlyingSymbol', TRADE_DAY_COLUMN, 'tradeId')
+
+# The index of migration 6 on the stored tradeDate, replaced by migration 7
+_TRADE_HISTORY_INDEX_V6 = 'idx_IBFlexQueryCZK_underlying_date_id'
+_TRADE_HISTORY_INDEX_V6_COLUMNS = ('underlyingSymbol', 'tradeDate', 'tradeId')
+
+# The wide covering index of migration 3, replaced by migration 6
+_COVERING_INDEX_V3 = 'idx_IBFlexQueryCZK_underlying_date'
+_COVERING_INDEX_V3_COLUMNS = (
+    'underlyingSymbol', 'tradeDate',
+    'symbol', 'putCall', 'strike', 'quantity', 'fifoPnlRealized', 'tradePrice', 'tradeId',
+    'netCash', 'fxPnL'
+)
+
+
+def _table_columns(conn, table):
+    """
+    Returns the columns of a table as {lowercase name: name}, generated ones
+    included (empty if the table does not exist).
+    """
+    return {row[1].lower(): row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+
+
+def _create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS DeltaNeutralStrategies (
+            date_open TEXT NOT NULL,
+            ticker TEXT NOT NULL,
+            date_close TEXT,
+            PRIMARY KEY (date_open, ticker)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS IBFlexQueryCZK (
+            tradeDate TEXT,
+            symbol TEXT,
+            conid INTEGER,
+            assetCategory TEXT,
+            strike REAL,
+            fifoPnlRealized REAL,
+            realizedPnL_Ccy TEXT,
+            netCash REAL,
+            netCash_Ccy TEXT,
+            fxPnL REAL,
+            fxPnL_Ccy TEXT,
+            tradeId REAL,
+            multiplier REAL,
+            code TEXT,
+            underlyingSymbol TEXT,
+            buySell TEXT,
+            putCall TEXT,
+            openClose TEXT,
+            tradePrice REAL,
+            quantity INTEGER,
+            PRIMARY KEY (tradeId)
+        )
+    ''')
+
+
+def _keep_trade_dates(conn):
+    # Formerly rewrote tradeDate 20240131 to '2024-01-31' in place, which broke
+    # the views of the user reading the stored format (e.g. DATE(SUBSTR(tradeDate, ...))).
+    # The stored dates are left alone; migration 7 adds the normalized tradeDay.
+    pass
+
+
+def _create_index(conn, name, columns):
+    # Older tables created by to_sql may lack some columns (or spell them differently;
+    # SQLite column names are case-insensitive): index the ones that exist
+    existing = _table_columns(conn, 'IBFlexQueryCZK')
+    columns = [existing[c.lower()] for c in columns if c.lower() in existing]
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON IBFlexQueryCZK ({', '.join(columns)})")
+    conn.execute("ANALYZE IBFlexQueryCZK")
+
+
+def _create_covering_index(conn):
+    _create_index(conn, _COVERING_INDEX_V3, _COVERING_INDEX_V3_COLUMNS)
+
+
+def create_trade_history_index(conn):
+    """Creates TRADE_HISTORY_INDEX on IBFlexQueryCZK (also on the archive copies, see trade_archives)."""
+    _create_index(conn, TRADE_HISTORY_INDEX, TRADE_HISTORY_INDEX_COLUMNS)
+
+
+def _narrow_trade_history_index(conn):
+    # The covering index duplicated most of the table; the paged history only
+    # filters and orders on these columns and reads one page of rows
+    conn.execute(f"DROP INDEX IF EXISTS {_COVERING_INDEX_V3}")
+    _create_index(conn, _TRADE_HISTORY_INDEX_V6, _TRADE_HISTORY_INDEX_V6_COLUMNS)
+
+
+def _in_strategy(date_column):
+    """
+    Condition of the trades t belonging to a strategy s: its underlying, traded
+    from date_open up to date_close (open strategies, date_close NULL or '': up to now).
+    """
+    return f"""
+        t.underlyingSymbol = s.ticker AND t.{date_column} >= s.date_open
+        AND (s.date_close IS NULL OR s.date_close = '' OR t.{date_column} <= s.date_close)
+    """
+
+
+def _strategy_summary_select(date_column):
+    return f"""
+        SELECT s.ticker, s.date_open, s.date_close, COUNT(t.rowid),
+               COALESCE(SUM(t.fifoPnlRealized), 0), COALESCE(SUM(t.netCash), 0), COALESCE(SUM(t.fxPnL), 0)
+        FROM DeltaNeutralStrategies s
+        LEFT JOIN IBFlexQueryCZK t ON {_in_strategy(date_column)}
+    """
+
+
+def _trade_delta_trigger(name, event, sign, row, date_column):
+    """Trigger adding (sign '+') or subtracting ('-') one trade from the summaries of its strategies."""
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON IBFlexQueryCZK
+        BEGIN
+            UPDATE StrategyPnLSummary SET
+                tradeCount = tradeCount {sign} 1,
+                realizedPnL = realizedPnL {sign} COALESCE({row}.fifoPnlRealized, 0),
+                netCash = netCash {sign} COALESCE({row}.netCash, 0),
+                fxPnL = fxPnL {sign} COALESCE({row}.fxPnL, 0)
+            WHERE ticker = {row}.underlyingSymbol AND {row}.{date_column} >= date_open
+              AND (date_close IS NULL OR date_close = '' OR {row}.{date_column} <= date_close);
+        END
+    """
+
+
+_STRATEGY_TRIGGERS = (
+    'trg_IBFlexQueryCZK_summary_insert', 'trg_IBFlexQueryCZK_summary_delete',
+    'trg_IBFlexQueryCZK_summary_update_old', 'trg_IBFlexQueryCZK_summary_update_new',
+    'trg_DeltaNeutralStrategies_summary_insert', 'trg_DeltaNeutralStrategies_summary_update',
+    'trg_DeltaNeutralStrategies_summary_delete',
+)
+
+
+def _create_strategy_triggers(conn, date_column):
+    conn.execute(_trade_delta_trigger('trg_IBFlexQueryCZK_summary_insert', 'INSERT', '+', 'NEW', date_column))
+    conn.execute(_trade_delta_trigger('trg_IBFlexQueryCZK_summary_delete', 'DELETE', '-', 'OLD', date_column))
+    # An update is the removal of the old values and the addition of the new ones
+    update_columns = 'underlyingSymbol, tradeDate, fifoPnlRealized, netCash, fxPnL'
+    conn.execute(_trade_delta_trigger('trg_IBFlexQueryCZK_summary_update_old', f'UPDATE OF {update_columns}', '-', 'OLD', date_column))
+    conn.execute(_trade_delta_trigger('trg_IBFlexQueryCZK_summary_update_new', f'UPDATE OF {update_columns}', '+', 'NEW', date_column))
+
+    # A new strategy or a changed range (date_open, date_close) is aggregated once
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_DeltaNeutralStrategies_summary_insert AFTER INSERT ON DeltaNeutralStrategies
+        BEGIN
+            INSERT OR REPLACE INTO StrategyPnLSummary
+            {_strategy_summary_select(date_column)} WHERE s.ticker = NEW.ticker AND s.date_open = NEW.date_open;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_DeltaNeutralStrategies_summary_update AFTER UPDATE ON DeltaNeutralStrategies
+        BEGIN
+            DELETE FROM StrategyPnLSummary WHERE ticker = OLD.ticker AND date_open = OLD.date_open;
+            INSERT OR REPLACE INTO StrategyPnLSummary
+            {_strategy_summary_select(date_column)} WHERE s.ticker = NEW.ticker AND s.date_open = NEW.date_open;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_DeltaNeutralStrategies_summary_delete AFTER DELETE ON DeltaNeutralStrategies
+        BEGIN
+            DELETE FROM StrategyPnLSummary WHERE ticker = OLD.ticker AND date_open = OLD.date_open;
+        END
+    """)
+
+
+def _rebuild_strategy_summaries(conn, date_column):
+    conn.execute("DELETE FROM StrategyPnLSummary")
+    conn.execute(f"INSERT INTO StrategyPnLSummary {_strategy_summary_select(date_column)} GROUP BY s.ticker, s.date_open")
+
+
+def _create_strategy_summary(conn):
+    # One precomputed row per strategy, kept current by triggers: every insert,
+    # update or delete of a trade (Flex ingest, deleting from the history)
+    # adjusts only the summaries whose range contains the trade
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS StrategyPnLSummary (
+            ticker TEXT NOT NULL,
+            date_open TEXT NOT NULL,
+            date_close TEXT,
+            tradeCount INTEGER NOT NULL DEFAULT 0,
+            realizedPnL REAL NOT NULL DEFAULT 0,
+            netCash REAL NOT NULL DEFAULT 0,
+            fxPnL REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (ticker, date_open)
+        )
+    ''')
+    _create_strategy_triggers(conn, 'tradeDate')
+    _rebuild_strategy_summaries(conn, 'tradeDate')
+
+
+def rebuild_strategy_summaries(conn):
+    """Recomputes all strategy summaries from the trades (e.g. after a manual change of the data)."""
+    _rebuild_strategy_summaries(conn, TRADE_DAY_COLUMN)
+
+
+def _add_commission_columns(conn):
+    # Commissions from the Flex report (flex_ingest.COLUMN_SOURCES), e.g. for
+    # commission scans of the Parquet export; existing trades get them on the next ingest
+    existing = _table_columns(conn, 'IBFlexQueryCZK')
+    for column, declared_type in (('ibCommission', 'REAL'), ('ibCommissionCurrency', 'TEXT')):
+        if column.lower() not in existing:
+            conn.execute(f"ALTER TABLE IBFlexQueryCZK ADD COLUMN {column} {declared_type}")
+
+
+def _add_trade_day(conn):
+    # The normalized date as a virtual column: computed on read, stored only in
+    # the index, so the trade history and the strategy summaries work with
+    # either stored format without changing a single trade
+    existing = _table_columns(conn, 'IBFlexQueryCZK')
+    if TRADE_DAY_COLUMN.lower() not in existing:
+        expression = TRADE_DAY_SQL.format(column=existing.get('tradedate', 'tradeDate'))
+        conn.execute(f"ALTER TABLE IBFlexQueryCZK ADD COLUMN {TRADE_DAY_COLUMN} TEXT "
+                     f"GENERATED ALWAYS AS ({expression}) VIRTUAL")
+    conn.execute(f"DROP INDEX IF EXISTS {_TRADE_HISTORY_INDEX_V6}")
+    create_trade_history_index(conn)
+    for trigger in _STRATEGY_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    _create_strategy_triggers(conn, TRADE_DAY_COLUMN)
+    rebuild_strategy_summaries(conn)
+
+
+# Ordered migrations: (version, description, function(conn)). Append only;
+# an applied migration must never change, add a new one instead.
+MIGRATIONS = [
+    (1, 'Base tables DeltaNeutralStrategies and IBFlexQueryCZK', _create_base_tables),
+    (2, 'IBFlexQueryCZK.tradeDate left as stored (normalized by migration 7)', _keep_trade_dates),
+    (3, 'Covering index for the trade history (underlyingSymbol, tradeDate, ...)', _create_covering_index),
+    (4, 'StrategyPnLSummary maintained by triggers', _create_strategy_summary),
+    (5, 'IBFlexQueryCZK commission columns', _add_commission_columns),
+    (6, 'Trade history index narrowed to (underlyingSymbol, tradeDate, tradeId)', _narrow_trade_history_index),
+    (7, 'IBFlexQueryCZK.tradeDay (tradeDate as YYYY-MM-DD) for the trade history and summaries', _add_trade_day),
+]
+
+
+def current_version(conn):
+    """Returns the schema version of the database (0 for a database without migrations)."""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+    ''')
+    row = conn.execute(f"SELECT MAX(version) FROM {VERSION_TABLE}").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, migrations=None):
+    """
+    Applies the pending migrations in order. Every migration runs in its own
+    explicit transaction (BEGIN ... COMMIT) together with its SchemaVersion
+    row, so a failed migration, DDL included, leaves the database at the
+    previous version. (The sqlite3 module opens transactions implicitly only
+    before DML; without the BEGIN, CREATE and ALTER would commit at once.)
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        migrations (list, optional): Defaults to MIGRATIONS.
+
+    Returns:
+        list[int]: Versions applied now (empty if the schema was current).
+
+    Raises:
+        sq.Error: A migration failed; later migrations are not attempted.
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    version = current_version(conn)
+    conn.commit()
+    applied = []
+    for number, description, function in migrations:
+        if number <= version:
+            continue
+        conn.execute("BEGIN")
+        try:
+            function(conn)
+            conn.execute(
+                f"INSERT INTO {VERSION_TABLE} (version, description, applied_at) VALUES (?, ?, ?)",
+                (number, description, datetime.now().isoformat(timespec='seconds'))
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        print(f"DEBUG: Database migration {number} applied: {description}")
+        applied.append(number)
+    return applied
+
+
+def query_plan(conn, sql, params=()):
+    """Returns the EXPLAIN QUERY PLAN details of a query (list of str)."""
+    # EXPLAIN does not check the schema version, so a connection opened before
+    # the migrations would still plan with the old schema; a real read reloads it
+    conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def uses_index(plan, index=TRADE_HISTORY_INDEX, covering=False):
+    """
+    Checks a query plan: the query searches the given index (no full table
+    scan and, with covering=True, no lookup into the table) and needs no
+    temporary B-tree for sorting.
+    """
+    search = f"USING COVERING INDEX {index}" if covering else f"INDEX {index}"
+    return (any(search in step and step.startswith('SEARCH') for step in plan)
+            and not any('TEMP B-TREE' in step for step in plan))
@@ -0,0 +1,180 @@
+# flex_archive.py
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3 as sq
+import xml.etree.ElementTree as ET
+from datetime import datetime
+import config
+from db_access import get_database
+
+CHUNK_SIZE = 64 * 1024
+
+
+# Attributes that differ between two downloads of the same statement
+VOLATILE_ATTRIBUTES = ('whenGenerated',)
+
+
+def content_sha256(source):
+    """
+    SHA-256 (hex) of a Flex report's content: every element with its sorted
+    attributes and text in document order, without VOLATILE_ATTRIBUTES, so
+    two downloads of the same statement hash the same. The report is
+    streamed; read elements are dropped, so memory stays flat.
+
+    Args:
+        source (str or file): Path or binary file object of the report.
+    """
+    digest = hashlib.sha256()
+    parents = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            attributes = sorted((name, value) for name, value in elem.attrib.items() if name not in VOLATILE_ATTRIBUTES)
+            digest.update(repr((elem.tag, attributes)).encode())
+            continue
+        digest.update(repr(('/', (elem.text or '').strip())).encode())
+        parents.pop()
+        if parents:
+            parents[-1].remove(elem)
+        elem.clear()
+    return digest.hexdigest()
+
+
+def _flex_date(value):
+    """'20240131' -> '2024-01-31' (other values unchanged, None for empty)."""
+    if not value:
+        return None
+    return f"{value[:4]}-{value[4:6]}-{value[6:8]}" if len(value) == 8 and value.isdigit() else value
+
+
+def report_period(source):
+    """
+    Reads the period of a Flex report from its first <FlexStatement> element
+    without parsing the rest of the file.
+
+    Returns:
+        tuple: (fromDate, toDate) as 'YYYY-MM-DD', or (None, None).
+    """
+    for _, elem in ET.iterparse(source, events=('start',)):
+        if elem.tag == 'FlexStatement':
+            return _flex_date(elem.get('fromDate')), _flex_date(elem.get('toDate'))
+    return None, None
+
+
+class FlexArchive:
+    """
+    Compressed copies of all downloaded Flex reports, keyed by query ID,
+    period and content hash (see content_sha256; the 'sha256' column holds it).
+
+    A download whose content is already archived and ingested needs no
+    ingestion at all, and the trade table can be rebuilt from the archive
+    without any network request (see flex_ingest.reingest_archive).
+    """
+    def __init__(self, db_path, directory=None):
+        """
+        Args:
+            db_path (str): Path to the SQLite database holding the FlexArchive table.
+            directory (str, optional): Directory of the .xml.gz files. Defaults to config.FLEX_ARCHIVE_DIR.
+        """
+        self.directory = config.FLEX_ARCHIVE_DIR if directory is None else directory
+        self.db = None
+        try:
+            self.db = get_database(db_path)
+            self.db.execute_write('''
+                CREATE TABLE IF NOT EXISTS FlexArchive (
+                    sha256 TEXT PRIMARY KEY,
+                    queryId TEXT NOT NULL,
+                    fromDate TEXT,
+                    toDate TEXT,
+                    path TEXT NOT NULL,
+                    downloadedAt TEXT NOT NULL,
+                    ingestedAt TEXT,
+                    trades INTEGER
+                )
+            ''')
+        except sq.Error as e:
+            print(f"WARNING: Flex archive is not available, database error: {e}")
+            self.db = None
+
+    def add(self, path, query_id):
+        """
+        Archives a downloaded report unless a report with the same content
+        (apart from its generation time) is already archived.
+
+        Args:
+            path (str): The downloaded XML.
+            query_id (str): Flex query ID.
+
+        Returns:
+            dict: The archive entry ('sha256', 'queryId', 'fromDate', 'toDate', 'path',
+                  'downloadedAt', 'ingestedAt', 'trades') and 'is_new'.
+        """
+        sha256 = content_sha256(path)
+        entry = self.get(sha256)
+        if entry is not None and os.path.exists(entry['path']):
+            print(f"DEBUG: Flex archive: identical report already archived ({entry['path']}).")
+            return dict(entry, is_new=False)
+
+        from_date, to_date = report_period(path)
+        os.makedirs(self.directory, exist_ok=True)
+        archive_path = os.path.join(
+            self.directory, f"{query_id}_{from_date or 'unknown'}_{to_date or 'unknown'}_{sha256[:16]}.xml.gz"
+        )
+        with open(path, 'rb') as source, gzip.open(archive_path, 'wb') as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+        entry = {
+            'sha256': sha256, 'queryId': str(query_id), 'fromDate': from_date, 'toDate': to_date,
+            'path': archive_path, 'downloadedAt': datetime.now().isoformat(timespec='seconds'),
+            'ingestedAt': None, 'trades': None
+        }
+        if self.db:
+            self.db.execute_write(
+                "INSERT OR REPLACE INTO FlexArchive (sha256, queryId, fromDate, toDate, path, downloadedAt) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, entry['queryId'], from_date, to_date, archive_path, entry['downloadedAt'])
+            )
+        print(f"DEBUG: Flex archive: stored {archive_path} ({os.path.getsize(archive_path)} bytes).")
+        return dict(entry, is_new=True)
+
+    def mark_ingested(self, sha256, trades):
+        """Records that an archived report was ingested and how many trades it had."""
+        if self.db:
+            self.db.execute_write(
+                "UPDATE FlexArchive SET ingestedAt = ?, trades = ? WHERE sha256 = ?",
+                (datetime.now().isoformat(timespec='seconds'), trades, sha256)
+            )
+
+    def get(self, sha256):
+        """Returns the archive entry of a content hash as a dict, or None."""
+        entries = self.entries(sha256=sha256)
+        return entries[0] if entries else None
+
+    def entries(self, query_id=None, sha256=None):
+        """
+        Lists archived reports, oldest period first (so a re-ingest applies
+        newer reports last).
+
+        Returns:
+            list[dict]: Archive entries.
+        """
+        if not self.db:
+            return []
+        columns = ('sha256', 'queryId', 'fromDate', 'toDate', 'path', 'downloadedAt', 'ingestedAt', 'trades')
+        sql = f"SELECT {', '.join(columns)} FROM FlexArchive WHERE 1 = 1"
+        params = []
+        if query_id is not None:
+            sql += " AND queryId = ?"
+            params.append(str(query_id))
+        if sha256 is not None:
+            sql += " AND sha256 = ?"
+            params.append(sha256)
+        sql += " ORDER BY toDate, downloadedAt"
+        return [dict(zip(columns, row)) for row in self.db.query(sql, params)]
+
+    @staticmethod
+    def open(entry):
+        """Opens an archived report for reading (decompressed binary stream)."""
+        return gzip.open(entry['path'], 'rb')
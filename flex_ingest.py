@@ -0,0 +1,545 @@
+# flex_ingest.py
+import math
+import os
+import sqlite3 as sq
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from ib_insync.flexreport import FlexError
+from db_access import get_database
+from flex_archive import FlexArchive
+
+TABLE = 'IBFlexQueryCZK'
+KEY_COLUMN = 'tradeId'
+BATCH_SIZE = 500
+# Columns in which the rows of one tradeId must agree to be copies of the same trade
+TRADE_IDENTITY_COLUMNS = ('quantity', 'tradeprice', 'netcash')
+
+# Flex Web Service (version 3): SendRequest returns a reference code, GetStatement the report
+FLEX_SEND_REQUEST_URL = 'https://gdcdyn.interactivebrokers.com/Universal/servlet/FlexStatementService.SendRequest'
+FLEX_IN_PROGRESS_CODES = ('1019',) # Statement generation in progress
+FLEX_POLL_SECONDS = 5
+FLEX_MAX_POLLS = 60
+FLEX_HTTP_TIMEOUT = 60
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Columns of the IBFlexQueryCZK table -> attribute of a Flex <Trade> element
+# (None: the value is taken from another attribute, see _row_values)
+COLUMN_SOURCES = {
+    'tradeDate': 'tradeDate',
+    'symbol': 'symbol',
+    'conid': 'conid',
+    'assetCategory': 'assetCategory',
+    'strike': 'strike',
+    'fifoPnlRealized': 'fifoPnlRealized',
+    'realizedPnL_Ccy': 'currency',
+    'netCash': 'netCash',
+    'netCash_Ccy': 'currency',
+    'fxPnL': 'fxPnl',
+    'fxPnL_Ccy': None, # fxPnl is in the account's base currency, which the Trade element does not carry
+    'tradeId': 'tradeID',
+    'multiplier': 'multiplier',
+    'code': 'notes',
+    'underlyingSymbol': 'underlyingSymbol',
+    'buySell': 'buySell',
+    'putCall': 'putCall',
+    'openClose': 'openCloseIndicator',
+    'tradePrice': 'tradePrice',
+    'quantity': 'quantity',
+    'ibCommission': 'ibCommission',
+    'ibCommissionCurrency': 'ibCommissionCurrency'
+}
+
+
+def normalize_trade_date(value):
+    """
+    Converts a Flex trade date (20240131, '20240131' or '2024-01-31', optionally
+    followed by a time) to 'YYYY-MM-DD', the format the application queries
+    with (tradeDay, see db_migrations).
+    """
+    if value is None or value == '':
+        return None
+    text = str(value).strip()
+    if isinstance(value, float) and value.is_integer():
+        text = str(int(value))
+    if len(text) >= 8 and text[:8].isdigit():
+        return f"{text[:4]}-{text[4:6]}-{text[6:8]}"
+    return text[:10]
+
+
+def trade_date_format(conn):
+    """
+    Returns the format in which the table stores tradeDate: 'integer'
+    (20240131, tables of the former to_sql), 'compact' ('20240131') or 'iso'
+    ('2024-01-31'). Trades are written in the format of the table, so views of
+    the user over it keep working; the application reads tradeDay.
+    """
+    column = next((row for row in conn.execute(f"PRAGMA table_info({TABLE})") if row[1].lower() == 'tradedate'), None)
+    if column is None:
+        return 'iso'
+    if 'INT' in (column[2] or '').upper():
+        return 'integer'
+    row = conn.execute(
+        f"SELECT CAST({column[1]} AS TEXT) GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]*' "
+        f"FROM {TABLE} WHERE {column[1]} IS NOT NULL LIMIT 1"
+    ).fetchone()
+    return 'compact' if row and row[0] else 'iso'
+
+
+def stored_trade_date(value, date_format):
+    """Converts a normalized trade date ('YYYY-MM-DD') to a format of trade_date_format."""
+    if value is None or date_format == 'iso':
+        return value
+    compact = value.replace('-', '')
+    if len(compact) != 8 or not compact.isdigit():
+        return value
+    return int(compact) if date_format == 'integer' else compact
+
+
+def _trade_id(value):
+    """Flex trade IDs are integers; the hand-built table stores them as REAL."""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _same(a, b):
+    """Compares a stored and an incoming value, ignoring int/float/str representation differences."""
+    if a is None or b is None or a == '' or b == '':
+        return (a is None or a == '') and (b is None or b == '')
+    try:
+        return math.isclose(float(a), float(b), rel_tol=1e-12, abs_tol=1e-9)
+    except (TypeError, ValueError):
+        return str(a) == str(b)
+
+
+def _clean(value):
+    """NaN (pandas' missing value) is stored as NULL."""
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def table_columns(conn):
+    """Returns the columns of the IBFlexQueryCZK table as {lowercase name: name}."""
+    return {row[1].lower(): row[1] for row in conn.execute(f"PRAGMA table_info({TABLE})")}
+
+
+def _duplicate_order(columns):
+    """
+    ORDER BY of the rows sharing a tradeId, the most complete first. Tables of
+    the former to_sql hold, next to a trade, copies from reports in which it
+    was not yet closed or realized (no openCloseIndicator, fifoPnlRealized 0,
+    fewer columns filled); the row id says nothing about which one is right.
+    """
+    terms = []
+    if 'fifopnlrealized' in columns:
+        terms.append(f"COALESCE({columns['fifopnlrealized']}, 0) <> 0 DESC")
+    for indicator in ('openclose', 'opencloseindicator'): # Flex name, or openClose of the application's table
+        if indicator in columns:
+            terms.append(f"COALESCE({columns[indicator]}, '') <> '' DESC")
+    filled = ' + '.join(f"(COALESCE({name}, '') <> '')" for name in columns.values())
+    return ', '.join(terms + [f"{filled} DESC", "rowid DESC"])
+
+
+def redundant_copies_sql(columns, table=TABLE):
+    """
+    SELECT of the rowids of the redundant copies of trades: all rows of a
+    tradeId but the most complete one (see _duplicate_order).
+
+    Args:
+        columns (dict): Columns of the table as {lowercase name: name}.
+        table (str): The trades table, optionally with its schema.
+    """
+    key = columns[KEY_COLUMN.lower()]
+    return f"""
+        SELECT rowid FROM (
+            SELECT rowid, ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY {_duplicate_order(columns)}) AS copy
+            FROM {table} WHERE {key} IS NOT NULL
+        ) WHERE copy > 1
+    """
+
+
+def conflicting_trades(conn, columns, table=TABLE):
+    """
+    Returns the tradeIds stored more than once with different trade data:
+    a different quantity, price or net cash, or two different realized PnLs.
+    Such rows are not copies of one trade and no row of them can be dropped.
+
+    Args:
+        conn (sqlite3.Connection): Connection with the table.
+        columns (dict): Columns of the table as {lowercase name: name}.
+        table (str): The trades table, optionally with its schema.
+    """
+    key = columns[KEY_COLUMN.lower()]
+    differs = [f"COUNT(DISTINCT ROUND({columns[c]}, 6)) > 1"
+               for c in TRADE_IDENTITY_COLUMNS if c in columns]
+    if 'fifopnlrealized' in columns:
+        pnl = columns['fifopnlrealized']
+        differs.append(f"COUNT(DISTINCT CASE WHEN {pnl} <> 0 THEN ROUND({pnl}, 6) END) > 1")
+    if not differs:
+        return []
+    return [row[0] for row in conn.execute(f"""
+        SELECT {key} FROM {table} WHERE {key} IS NOT NULL GROUP BY {key}
+        HAVING COUNT(*) > 1 AND ({' OR '.join(differs)}) ORDER BY {key}
+    """)]
+
+
+def ensure_trade_key(conn):
+    """
+    Makes sure tradeId is unique, which the upsert relies on. Tables created by
+    the former to_sql(if_exists='replace') have no primary key and may hold
+    several rows of one trade from overlapping reports; of those only the most
+    complete one is kept (see _duplicate_order). Rows of one tradeId that
+    differ in the trade itself are not merged: the index is not created and
+    the error lists them.
+    Runs in a savepoint, so it joins a transaction of the caller (and commits
+    only when there is none).
+
+    Raises:
+        sq.IntegrityError: The table holds different trades under one tradeId.
+    """
+    columns = table_columns(conn)
+    if KEY_COLUMN.lower() not in columns:
+        raise sq.OperationalError(f"Table {TABLE} with a {KEY_COLUMN} column does not exist (run the application once to create it).")
+    key = columns[KEY_COLUMN.lower()]
+    for index in conn.execute(f"PRAGMA index_list({TABLE})").fetchall():
+        if index[2]: # unique
+            index_columns = [row[2].lower() for row in conn.execute(f"PRAGMA index_info('{index[1]}')")]
+            if index_columns == [KEY_COLUMN.lower()]:
+                return
+    conflicts = conflicting_trades(conn, columns)
+    if conflicts:
+        raise sq.IntegrityError(
+            f"Table {TABLE} holds different trades under the same {key} ({len(conflicts)}: "
+            f"{', '.join(map(str, conflicts[:20]))}{', ...' if len(conflicts) > 20 else ''}); "
+            f"the unique index was not created, resolve them first."
+        )
+    conn.execute("SAVEPOINT ensure_trade_key")
+    try:
+        redundant = redundant_copies_sql(columns)
+        merged = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT {key} FROM {TABLE} WHERE rowid IN ({redundant}) ORDER BY {key}"
+        )]
+        removed = conn.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({redundant})").rowcount
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{TABLE}_{KEY_COLUMN} ON {TABLE} ({key})")
+    except BaseException:
+        conn.execute("ROLLBACK TO ensure_trade_key")
+        conn.execute("RELEASE ensure_trade_key")
+        raise
+    conn.execute("RELEASE ensure_trade_key")
+    if merged:
+        print(f"WARNING: Flex ingest: {removed} redundant copies of {len(merged)} trades removed, "
+              f"the most complete row of each kept: {', '.join(map(str, merged))}")
+    print(f"DEBUG: Flex ingest: unique index on {key} created.")
+
+
+def _row_values(trade, columns, date_format='iso'):
+    """Values of one Flex trade (dict of attributes) for the given table columns."""
+    values = []
+    for column in columns:
+        source = COLUMN_SOURCES[column]
+        value = _clean(trade.get(source)) if source else None
+        if column == 'tradeDate':
+            value = stored_trade_date(normalize_trade_date(value), date_format)
+        elif column == 'tradeId':
+            value = _trade_id(value)
+        values.append(value)
+    return values
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_trades(conn, trades, batch_size=BATCH_SIZE):
+    """
+    Upserts Flex trades by tradeId in one transaction. New trades are
+    inserted, trades whose values differ are updated and identical ones are
+    not written at all, so a refresh costs work proportional to the new and
+    changed trades, not to the size of the history.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database with the IBFlexQueryCZK table.
+        trades (iterable[dict]): Flex Trade attributes (e.g. from iter_flex_elements).
+        batch_size (int): Trades compared and written per executemany.
+
+    Returns:
+        dict: {'inserted': int, 'updated': int, 'unchanged': int, 'skipped': int}
+              (skipped = trades without a tradeID).
+
+    Raises:
+        sq.Error: The transaction is rolled back and nothing is written.
+
+    If the connection is already in a transaction (e.g. a re-ingest of the
+    whole archive), the trades are written within it and the caller commits.
+    """
+    ensure_trade_key(conn)
+    existing_columns = table_columns(conn)
+    # Only the mapped columns that the table actually has (older tables use different sets)
+    columns = [c for c in COLUMN_SOURCES if c.lower() in existing_columns]
+    names = [existing_columns[c.lower()] for c in columns]
+    key_index = columns.index(KEY_COLUMN)
+    date_format = trade_date_format(conn)
+    value_columns = [c for c in range(len(columns)) if c != key_index]
+
+    insert_sql = f"INSERT INTO {TABLE} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+    update_sql = (f"UPDATE {TABLE} SET {', '.join(f'{names[i]} = ?' for i in value_columns)} "
+                  f"WHERE {names[key_index]} = ?")
+    select_sql = f"SELECT {', '.join(names)} FROM {TABLE} WHERE {names[key_index]} IN ({{}})"
+
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+    own_transaction = not conn.in_transaction # One transaction: committed at the end, rolled back on error
+    try:
+        for batch in _batches(trades, batch_size):
+            rows = []
+            for trade in batch:
+                values = _row_values(trade, columns, date_format)
+                if values[key_index] is None:
+                    counts['skipped'] += 1
+                else:
+                    rows.append(values)
+
+            ids = list({values[key_index] for values in rows})
+            stored = {}
+            if ids:
+                for row in conn.execute(select_sql.format(', '.join('?' * len(ids))), ids):
+                    stored[_trade_id(row[key_index])] = list(row)
+
+            inserts, updates = [], []
+            for values in rows:
+                trade_id = values[key_index]
+                current = stored.get(trade_id)
+                if current is None:
+                    inserts.append(values)
+                    counts['inserted'] += 1
+                elif all(_same(a, b) for a, b in zip(current, values)):
+                    counts['unchanged'] += 1
+                    continue
+                else:
+                    updates.append([values[i] for i in value_columns] + [trade_id])
+                    counts['updated'] += 1
+                stored[trade_id] = values # Repeated trades within the report compare against the latest values
+
+            if inserts:
+                conn.executemany(insert_sql, inserts)
+            if updates:
+                conn.executemany(update_sql, updates)
+    except BaseException:
+        if own_transaction:
+            conn.rollback()
+        raise
+    if own_transaction:
+        conn.commit()
+
+    print(f"DEBUG: Flex ingest: {counts}")
+    return counts
+
+
+def ingest_dataframe(conn, df):
+    """Upserts the trades of a FlexReport DataFrame; see ingest_trades."""
+    return ingest_trades(conn, (row for row in df.to_dict('records')))
+
+
+def _parse_number(value):
+    """Converts a numeric attribute to int or float, as FlexReport.df does; other text is kept."""
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return number
+
+
+def iter_flex_elements(source, tag='Trade'):
+    """
+    Yields the attributes of all <tag> elements of a Flex XML report one by
+    one. Every element is removed from the tree once it has been read, so
+    memory stays flat regardless of the report size.
+
+    Args:
+        source (str or file): Path or binary file object of the report.
+        tag (str): Element name, e.g. 'Trade'.
+
+    Yields:
+        dict: Attribute name -> value (numbers converted to int/float).
+    """
+    parents = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == tag:
+            yield {name: _parse_number(value) for name, value in elem.attrib.items()}
+        if parents:
+            parents[-1].remove(elem) # Children end one by one, so the parent never holds more than one
+        elem.clear()
+
+
+def ingest_file(conn, source):
+    """
+    Streams the trades of a Flex XML report into the database; see ingest_trades.
+
+    Returns:
+        dict: The counts returned by ingest_trades, plus 'downloaded' (trades in the report).
+    """
+    read = 0
+
+    def counted(trades):
+        nonlocal read
+        for trade in trades:
+            read += 1
+            yield trade
+
+    counts = ingest_trades(conn, counted(iter_flex_elements(source, 'Trade')))
+    counts['downloaded'] = read
+    return counts
+
+
+def _flex_response(data):
+    """Parses a Flex Web Service status response into (status, error code, message, root)."""
+    root = ET.fromstring(data)
+    return (root.findtext('Status'), root.findtext('ErrorCode'),
+            root.findtext('ErrorMessage') or root.findtext('code'), root)
+
+
+def download_report(token, query_id, path):
+    """
+    Requests a Flex report and streams it to a file in chunks, without
+    holding the whole report in memory.
+
+    Args:
+        token (str): Flex Web Service token.
+        query_id (str): Flex query ID.
+        path (str): File the report XML is written to.
+
+    Raises:
+        FlexError: IB refused the request or did not prepare the report in time.
+    """
+    query = urllib.parse.urlencode({'t': token, 'q': query_id, 'v': 3})
+    with urllib.request.urlopen(f"{FLEX_SEND_REQUEST_URL}?{query}", timeout=FLEX_HTTP_TIMEOUT) as response:
+        status, error_code, message, root = _flex_response(response.read())
+    if status != 'Success':
+        raise FlexError(f"{error_code}: {message}")
+    statement_url = f"{root.findtext('Url')}?{urllib.parse.urlencode({'q': root.findtext('ReferenceCode'), 't': token, 'v': 3})}"
+
+    for _ in range(FLEX_MAX_POLLS):
+        time.sleep(FLEX_POLL_SECONDS)
+        with urllib.request.urlopen(statement_url, timeout=FLEX_HTTP_TIMEOUT) as response:
+            chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+            if b'<FlexStatementResponse' in chunk[:512] or b'<code>' in chunk[:512]:
+                # Status response instead of the report (small, read in full)
+                status, error_code, message, _ = _flex_response(chunk + response.read())
+                if error_code in FLEX_IN_PROGRESS_CODES or (message or '').startswith('Statement generation in progress'):
+                    print("DEBUG: Flex report is being prepared...")
+                    continue
+                raise FlexError(f"{error_code}: {message}")
+            with open(path, 'wb') as file:
+                size = 0
+                while chunk:
+                    file.write(chunk)
+                    size += len(chunk)
+                    chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+        print(f"DEBUG: Flex report downloaded ({size} bytes).")
+        return
+    raise FlexError(f"Flex report was not prepared within {FLEX_POLL_SECONDS * FLEX_MAX_POLLS}s.")
+
+
+def run_flex_report(token, query_id, db_path, archive=None):
+    """
+    Downloads a Flex report to a temporary file, archives it (see
+    flex_archive) and streams its trades into the database on its writer
+    thread (readers keep working meanwhile). A report identical to one that
+    was already ingested is not ingested again.
+
+    Args:
+        token (str): Flex Web Service token.
+        query_id (str): Flex query ID.
+        db_path (str): Path to the SQLite database.
+        archive (FlexArchive, optional): Defaults to the archive in config.FLEX_ARCHIVE_DIR.
+
+    Returns:
+        dict: The counts returned by ingest_file, plus 'duplicate' (True if the
+              report was already ingested; all its trades count as unchanged).
+    """
+    archive = FlexArchive(db_path) if archive is None else archive
+    fd, path = tempfile.mkstemp(prefix='flex_', suffix='.xml')
+    os.close(fd)
+    try:
+        download_report(token, query_id, path)
+        entry = archive.add(path, query_id)
+        if not entry['is_new'] and entry['ingestedAt'] and entry['trades'] is not None:
+            print(f"DEBUG: Flex report is identical to the one ingested at {entry['ingestedAt']}, ingestion skipped.")
+            trades = entry['trades']
+            return {'inserted': 0, 'updated': 0, 'unchanged': trades, 'skipped': 0,
+                    'downloaded': trades, 'duplicate': True}
+        counts = get_database(db_path).write_sync(ingest_file, path)
+        archive.mark_ingested(entry['sha256'], counts['downloaded'])
+        counts['duplicate'] = False
+        return counts
+    finally:
+        os.remove(path)
+
+
+def _reingest(conn, entries, rebuild):
+    conn.execute("BEGIN") # The whole re-ingest is one transaction (ingest_trades joins it)
+    ensure_trade_key(conn)
+    if rebuild:
+        conn.execute(f"DELETE FROM {TABLE}")
+    totals = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'downloaded': 0}
+    ingested = []
+    for entry in entries:
+        with FlexArchive.open(entry) as source:
+            counts = ingest_file(conn, source)
+        for key in totals:
+            totals[key] += counts[key]
+        ingested.append((entry['sha256'], counts['downloaded']))
+    totals['reports'] = len(ingested)
+    totals['ingested'] = ingested
+    return totals
+
+
+def reingest_archive(db_path, query_id=None, rebuild=False, archive=None):
+    """
+    Re-parses the archived Flex reports and ingests them again, oldest
+    period first, without any network request.
+
+    Args:
+        db_path (str): Path to the SQLite database.
+        query_id (str, optional): Only the reports of this Flex query (default: all).
+        rebuild (bool): Empty IBFlexQueryCZK first, so it holds exactly the archived
+                        trades; trades that are not in any archived report (e.g.
+                        loaded from a file or by an older version) are lost.
+                        By default the archived trades are only upserted.
+                        Everything runs in one transaction, so on an error the
+                        table stays as it was.
+        archive (FlexArchive, optional): Defaults to the archive in config.FLEX_ARCHIVE_DIR.
+
+    Returns:
+        dict: Summed ingest counts, plus 'reports' (number of reports ingested).
+    """
+    archive = FlexArchive(db_path) if archive is None else archive
+    entries = []
+    for entry in archive.entries(query_id):
+        if os.path.exists(entry['path']):
+            entries.append(entry)
+        else:
+            print(f"WARNING: Archived Flex report {entry['path']} does not exist, skipped.")
+    if not entries: # Never empty the table without anything to rebuild it from
+        print("WARNING: Flex archive contains no reports to re-ingest.")
+        return {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'downloaded': 0, 'reports': 0}
+    totals = get_database(db_path).write_sync(_reingest, entries, rebuild)
+    for sha256, trades in totals.pop('ingested'):
+        archive.mark_ingested(sha256, trades)
+    return totals
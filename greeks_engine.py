@@ -0,0 +1,174 @@
+# greeks_engine.py
+from datetime import datetime
+import numpy as np
+
+# Bounds of the implied volatility search (annualized)
+IV_MIN = 1e-4
+IV_MAX = 5.0
+IV_TOLERANCE = 1e-6 # Price tolerance of the solver
+IV_MAX_ITERATIONS = 100
+SECONDS_PER_YEAR = 365.0 * 24 * 3600
+
+
+def _norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2.0 * np.pi)
+
+
+def _norm_cdf(x):
+    """
+    Standard normal CDF via the complementary error function approximation
+    from Numerical Recipes (erfcc, fractional error below 1.2e-7), so the
+    whole engine stays vectorized without SciPy.
+    """
+    z = np.abs(x) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.5 * z)
+    erfc = t * np.exp(
+        -z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+            0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+    )
+    return np.where(x >= 0, 1.0 - 0.5 * erfc, 0.5 * erfc)
+
+
+def years_to_expiry(expiries, now=None):
+    """
+    Converts IB expiries ('YYYYMMDD', optionally followed by a time) to
+    years until 16:00 local time of the expiry day.
+
+    Args:
+        expiries (list[str]): lastTradeDateOrContractMonth values.
+        now (datetime, optional): Reference time. Defaults to datetime.now().
+
+    Returns:
+        np.ndarray: Years to expiry; NaN for missing/unparseable or expired values.
+    """
+    now = now or datetime.now()
+    years = np.full(len(expiries), np.nan)
+    for i, expiry in enumerate(expiries):
+        try:
+            expiry_time = datetime.strptime(str(expiry)[:8], '%Y%m%d').replace(hour=16)
+        except ValueError:
+            continue
+        seconds = (expiry_time - now).total_seconds()
+        if seconds > 0:
+            years[i] = seconds / SECONDS_PER_YEAR
+    return years
+
+
+def _d1_d2(spot, strike, years, rate, dividend_yield, sigma):
+    sqrt_t = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate - dividend_yield + 0.5 * sigma * sigma) * years) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def option_price(spot, strike, years, rate, dividend_yield, sigma, is_call):
+    """
+    Black-Scholes-Merton price with a continuous dividend yield. With
+    dividend_yield equal to rate and the futures price as spot it is Black-76.
+    """
+    d1, d2 = _d1_d2(spot, strike, years, rate, dividend_yield, sigma)
+    spot_df = spot * np.exp(-dividend_yield * years)
+    strike_df = strike * np.exp(-rate * years)
+    call = spot_df * _norm_cdf(d1) - strike_df * _norm_cdf(d2)
+    put = strike_df * _norm_cdf(-d2) - spot_df * _norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def _vega(spot, strike, years, rate, dividend_yield, sigma):
+    d1, _ = _d1_d2(spot, strike, years, rate, dividend_yield, sigma)
+    return spot * np.exp(-dividend_yield * years) * _norm_pdf(d1) * np.sqrt(years)
+
+
+def implied_volatility(price, spot, strike, years, rate, dividend_yield, is_call):
+    """
+    Solves the implied volatility of all options at once: Newton steps on the
+    price, falling back to bisection whenever a step leaves the bracket that
+    still contains the root (so the solver cannot diverge).
+
+    Returns:
+        np.ndarray: Annualized IV; NaN where the inputs are missing or the
+                    price lies outside the no-arbitrage bounds.
+    """
+    price, spot, strike, years = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (price, spot, strike, years)))
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), price.shape)
+    dividend_yield = np.broadcast_to(np.asarray(dividend_yield, dtype=np.float64), price.shape)
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        valid = ~np.isnan(price) & ~np.isnan(spot) & ~np.isnan(strike) & ~np.isnan(years)
+        valid &= (price > 0) & (spot > 0) & (strike > 0) & (years > 0)
+        low_bound = option_price(spot, strike, years, rate, dividend_yield, IV_MIN, is_call)
+        high_bound = option_price(spot, strike, years, rate, dividend_yield, IV_MAX, is_call)
+        valid &= (price >= low_bound) & (price <= high_bound)
+
+        lo = np.full(price.shape, IV_MIN)
+        hi = np.full(price.shape, IV_MAX)
+        sigma = np.full(price.shape, 0.3)
+        active = valid.copy()
+        for _ in range(IV_MAX_ITERATIONS):
+            if not active.any():
+                break
+            diff = option_price(spot, strike, years, rate, dividend_yield, sigma, is_call) - price
+            active &= np.abs(diff) > IV_TOLERANCE
+            # Model price above the market means sigma is too high
+            hi = np.where(active & (diff > 0), sigma, hi)
+            lo = np.where(active & (diff < 0), sigma, lo)
+            newton = sigma - diff / _vega(spot, strike, years, rate, dividend_yield, sigma)
+            in_bracket = np.isfinite(newton) & (newton > lo) & (newton < hi)
+            sigma = np.where(active, np.where(in_bracket, newton, 0.5 * (lo + hi)), sigma)
+
+    return np.where(valid, sigma, np.nan)
+
+
+def option_greeks(spot, strike, years, rate, dividend_yield, sigma, is_call):
+    """
+    Computes the greeks per unit of the underlying.
+
+    Returns:
+        dict: 'delta', 'gamma', 'theta' (per calendar day) and 'vega'
+              (per 1 volatility point) arrays.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        d1, d2 = _d1_d2(spot, strike, years, rate, dividend_yield, sigma)
+        sqrt_t = np.sqrt(years)
+        q_df = np.exp(-dividend_yield * years)
+        r_df = np.exp(-rate * years)
+        pdf_d1 = _norm_pdf(d1)
+
+        delta = np.where(is_call, q_df * _norm_cdf(d1), -q_df * _norm_cdf(-d1))
+        gamma = q_df * pdf_d1 / (spot * sigma * sqrt_t)
+        decay = -spot * q_df * pdf_d1 * sigma / (2.0 * sqrt_t)
+        theta_call = decay - rate * strike * r_df * _norm_cdf(d2) + dividend_yield * spot * q_df * _norm_cdf(d1)
+        theta_put = decay + rate * strike * r_df * _norm_cdf(-d2) - dividend_yield * spot * q_df * _norm_cdf(-d1)
+        theta = np.where(is_call, theta_call, theta_put) / 365.0
+        vega = spot * q_df * pdf_d1 * sqrt_t / 100.0
+
+    return {'delta': delta, 'gamma': gamma, 'theta': theta, 'vega': vega}
+
+
+def compute_option_greeks(price, spot, strike, years, is_call, rate, is_future=None, dividend_yield=0.0):
+    """
+    Solves IV and computes the greeks of a batch of options in one call.
+
+    Args:
+        price (array): Option prices per unit of the underlying (NaN if unknown).
+        spot (array): Underlying prices (futures prices for options on futures).
+        strike (array): Strikes.
+        years (array): Years to expiry (see years_to_expiry).
+        is_call (array of bool): True for calls, False for puts.
+        rate (float): Risk-free rate (continuous, annualized).
+        is_future (array of bool, optional): Options on futures are priced with Black-76.
+        dividend_yield (float or array, optional): Continuous dividend yield of stock underlyings.
+
+    Returns:
+        dict: 'iv', 'delta', 'gamma', 'theta', 'vega' arrays; NaN where the
+              IV could not be solved.
+    """
+    price = np.asarray(price, dtype=np.float64)
+    dividend_yield = np.broadcast_to(np.asarray(dividend_yield, dtype=np.float64), price.shape)
+    if is_future is not None:
+        # Black-76: a futures price carries no cost of carry
+        dividend_yield = np.where(np.asarray(is_future, dtype=bool), rate, dividend_yield)
+
+    iv = implied_volatility(price, spot, strike, years, rate, dividend_yield, is_call)
+    greeks = option_greeks(np.asarray(spot, dtype=np.float64), np.asarray(strike, dtype=np.float64),
+                           np.asarray(years, dtype=np.float64), rate, dividend_yield, iv, is_call)
+    return {'iv': iv, **greeks}
@@ -1,46 +1,386 @@
 # ib_manager.py
-import random
-from ib_insync import IB, Stock, Option, Position
-from PyQt6.QtWidgets import QApplication, QTableWidgetItem
+import asyncio
+import time
+from collections import OrderedDict
+from ib_insync import IB, Stock, Option, Position, util
+from PyQt6.QtWidgets import QApplication
 from PyQt6.QtGui import QColor
 import math # Importujeme modul math pro práci s NaN
+import numpy as np
+import config
+from contract_cache import ContractCache
+from iv_history_store import IVHistoryStore
+from ib_session import get_shared_session
+from request_scheduler import get_request_scheduler, MARKET_DATA
+from async_tasks import SingleFlight
+import pnl_engine
+import greeks_engine
+
+
+def _clean_price(value):
+    """Converts a ticker price field to float, or None if it is missing/NaN."""
+    return value if value is not None and not math.isnan(value) else None
+
+
+def _nan_to_na(value):
+    """Converts a NumPy result to float, or "N/A" if it could not be computed (NaN)."""
+    value = float(value)
+    return value if not math.isnan(value) else "N/A"
+
+
+def _ticker_filled(ticker_data):
+    """A ticker is considered filled once it has a bid/ask pair or a last price."""
+    bid = _clean_price(ticker_data.bid)
+    ask = _clean_price(ticker_data.ask)
+    return (bid is not None and ask is not None) or _clean_price(ticker_data.last) is not None
+
+
+class QuoteStore:
+    """
+    Long-lived in-memory store of streaming quotes keyed by conId, managing
+    the account's market data lines.
+
+    Contracts in the current view are pinned. Other subscriptions keep
+    streaming until the line budget is reached; then the least recently used
+    unpinned subscription is cancelled to make room. A cancelled contract's
+    last quote is still served until it is older than the staleness TTL and
+    it is resubscribed when it is accessed again. If every line is pinned,
+    new contracts get a one-off snapshot instead of a streaming line.
+    """
+    def __init__(self, ib, ttl=None, max_lines=None):
+        """
+        Args:
+            ib (IB): The ib_insync IB instance used for subscriptions.
+            ttl (float, optional): Seconds a released quote stays valid.
+                                   Defaults to config.QUOTE_TTL_SECONDS.
+            max_lines (int, optional): Budget of concurrent streaming lines.
+                                       Defaults to config.MARKET_DATA_LINES.
+        """
+        self.ib = ib
+        self.ttl = config.QUOTE_TTL_SECONDS if ttl is None else ttl
+        self.max_lines = config.MARKET_DATA_LINES if max_lines is None else max_lines
+        # conId -> {'contract': Contract, 'ticker': Ticker, 'streaming': bool, 'released_at': float or None},
+        # ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._pinned = set() # conIds in the current view
+
+    def get(self, contract):
+        """
+        Returns the stored (contract, ticker) pair for a contract if it is
+        streaming or still within the TTL, otherwise None.
+        """
+        entry = self._entries.get(contract.conId) if contract.conId else None
+        if entry is None:
+            return None
+        if entry['streaming'] or time.monotonic() - entry['released_at'] <= self.ttl:
+            self._entries.move_to_end(contract.conId)
+            return entry['contract'], entry['ticker']
+        del self._entries[contract.conId]
+        return None
+
+    def is_streaming(self, contract):
+        """Checks if a contract holds a streaming market data line."""
+        entry = self._entries.get(contract.conId)
+        return entry is not None and entry['streaming']
+
+    def subscribe(self, contracts):
+        """
+        Opens streaming subscriptions for qualified contracts (or resubscribes
+        released ones), evicting least recently used unpinned lines when the
+        budget is reached.
+
+        Returns:
+            list[Ticker]: The live tickers, in the same order as contracts.
+        """
+        tickers = []
+        for contract in contracts:
+            entry = self._entries.get(contract.conId)
+            if entry is None or not entry['streaming']:
+                streaming = self.active_lines() < self.max_lines or self._evict_one()
+                if not streaming:
+                    print(f"DEBUG: Quote store: all {self.max_lines} lines are pinned, snapshot for {contract.symbol}.")
+                ticker_data = self.ib.reqMktData(contract, '', not streaming, False)
+                entry = {'contract': contract, 'ticker': ticker_data, 'streaming': streaming,
+                         'released_at': None if streaming else time.monotonic()}
+                self._entries[contract.conId] = entry
+            self._entries.move_to_end(contract.conId)
+            tickers.append(entry['ticker'])
+        return tickers
+
+    def set_view(self, contracts):
+        """
+        Declares the contracts currently in view. They are pinned and never
+        evicted; the previous view stays subscribed until its lines are needed.
+        """
+        self._pinned = {c.conId for c in contracts if c.conId}
+
+    def active_lines(self):
+        """Number of streaming market data lines in use."""
+        return sum(1 for entry in self._entries.values() if entry['streaming'])
+
+    def line_usage(self):
+        """Returns {'active': int, 'pinned': int, 'budget': int} for monitoring."""
+        return {'active': self.active_lines(), 'pinned': len(self._pinned), 'budget': self.max_lines}
+
+    def reset(self):
+        """Drops all quotes after the connection was lost (its subscriptions are gone)."""
+        self._entries.clear()
+
+    def _evict_one(self):
+        """Cancels the least recently used unpinned line. Returns False if every line is pinned."""
+        for con_id, entry in self._entries.items():
+            if entry['streaming'] and con_id not in self._pinned:
+                print(f"DEBUG: Quote store: line budget reached, releasing {entry['contract'].symbol} ({con_id}).")
+                self._release(entry)
+                return True
+        return False
+
+    def _release(self, entry):
+        try:
+            self.ib.cancelMktData(entry['contract'])
+        except Exception:
+            pass
+        entry['streaming'] = False
+        entry['released_at'] = time.monotonic()
+
+
+class PositionBook:
+    """
+    In-memory book of the account's positions, kept current by ib_insync's
+    positionEvent and updatePortfolioEvent and indexed by underlying symbol
+    and by conId, so looking up the legs of a strategy needs no IB request.
+    """
+    def __init__(self, ib):
+        """
+        Args:
+            ib (IB): The ib_insync IB instance whose events feed the book.
+        """
+        self.ib = ib
+        self._by_con_id = {} # conId -> Position
+        self._by_symbol = {} # symbol -> {conId: Position}
+        self.ib.positionEvent += self._on_position
+        self.ib.updatePortfolioEvent += self._on_portfolio_item
+        self.ib.connectedEvent += self.reload
+        self.reload()
+
+    def reload(self):
+        """Rebuilds the book from the positions ib_insync received at connect time."""
+        self._by_con_id.clear()
+        self._by_symbol.clear()
+        for position in self.ib.positions():
+            self._on_position(position)
+        print(f"DEBUG: Position book loaded {len(self._by_con_id)} positions.")
+
+    def _on_position(self, position):
+        contract = position.contract
+        previous = self._by_con_id.pop(contract.conId, None)
+        if previous is not None:
+            legs = self._by_symbol.get(previous.contract.symbol, {})
+            legs.pop(contract.conId, None)
+            if not legs:
+                self._by_symbol.pop(previous.contract.symbol, None)
+        if position.position == 0: # Closed positions leave the book
+            return
+        self._by_con_id[contract.conId] = position
+        self._by_symbol.setdefault(contract.symbol, {})[contract.conId] = position
+
+    def _on_portfolio_item(self, item):
+        self._on_position(Position(item.account, item.contract, item.position, item.averageCost))
+
+    def positions_for(self, symbol):
+        """Returns the open positions (all legs) for an underlying symbol."""
+        return list(self._by_symbol.get(symbol, {}).values())
+
+    def position(self, con_id):
+        """Returns the open position for a conId, or None."""
+        return self._by_con_id.get(con_id)
+
+    def symbols(self):
+        """Returns the underlying symbols with open positions."""
+        return list(self._by_symbol)
+
 
 class IBManager:
-    def __init__(self, chat_output_widget):
+    def __init__(self, chat_output_widget, session=None):
         """
         Initializes the IBManager.
 
         Args:
             chat_output_widget (QTextEdit): Reference to the QTextEdit widget
                                             to display messages/errors.
+            session (IBSession, optional): The managed IB connection.
+                                           Defaults to the shared session.
         """
-        self.ib = IB()
+        self.session = session or get_shared_session()
+        self.session.set_log(chat_output_widget)
+        self.ib = self.session.ib
         self.chat_output = chat_output_widget
+        self.quote_store = QuoteStore(self.ib)
+        self.position_book = PositionBook(self.ib)
+        self.contract_cache = ContractCache(config.DATABASE_PATH)
+        self.iv_history = IVHistoryStore(config.DATABASE_PATH)
+        # Concurrent callers of the same request share one in-flight IB request
+        self._single_flight = SingleFlight()
+        # Subscriptions do not survive a lost connection
+        self.ib.disconnectedEvent += self.quote_store.reset
+
+        # Attempt to connect to IB Gateway/TWS on startup; later reconnects run in the background
+        self.session.connect()
+        self.session.start_health_check()
 
-        # Attempt to connect to IB Gateway/TWS on startup
-        self._connect_to_ib()
+    def is_connected(self):
+        """Checks if the IB connection is active."""
+        return self.session.is_connected()
 
-    def _connect_to_ib(self):
+    def _empty_market_data(self):
+        """Returns the market data dictionary used when no data could be fetched."""
+        return {'last': None, 'bid': None, 'ask': None, 'close': None, 'best_market_price': 'N/A', 'multiplier': 1.0}
+
+    def _extract_market_data(self, contract, qualified_contract, ticker_data):
+        """
+        Builds the market data dictionary for one qualified contract from its ticker.
+
+        Args:
+            contract (Contract): The contract as requested (used for logging).
+            qualified_contract (Contract): The qualified contract (carries the multiplier).
+            ticker_data (Ticker): The ib_insync Ticker filled by reqMktData.
+
+        Returns:
+            dict: See get_market_data_for_contracts.
+        """
+        # Extract all relevant prices and handle NaN explicitly
+        last_price = _clean_price(ticker_data.last)
+        bid_price = _clean_price(ticker_data.bid)
+        ask_price = _clean_price(ticker_data.ask)
+        close_price = _clean_price(ticker_data.close)
+
+        # Determine the 'best_market_price' for general display/market value
+        # Prioritizing Last -> Mid -> Bid -> Ask -> Close
+        best_market_price = 'N/A'
+        if last_price is not None and last_price != 0.0:
+            best_market_price = last_price
+        elif bid_price is not None and ask_price is not None and bid_price != 0.0 and ask_price != 0.0:
+            best_market_price = (bid_price + ask_price) / 2
+        elif bid_price is not None and bid_price != 0.0:
+            best_market_price = bid_price
+        elif ask_price is not None and ask_price != 0.0:
+            best_market_price = ask_price
+        elif close_price is not None and close_price != 0.0:
+            best_market_price = close_price
+
+        print(f"DEBUG: {contract.symbol} - Fetched market data: Last={last_price}, Bid={bid_price}, Ask={ask_price}, Close={close_price}, Best={best_market_price}")
+
+        # Explicitly convert multiplier to float to prevent TypeError
+        multiplier = 1.0 # Default to 1.0 (float)
+        if hasattr(qualified_contract, 'multiplier') and qualified_contract.multiplier is not None:
+            try:
+                multiplier = float(qualified_contract.multiplier)
+            except ValueError:
+                print(f"WARNING: Multiplier for {contract.symbol} is not a valid number: {qualified_contract.multiplier}. Defaulting to 1.0.")
+                multiplier = 1.0
+        print(f"DEBUG: {contract.symbol} - Final Multiplier (type {type(multiplier)}): {multiplier}")
+
+        return {
+            'last': last_price,
+            'bid': bid_price,
+            'ask': ask_price,
+            'close': close_price,
+            'best_market_price': best_market_price,
+            'multiplier': multiplier
+        }
+
+    async def get_market_data_for_contracts_async(self, contracts, timeout=None):
         """
-        Attempts to connect to Interactive Brokers.
-        Displays connection status in the chat_output.
+        Gets market data (last, bid, ask, close) for several contracts in one batch.
+        Quotes already held by the quote store are served from memory. The
+        remaining contracts are qualified in a single call and subscribed all at
+        once; the method returns as soon as every new ticker is filled or the
+        shared deadline passes, so the cost is at most one round-trip.
+
+        Args:
+            contracts (list[Contract]): The ib_insync Contract objects.
+            timeout (float, optional): Shared deadline in seconds for all new quotes.
+                                       Defaults to config.MARKET_DATA_TIMEOUT.
+
+        Returns:
+            list[dict]: One dictionary per input contract (same order) containing
+                        'last', 'bid', 'ask', 'close' (float or None),
+                        'best_market_price' (float or 'N/A') and 'multiplier' (float).
+                        Concurrent callers asking for the same contracts share
+                        the result, so it must not be modified.
         """
+        contracts = list(contracts)
+        if not contracts:
+            return []
+        key = ('market_data', tuple(c.conId or repr(c) for c in contracts), timeout)
+        return await self._single_flight.do(key, lambda: self._fetch_market_data_for_contracts(contracts, timeout))
+
+    async def _fetch_market_data_for_contracts(self, contracts, timeout):
+        """Fetches a batch of market data; see get_market_data_for_contracts_async."""
+        if timeout is None:
+            timeout = config.MARKET_DATA_TIMEOUT
+
+        if not self.session.ensure_connected():
+            print("DEBUG: IB not connected, reconnect runs in the background.")
+            return [self._empty_market_data() for _ in contracts]
+
+        results = [self._empty_market_data() for _ in contracts]
         try:
-            client_id = random.randint(1, 1000) # Generate a random client ID
-            # Use a short timeout for the initial connection attempt
-            self.ib.connect(host='127.0.0.1', port=7497, clientId=client_id, timeout=5)
-            self.chat_output.setText(f"Connected to Interactive Brokers with Client ID: {client_id}.")
+            cached = [self.quote_store.get(c) for c in contracts]
+            misses = [c for c, hit in zip(contracts, cached) if hit is None]
+            print(f"DEBUG: Quote store: {len(contracts) - len(misses)} hits, {len(misses)} misses.")
+
+            # Released quotes are served from memory now and resubscribed for the next access
+            for contract, hit in zip(contracts, cached):
+                if hit is not None and not self.quote_store.is_streaming(hit[0]):
+                    await get_request_scheduler().acquire(MARKET_DATA)
+                    self.quote_store.subscribe([hit[0]])
+
+            requested = {} # id(contract) -> ticker_data
+            if misses:
+                # IMPORTANT: Qualify the contracts to ensure multiplier is populated for options.
+                # The contract cache fills the contracts in place (asking IB only for unknown conIds)
+                # and returns only the successful ones.
+                qualified_contracts = await self.contract_cache.qualify_async(self.ib, misses)
+                tickers = []
+                for contract in qualified_contracts:
+                    await get_request_scheduler().acquire(MARKET_DATA)
+                    tickers.extend(self.quote_store.subscribe([contract]))
+                requested = {id(c): t for c, t in zip(qualified_contracts, tickers)}
+
+                # Wait for all new quotes together, bounded by one shared deadline
+                deadline = time.monotonic() + timeout
+                while not all(_ticker_filled(t) for t in requested.values()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        print(f"DEBUG: Market data deadline ({timeout}s) reached, using what has arrived.")
+                        break
+                    try:
+                        await asyncio.wait_for(self.ib.updateEvent, remaining)
+                    except asyncio.TimeoutError:
+                        pass
+
+            for i, (contract, hit) in enumerate(zip(contracts, cached)):
+                if hit is not None:
+                    qualified_contract, ticker_data = hit
+                elif id(contract) in requested:
+                    qualified_contract, ticker_data = contract, requested[id(contract)]
+                else:
+                    print(f"DEBUG: Failed to qualify contract {contract.symbol}. No qualified contracts returned.")
+                    continue
+                results[i] = self._extract_market_data(contract, qualified_contract, ticker_data)
         except Exception as e:
-            error_message = (
-                f"ERROR: Could not connect to IB. Ensure TWS/Gateway is running on port 7497 "
-                f"(or your configured port). Error: {e}"
-            )
-            self.chat_output.setText(error_message)
-            print(error_message) # Also print to console for debugging
+            print(f"Failed to get market data for batch of {len(contracts)} contracts: {e}")
+            self.chat_output.append(f"Chyba při získávání tržních dat: {e}")
 
-    def is_connected(self):
-        """Checks if the IB connection is active."""
-        return self.ib.isConnected()
+        return results
+
+    def get_market_data_for_contracts(self, contracts, timeout=None):
+        """
+        Gets market data for several contracts in one batch (blocking).
+        See get_market_data_for_contracts_async.
+        """
+        return util.run(self.get_market_data_for_contracts_async(contracts, timeout))
 
     def get_market_data_for_contract(self, contract):
         """
@@ -55,346 +395,387 @@ class IBManager:
                   'best_market_price' (float or 'N/A' for general market value),
                   and 'multiplier' (float, defaults to 1.0).
         """
-        if not self.is_connected():
-            self.chat_output.append("Attempting to reconnect to IB for market data...")
-            self._connect_to_ib() # Try to reconnect
-            if not self.is_connected():
-                print("DEBUG: Still not connected after reconnect attempt.")
-                return {'last': None, 'bid': None, 'ask': None, 'close': None, 'best_market_price': 'N/A', 'multiplier': 1.0}
+        return self.get_market_data_for_contracts([contract])[0]
 
-        try:
-            # IMPORTANT: Qualify the contract to ensure multiplier is populated for options
-            qualified_contracts = self.ib.qualifyContracts(contract)
-            if not qualified_contracts:
-                print(f"DEBUG: Failed to qualify contract {contract.symbol}. No qualified contracts returned.")
-                return {'last': None, 'bid': None, 'ask': None, 'close': None, 'best_market_price': 'N/A', 'multiplier': 1.0}
-            qualified_contract = qualified_contracts[0]
-            
-            ticker_data = self.ib.reqMktData(qualified_contract, '', True, False)
-            self.ib.sleep(1.0) # Increased sleep time to give more opportunity for market data to arrive.
-
-            # Extract all relevant prices and handle NaN explicitly
-            last_price = ticker_data.last if ticker_data.last is not None and not math.isnan(ticker_data.last) else None
-            bid_price = ticker_data.bid if ticker_data.bid is not None and not math.isnan(ticker_data.bid) else None
-            ask_price = ticker_data.ask if ticker_data.ask is not None and not math.isnan(ticker_data.ask) else None
-            close_price = ticker_data.close if ticker_data.close is not None and not math.isnan(ticker_data.close) else None
-
-            # Determine the 'best_market_price' for general display/market value
-            # Prioritizing Last -> Mid -> Bid -> Ask -> Close
-            best_market_price = 'N/A'
-            if last_price is not None and last_price != 0.0:
-                best_market_price = last_price
-            elif bid_price is not None and ask_price is not None and bid_price != 0.0 and ask_price != 0.0:
-                best_market_price = (bid_price + ask_price) / 2
-            elif bid_price is not None and bid_price != 0.0:
-                best_market_price = bid_price
-            elif ask_price is not None and ask_price != 0.0:
-                best_market_price = ask_price
-            elif close_price is not None and close_price != 0.0:
-                best_market_price = close_price
-            
-            print(f"DEBUG: {contract.symbol} - Fetched market data: Last={last_price}, Bid={bid_price}, Ask={ask_price}, Close={close_price}, Best={best_market_price}")
-
-            self.ib.cancelMktData(qualified_contract) # Crucial to cancel subscriptions
-
-            # Explicitly convert multiplier to float to prevent TypeError
-            multiplier = 1.0 # Default to 1.0 (float)
-            if hasattr(qualified_contract, 'multiplier') and qualified_contract.multiplier is not None:
-                try:
-                    multiplier = float(qualified_contract.multiplier)
-                except ValueError:
-                    print(f"WARNING: Multiplier for {contract.symbol} is not a valid number: {qualified_contract.multiplier}. Defaulting to 1.0.")
-                    multiplier = 1.0
-            print(f"DEBUG: {contract.symbol} - Final Multiplier (type {type(multiplier)}): {multiplier}")
-
-            return {
-                'last': last_price,
-                'bid': bid_price,
-                'ask': ask_price,
-                'close': close_price,
-                'best_market_price': best_market_price,
-                'multiplier': multiplier
-            }
-        except Exception as e:
-            print(f"Failed to get market data for {contract.symbol}: {e}")
-            self.chat_output.append(f"Chyba při získávání tržních dat pro {contract.symbol}: {e}")
-            return {'last': None, 'bid': None, 'ask': None, 'close': None, 'best_market_price': 'N/A', 'multiplier': 1.0}
-
-    def load_live_positions(self, ticker, ib_live_positions_table, ib_live_positions_label):
+    async def get_position_snapshot_async(self, ticker):
         """
-        Loads and displays live open positions from IB for a specific ticker.
+        Takes the live IB positions for a ticker from the position book and
+        fetches their quotes (plus the underlying's quote if the strategy has
+        no stock leg) in one batched market data request; computes market
+        value, unrealized PnL, IV and greeks per leg and in total.
 
         Args:
             ticker (str): The ticker symbol to filter positions by.
-            ib_live_positions_table (QTableWidget): The table widget to populate.
-            ib_live_positions_label (QLabel): The label to update with status.
+
+        Returns:
+            dict or None: None if IB is not connected, otherwise
+                  {'ticker': str,
+                   'legs': list of dicts with 'contract', 'position', 'avgCost',
+                           'marketValue', 'unrealizedPnl', 'iv', 'delta' (per unit),
+                           'positionDelta' (in shares), 'gamma', 'theta' and 'vega'
+                           (float or "N/A"),
+                   'underlying_price': float or "N/A",
+                   'total_market_value': float,
+                   'total_unrealized_pnl': float,
+                   'total_delta': float or "N/A" (N/A if a leg's delta is unknown)}
         """
-        if not self.is_connected():
-            ib_live_positions_table.setRowCount(1)
-            ib_live_positions_table.setItem(0, 0, QTableWidgetItem("IB není připojeno."))
-            ib_live_positions_table.setSpan(0, 0, 1, ib_live_positions_table.columnCount())
-            ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: IB odpojeno')
-            print("DEBUG: load_live_positions: IB not connected.")
+        return await self._single_flight.do(('position_snapshot', ticker), lambda: self._fetch_position_snapshot(ticker))
+
+    async def _fetch_position_snapshot(self, ticker):
+        """Builds a position snapshot; see get_position_snapshot_async."""
+        if not self.session.ensure_connected():
+            print("DEBUG: get_position_snapshot_async: IB not connected.")
+            return None
+
+        positions_for_ticker = self.position_book.positions_for(ticker)
+        print(f"DEBUG: get_position_snapshot: Found {len(positions_for_ticker)} IB positions for ticker {ticker}.")
+
+        # Pin the legs in view and fetch market data for all legs in one batch
+        leg_contracts = [p.contract for p in positions_for_ticker]
+        underlying_contract = await self._underlying_contract_async(ticker, leg_contracts)
+        view = leg_contracts + ([underlying_contract] if underlying_contract is not None else [])
+        self.quote_store.set_view(view)
+        market_data_batch = await self.get_market_data_for_contracts_async(view)
+        underlying_data = market_data_batch[len(leg_contracts)] if underlying_contract is not None else None
+
+        return self._build_position_snapshot(ticker, positions_for_ticker, market_data_batch[:len(leg_contracts)], underlying_data)
+
+    def get_position_snapshot(self, ticker):
+        """Blocking variant of get_position_snapshot_async."""
+        return util.run(self.get_position_snapshot_async(ticker))
+
+    async def get_portfolio_snapshot_async(self, tickers):
+        """
+        Builds position snapshots for several strategies at once. The legs of
+        all strategies (and the underlyings needed for the greeks) are fetched
+        in a single batched market data request instead of one detail load
+        per strategy.
+
+        Args:
+            tickers (list[str]): Underlying symbols of the strategies.
+
+        Returns:
+            dict or None: None if IB is not connected, otherwise
+                  {'strategies': list of position snapshots (see get_position_snapshot_async),
+                                 each with an added 'dollar_delta' (delta * underlying price),
+                   'total_market_value': float,
+                   'total_unrealized_pnl': float,
+                   'total_dollar_delta': float or "N/A"}
+                  Share deltas of different underlyings cannot be added, so the
+                  portfolio delta is expressed in dollars.
+        """
+        tickers = list(tickers)
+        return await self._single_flight.do(('portfolio_snapshot', tuple(tickers)), lambda: self._fetch_portfolio_snapshot(tickers))
+
+    async def _fetch_portfolio_snapshot(self, tickers):
+        """Builds the portfolio snapshot; see get_portfolio_snapshot_async."""
+        if not self.session.ensure_connected():
+            print("DEBUG: get_portfolio_snapshot_async: IB not connected.")
+            return None
+
+        # One flat contract list; each strategy remembers its slice of it
+        batch = []
+        layout = [] # (ticker, positions, leg slice, underlying index or None)
+        for ticker in tickers:
+            positions = self.position_book.positions_for(ticker)
+            leg_contracts = [p.contract for p in positions]
+            legs = slice(len(batch), len(batch) + len(leg_contracts))
+            batch.extend(leg_contracts)
+            underlying_contract = await self._underlying_contract_async(ticker, leg_contracts)
+            underlying_index = None
+            if underlying_contract is not None:
+                underlying_index = len(batch)
+                batch.append(underlying_contract)
+            layout.append((ticker, positions, legs, underlying_index))
+
+        print(f"DEBUG: get_portfolio_snapshot: {len(tickers)} strategies, {len(batch)} contracts in one batch.")
+        self.quote_store.set_view(batch)
+        market_data_batch = await self.get_market_data_for_contracts_async(batch)
+
+        strategies = []
+        for ticker, positions, legs, underlying_index in layout:
+            underlying_data = market_data_batch[underlying_index] if underlying_index is not None else None
+            snapshot = self._build_position_snapshot(ticker, positions, market_data_batch[legs], underlying_data)
+            if isinstance(snapshot['total_delta'], float) and isinstance(snapshot['underlying_price'], (float, int)):
+                snapshot['dollar_delta'] = snapshot['total_delta'] * snapshot['underlying_price']
+            else:
+                snapshot['dollar_delta'] = "N/A"
+            strategies.append(snapshot)
+
+        dollar_deltas = [s['dollar_delta'] for s in strategies if s['legs']]
+        return {
+            'strategies': strategies,
+            'total_market_value': sum(s['total_market_value'] for s in strategies),
+            'total_unrealized_pnl': sum(s['total_unrealized_pnl'] for s in strategies),
+            'total_dollar_delta': sum(dollar_deltas) if all(isinstance(d, float) for d in dollar_deltas) else "N/A"
+        }
+
+    async def _underlying_contract_async(self, ticker, leg_contracts):
+        """
+        Returns the qualified underlying contract whose quote is needed for the
+        option greeks: the stock for stock options, the future for options on
+        futures (that of the first FOP leg). None if the strategy has no options
+        or already holds the underlying. The contract comes from the contract
+        cache, so it has the same conId on every call and its quote is served
+        by the quote store.
+        """
+        sec_types = {c.secType for c in leg_contracts}
+        if 'OPT' in sec_types and 'STK' not in sec_types:
+            return await self.contract_cache.qualify_stock_async(self.ib, ticker)
+        if 'FOP' in sec_types and 'FUT' not in sec_types:
+            option = next(c for c in leg_contracts if c.secType == 'FOP')
+            return await self.contract_cache.qualify_underlying_async(self.ib, option)
+        return None
+
+    @staticmethod
+    def _underlying_price(market_data):
+        """Underlying price for the greeks: Mid, falling back to the best market price."""
+        if market_data is None:
+            return None
+        bid, ask = market_data['bid'], market_data['ask']
+        if bid and ask: # Both present and non-zero
+            return (bid + ask) / 2
+        best_market_price = market_data['best_market_price']
+        return best_market_price if isinstance(best_market_price, (float, int)) else None
+
+    def _compute_leg_greeks(self, positions_for_ticker, market_data_batch, values, underlying_data):
+        """
+        Solves IV and greeks of all option legs in one call of the greeks engine;
+        options on futures (FOP) are priced with Black-76. Stock and futures
+        legs have delta 1; legs of other types stay NaN.
+
+        Returns:
+            tuple: (dict of 'iv', 'delta', 'gamma', 'theta', 'vega' arrays, underlying price or None)
+        """
+        contracts = [p.contract for p in positions_for_ticker]
+        if underlying_data is None:
+            # The strategy holds the stock or future itself; its quote is in the batch
+            underlying_data = next((m for c, m in zip(contracts, market_data_batch) if c.secType in ('STK', 'FUT')), None)
+        underlying_price = self._underlying_price(underlying_data)
+
+        greeks = greeks_engine.compute_option_greeks(
+            price=values['pnl_price'],
+            spot=underlying_price if underlying_price is not None else np.nan,
+            strike=pnl_engine.to_float_array([c.strike for c in contracts]),
+            years=greeks_engine.years_to_expiry([c.lastTradeDateOrContractMonth for c in contracts]),
+            is_call=np.array([c.right in ('C', 'CALL') for c in contracts], dtype=bool),
+            rate=config.RISK_FREE_RATE,
+            is_future=np.array([c.secType == 'FOP' for c in contracts], dtype=bool)
+        )
+        is_option = np.array([c.secType in ('OPT', 'FOP') for c in contracts], dtype=bool)
+        is_underlying = np.array([c.secType in ('STK', 'FUT') for c in contracts], dtype=bool)
+        for name in ('iv', 'delta', 'gamma', 'theta', 'vega'):
+            greeks[name] = np.where(is_option, greeks[name], np.nan)
+        greeks['delta'] = np.where(is_underlying, 1.0, greeks['delta'])
+        return greeks, underlying_price
+
+    def _build_position_snapshot(self, ticker, positions_for_ticker, market_data_batch, underlying_data=None):
+        """
+        Computes market value, unrealized PnL, IV and greeks per leg and in total.
+
+        Args:
+            ticker (str): The ticker symbol.
+            positions_for_ticker (list[Position]): The IB positions of the ticker.
+            market_data_batch (list[dict]): Market data for each position (same order).
+            underlying_data (dict, optional): Market data of the underlying (stock or
+                                              future) if it is not one of the positions.
+
+        Returns:
+            dict: The position snapshot (see get_position_snapshot_async).
+        """
+        values = pnl_engine.compute_position_values(
+            quantity=pnl_engine.to_float_array([p.position for p in positions_for_ticker]),
+            avg_cost=pnl_engine.to_float_array([p.avgCost for p in positions_for_ticker]),
+            bid=pnl_engine.to_float_array([m['bid'] for m in market_data_batch]),
+            ask=pnl_engine.to_float_array([m['ask'] for m in market_data_batch]),
+            last=pnl_engine.to_float_array([m['last'] for m in market_data_batch]),
+            close=pnl_engine.to_float_array([m['close'] for m in market_data_batch]),
+            multiplier=pnl_engine.to_float_array([m['multiplier'] for m in market_data_batch])
+        )
+        snapshot_totals = pnl_engine.totals(values)
+
+        greeks, underlying_price = self._compute_leg_greeks(positions_for_ticker, market_data_batch, values, underlying_data)
+        # Share-equivalent delta of each leg
+        position_delta = greeks['delta'] * np.nan_to_num(pnl_engine.to_float_array([p.position for p in positions_for_ticker])) \
+            * pnl_engine.to_float_array([m['multiplier'] for m in market_data_batch])
+
+        legs = []
+        for i, p in enumerate(positions_for_ticker):
+            legs.append({
+                'contract': p.contract,
+                'position': p.position, # Keep original p.position for table display
+                'avgCost': p.avgCost, # Keep original avgCost for table display
+                'marketValue': _nan_to_na(values['market_value'][i]),
+                'unrealizedPnl': _nan_to_na(values['unrealized_pnl'][i]),
+                'iv': _nan_to_na(greeks['iv'][i]),
+                'delta': _nan_to_na(greeks['delta'][i]),
+                'positionDelta': _nan_to_na(position_delta[i]),
+                'gamma': _nan_to_na(greeks['gamma'][i]),
+                'theta': _nan_to_na(greeks['theta'][i]),
+                'vega': _nan_to_na(greeks['vega'][i])
+            })
+            print(f"DEBUG: {p.contract.symbol} {p.contract.secType} {p.contract.right} {p.contract.strike}: "
+                  f"Position={p.position}, AvgCost={p.avgCost}, Market Value={legs[-1]['marketValue']}, "
+                  f"Unrealized PnL={legs[-1]['unrealizedPnl']}, IV={legs[-1]['iv']}, Delta={legs[-1]['delta']}")
+
+        # A strategy delta missing a leg would be misleading, so it is N/A then
+        total_delta = float(position_delta.sum()) if len(legs) and not np.isnan(position_delta).any() else "N/A"
+
+        return {
+            'ticker': ticker,
+            'legs': legs,
+            'underlying_price': underlying_price if underlying_price is not None else "N/A",
+            'total_market_value': snapshot_totals['market_value'],
+            'total_unrealized_pnl': snapshot_totals['unrealized_pnl'],
+            'total_delta': total_delta
+        }
+
+    def get_iv_history(self, ticker):
+        """Reads the stored IV history of a ticker from disk (no IB request)."""
+        return self.iv_history.get_history(ticker)
+
+    async def backfill_iv_history_async(self, ticker):
+        """
+        Downloads only the days missing from the stored IV history of a ticker.
+
+        Returns:
+            list[tuple] or None: The updated history (see IVHistoryStore.get_history),
+                                 or None if IB is not connected.
+        """
+        if not self.session.ensure_connected():
+            print("DEBUG: backfill_iv_history_async: IB not connected.")
+            return None
+        await self._single_flight.do(('iv_history', ticker), lambda: self.iv_history.backfill_async(self.ib, ticker))
+        return self.iv_history.get_history(ticker)
+
+    @staticmethod
+    def render_iv_history(ticker, history, iv_history_label):
+        """
+        Displays the last IV, its range over the stored period and the last historical volatility.
+
+        Args:
+            ticker (str): The ticker symbol.
+            history (list[tuple]): Rows from get_iv_history.
+            iv_history_label (QLabel): The label to update.
+        """
+        implied = [iv for _, iv, _ in history if iv is not None]
+        historical = [hv for _, _, hv in history if hv is not None]
+        if not implied:
+            iv_history_label.setText(f'Historická IV ({ticker}, {config.IV_HISTORY_DAYS} dní): N/A')
             return
+        text = (f'Historická IV ({ticker}, {config.IV_HISTORY_DAYS} dní): poslední {implied[-1] * 100:.1f} %, '
+                f'průměr {sum(implied) / len(implied) * 100:.1f} %, '
+                f'min {min(implied) * 100:.1f} %, max {max(implied) * 100:.1f} %')
+        if historical:
+            text += f'; HV {historical[-1] * 100:.1f} %'
+        iv_history_label.setText(text)
+
+    def load_position_detail(self, ticker, ib_live_positions_table, ib_live_positions_label, current_pnl_label):
+        """
+        Loads live positions for a ticker once and feeds both the live positions
+        table and the unrealized PnL label from the same snapshot (blocking).
 
-        ib_live_positions_table.setRowCount(0) # Clear previous data
-        ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: Načítám...')
+        Args:
+            ticker (str): The ticker symbol to filter positions by.
+            ib_live_positions_table (QTableView): The table view with a LivePositionsModel.
+            ib_live_positions_label (QLabel): The label to update with status.
+            current_pnl_label (QLabel, optional): The QLabel to update with the PnL.
+
+        Returns:
+            dict or None: The position snapshot, or None if it could not be loaded.
+        """
+        self.show_position_detail_loading(ticker, ib_live_positions_table, ib_live_positions_label, current_pnl_label)
         QApplication.processEvents() # Update UI immediately to show "Načítám..."
 
         try:
-            ib_all_open_positions = self.ib.reqPositions()
-            self.ib.sleep(0.1) # Give IB a moment to send the positions
-
-            positions_for_ticker = [p for p in ib_all_open_positions if p.contract.symbol == ticker]
-            print(f"DEBUG: load_live_positions: Found {len(positions_for_ticker)} IB positions for ticker {ticker}.")
-
-            if not positions_for_ticker:
-                ib_live_positions_table.setRowCount(1)
-                ib_live_positions_table.setItem(0, 0, QTableWidgetItem(f"Žádné živé pozice z IB pro {ticker}."))
-                ib_live_positions_table.setSpan(0, 0, 1, ib_live_positions_table.columnCount())
-                ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: (Žádné)')
-                print(f"DEBUG: load_live_positions: No live IB positions found for {ticker}.")
-                return
-
-            ib_live_positions_table.setRowCount(len(positions_for_ticker))
-
-            processed_positions_data = []
-
-            for i, p in enumerate(positions_for_ticker):
-                contract = p.contract
-                print(f"\nDEBUG: Processing IB position {i+1}/{len(positions_for_ticker)}:")
-                print(f"  Contract: {contract.symbol} ({contract.secType}) - {contract.right} {contract.strike}")
-                print(f"  Raw Position: {p.position}, Raw AvgCost: {p.avgCost}")
-                
-                market_value = "N/A"
-                unrealized_pnl = "N/A"
-                
-                # Get comprehensive market data
-                market_data = self.get_market_data_for_contract(contract)
-                # Define current_market_price here for use in this function
-                current_market_price = market_data['best_market_price'] 
-                print(f"  DEBUG: Market data for {contract.symbol}: {market_data}") # Updated print
-                
-                # Get multiplier for options, default to 1.0 for stocks/futures
-                multiplier = market_data['multiplier'] # Now guaranteed to be a float
-                print(f"  Contract Multiplier (from market_data): {multiplier}")
-
-
-                # Ensure avgCost is a number for calculation
-                avg_cost_for_calc = p.avgCost if p.avgCost is not None else 0.0
-                if not isinstance(avg_cost_for_calc, (float, int)):
-                    print(f"  WARNING: p.avgCost is not a number for {contract.symbol} ({p.avgCost}). Using 0.0 for calculation.")
-                    avg_cost_for_calc = 0.0
-
-                # Ensure position is a number for calculation
-                position_qty_for_calc = p.position if p.position is not None else 0.0
-                if not isinstance(position_qty_for_calc, (float, int)):
-                    print(f"  WARNING: p.position is not a number for {contract.symbol} ({p.position}). Using 0.0 for calculation.")
-                    position_qty_for_calc = 0.0
-
-
-                # Determine the 'closing price' per share for PnL calculation
-                pnl_calculation_price_per_share = None
-                
-                # Prioritize Mid -> Last -> Best_market_price for PnL calculation
-                if market_data['bid'] is not None and market_data['ask'] is not None and \
-                   market_data['bid'] != 0.0 and market_data['ask'] != 0.0:
-                    pnl_calculation_price_per_share = (market_data['bid'] + market_data['ask']) / 2
-                    print(f"  DEBUG: PnL Price per share (preferring Mid): {pnl_calculation_price_per_share}")
-                elif market_data['last'] is not None and market_data['last'] != 0.0:
-                    pnl_calculation_price_per_share = market_data['last']
-                    print(f"  DEBUG: PnL Price per share (Mid not available, falling back to Last): {pnl_calculation_price_per_share}")
-                elif isinstance(market_data['best_market_price'], (float, int)):
-                    pnl_calculation_price_per_share = market_data['best_market_price']
-                    print(f"  DEBUG: PnL Price per share (Last not available, falling back to Best Market Price): {pnl_calculation_price_per_share}")
-                else:
-                    print(f"  DEBUG: No valid PnL calculation price found for {contract.symbol}. All fallbacks failed.")
-                
-                
-                if position_qty_for_calc > 0: # Long position (bought asset)
-                    if isinstance(pnl_calculation_price_per_share, (float, int)):
-                        # PnL for long position: (Current Value per contract - Initial Cost per contract) * number of contracts
-                        unrealized_pnl = ((pnl_calculation_price_per_share * multiplier) - avg_cost_for_calc) * position_qty_for_calc
-                        print(f"  Calculated Unrealized PnL (Long): {unrealized_pnl:.2f}")
-                    else:
-                        print(f"  WARNING: PnL calculation price per share for Long {contract.symbol} is not a number: {pnl_calculation_price_per_share}")
-
-                elif position_qty_for_calc < 0: # Short position (sold asset)
-                    if isinstance(pnl_calculation_price_per_share, (float, int)):
-                        # PnL for short position: (Initial Credit per contract - Current Cost to Close per contract) * number of contracts
-                        # Opraveno: Multiplikátor se aplikuje na celý rozdíl, nikoli jen na aktuální cenu
-                        unrealized_pnl = (avg_cost_for_calc - pnl_calculation_price_per_share) * abs(position_qty_for_calc) * multiplier
-                        print(f"  Calculated Unrealized PnL (Short): {unrealized_pnl:.2f}")
-                    else:
-                        print(f"  WARNING: PnL calculation price per share for Short {contract.symbol} is not a number: {pnl_calculation_price_per_share}")
-                else: # Position is 0
-                    unrealized_pnl = 0.0
-                
-                # --- Market Value Calculation ---
-                if isinstance(current_market_price, (float, int)) and position_qty_for_calc is not None:
-                    market_value = current_market_price * position_qty_for_calc * multiplier # Apply multiplier to market value too
-                    print(f"  Calculated Market Value: {market_value:.2f}")
-                else:
-                    print(f"  Skipping Market Value calculation: current_market_price ({current_market_price}) not float/int or position ({position_qty_for_calc}) is None.")
-                    market_value = "N/A" # Ensure it remains N/A if not calculable
-
-
-                processed_positions_data.append({
-                    'contract': contract,
-                    'position': p.position, # Keep original p.position for table display
-                    'avgCost': p.avgCost, # Keep original avgCost for table display
-                    'marketValue': market_value,
-                    'unrealizedPnl': unrealized_pnl
-                })
-            
-            for i, data in enumerate(processed_positions_data):
-                self._populate_live_position_row(i, data, ib_live_positions_table)
-
-            ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}:') # Update label after loading
+            snapshot = self.get_position_snapshot(ticker)
         except Exception as e:
-            ib_live_positions_table.setRowCount(1)
-            ib_live_positions_table.setItem(0, 0, QTableWidgetItem(f"Chyba při načítání živých pozic: {e}"))
-            ib_live_positions_table.setSpan(0, 0, 1, ib_live_positions_table.columnCount())
-            ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: Chyba')
-            self.chat_output.append(f"Chyba v IBManager.load_live_positions: {e}")
-            print(f"DEBUG: Exception in load_live_positions: {e}")
+            self.show_position_detail_error(ticker, e, ib_live_positions_table, ib_live_positions_label, current_pnl_label)
+            return None
 
+        self.render_position_detail(ticker, snapshot, ib_live_positions_table, ib_live_positions_label, current_pnl_label)
+        return snapshot
 
-    def _populate_live_position_row(self, row_index, data, ib_live_positions_table):
+    def show_position_detail_loading(self, ticker, ib_live_positions_table, ib_live_positions_label, current_pnl_label):
+        """Shows the loading state of the position detail widgets."""
+        ib_live_positions_table.model().clear() # Clear previous data
+        ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: Načítám...')
+        if current_pnl_label is not None:
+            current_pnl_label.setText(f'Aktuální PnL ({ticker}): Načítám...')
+
+    def show_position_detail_error(self, ticker, error, ib_live_positions_table, ib_live_positions_label, current_pnl_label):
+        """Shows an error that occurred while loading the position detail."""
+        self._show_table_message(ib_live_positions_table, f"Chyba při načítání živých pozic: {error}")
+        ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: Chyba')
+        if current_pnl_label is not None:
+            current_pnl_label.setText(f'Aktuální PnL ({ticker}): Chyba') # Display "Chyba"
+        self.chat_output.append(f"Chyba v IBManager při načítání živých pozic: {error}")
+        print(f"DEBUG: Exception while loading position detail: {error}")
+
+    def render_position_detail(self, ticker, snapshot, ib_live_positions_table, ib_live_positions_label, current_pnl_label):
         """
-        Helper to populate a single row in the live positions table.
+        Feeds the live positions table and the PnL label from one snapshot.
+        A snapshot of None means IB is not connected.
+        """
+        if snapshot is None:
+            self._show_table_message(ib_live_positions_table, "IB není připojeno.")
+            ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: IB odpojeno')
+            if current_pnl_label is not None:
+                current_pnl_label.setText('Aktuální PnL (Otevřené pozice): IB odpojeno')
+            return
+
+        self.render_live_positions(snapshot, ib_live_positions_table, ib_live_positions_label)
+        if current_pnl_label is not None:
+            self.render_unrealized_pnl(snapshot, current_pnl_label)
+
+    def render_live_positions(self, snapshot, ib_live_positions_table, ib_live_positions_label):
+        """
+        Displays the legs of a position snapshot in the live positions table.
 
         Args:
-            row_index (int): The row index in the table.
-            data (dict): Dictionary containing position data.
-            ib_live_positions_table (QTableWidget): The table widget to populate.
-        """
-        contract = data['contract']
-        position_qty = data['position']
-        avg_cost = data['avgCost']
-        market_value = data['marketValue']
-        unrealized_pnl = data['unrealizedPnl']
-
-        symbol_item = QTableWidgetItem(contract.symbol)
-        sec_type_item = QTableWidgetItem(contract.secType)
-        right_item = QTableWidgetItem(contract.right if contract.secType == "OPT" else "")
-        strike_item = QTableWidgetItem(str(contract.strike) if contract.secType == "OPT" else "")
-        position_item = QTableWidgetItem(str(position_qty))
-        
-        # Format numerical values to 2 decimal places, keep "N/A" for others
-        market_value_item = QTableWidgetItem(f"{market_value:.2f}" if isinstance(market_value, float) else str(market_value))
-        avg_cost_item = QTableWidgetItem(f"{avg_cost:.2f}" if isinstance(avg_cost, float) else "N/A")
-        unrealized_pnl_item = QTableWidgetItem(f"{unrealized_pnl:.2f}" if isinstance(unrealized_pnl, float) else str(unrealized_pnl))
-
-        ib_live_positions_table.setItem(row_index, 0, symbol_item)
-        ib_live_positions_table.setItem(row_index, 1, sec_type_item)
-        ib_live_positions_table.setItem(row_index, 2, right_item)
-        ib_live_positions_table.setItem(row_index, 3, strike_item)
-        ib_live_positions_table.setItem(row_index, 4, position_item)
-        ib_live_positions_table.setItem(row_index, 5, market_value_item)
-        ib_live_positions_table.setItem(row_index, 6, avg_cost_item)
-        ib_live_positions_table.setItem(row_index, 7, unrealized_pnl_item)
-
-
-    def calculate_current_unrealized_pnl(self, ticker, current_pnl_label):
-        """
-        Calculates and updates the current unrealized PnL for a given ticker
-        from live IB positions.
+            snapshot (dict): The snapshot returned by get_position_snapshot.
+            ib_live_positions_table (QTableView): The table view with a LivePositionsModel.
+            ib_live_positions_label (QLabel): The label to update with status.
+        """
+        ticker = snapshot['ticker']
+        legs = snapshot['legs']
+        if not legs:
+            self._show_table_message(ib_live_positions_table, f"Žádné živé pozice z IB pro {ticker}.")
+            ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: (Žádné)')
+            print(f"DEBUG: render_live_positions: No live IB positions found for {ticker}.")
+            return
+
+        # The model formats the cells of the visible rows on demand
+        ib_live_positions_table.clearSpans()
+        ib_live_positions_table.model().set_rows(legs)
+
+        total_delta = snapshot['total_delta']
+        delta_display = f"{total_delta:.2f}" if isinstance(total_delta, float) else total_delta
+        ib_live_positions_label.setText(f'Detailní živé pozice z IB pro {ticker}: (Delta pozice: {delta_display})') # Update label after loading
+
+    def render_unrealized_pnl(self, snapshot, current_pnl_label):
+        """
+        Displays the total unrealized PnL of a position snapshot.
 
         Args:
-            ticker (str): The ticker symbol.
+            snapshot (dict): The snapshot returned by get_position_snapshot.
             current_pnl_label (QLabel): The QLabel to update with the PnL.
         """
-        current_unrealized_pnl_total = 0.0
-        if not self.is_connected():
-            current_pnl_label.setText('Aktuální PnL (Otevřené pozice): IB odpojeno')
-            print("DEBUG: calculate_current_unrealized_pnl: IB not connected.")
-            return
+        current_pnl_label.setText(f"Aktuální PnL ({snapshot['ticker']}): {snapshot['total_unrealized_pnl']:.2f} USD")
 
-        current_pnl_label.setText(f'Aktuální PnL ({ticker}): Načítám...')
-        QApplication.processEvents()
+    @staticmethod
+    def _show_table_message(table, message):
+        """Shows a single spanning message row in a table view backed by a RowTableModel."""
+        table.model().set_message(message)
+        table.setSpan(0, 0, 1, table.model().columnCount())
 
-        try:
-            ib_open_positions = self.ib.reqPositions()
-            self.ib.sleep(0.1)
-
-            positions_for_current_pnl = [p for p in ib_open_positions if p.contract.symbol == ticker]
-            print(f"DEBUG: calculate_current_unrealized_pnl: Found {len(positions_for_current_pnl)} IB positions for PnL for ticker {ticker}.")
-
-            for i, p in enumerate(positions_for_current_pnl):
-                print(f"  DEBUG: Calculating PnL for: {p.contract.symbol} - Position: {p.position}, AvgCost: {p.avgCost}")
-                
-                market_data = self.get_market_data_for_contract(p.contract)
-                # Define current_market_price here for use in this function
-                current_market_price = market_data['best_market_price'] 
-                print(f"  DEBUG: Market data for PnL {p.contract.symbol}: {market_data}")
-
-                # Get multiplier for options, default to 1.0 for stocks/futures
-                multiplier = market_data['multiplier'] # Now guaranteed to be a float
-                print(f"  Contract Multiplier: {multiplier}")
-
-
-                # Ensure avgCost is a number for calculation
-                # For options, p.avgCost often comes as the total cost per contract (Avg Price * Multiplier)
-                avg_cost_for_calc = p.avgCost if p.avgCost is not None else 0.0
-                if not isinstance(avg_cost_for_calc, (float, int)):
-                    print(f"  WARNING: p.avgCost is not a number for {p.contract.symbol} ({p.avgCost}). Using 0.0 for calculation.")
-                    avg_cost_for_calc = 0.0
-
-                # Ensure position is a number for calculation
-                position_qty_for_calc = p.position if p.position is not None else 0.0
-                if not isinstance(position_qty_for_calc, (float, int)):
-                    print(f"  WARNING: p.position is not a number for {p.contract.symbol} ({p.position}). Using 0.0 for calculation.")
-                    position_qty_for_calc = 0.0
-
-                # Determine the 'closing price' per share for PnL calculation based on position direction
-                pnl_calculation_price_per_share = None
-                unrealized_pnl_val = 0.0 # Default to 0
-                
-                # Prioritize Mid -> Last -> Best_market_price for PnL calculation
-                if market_data['bid'] is not None and market_data['ask'] is not None and \
-                   market_data['bid'] != 0.0 and market_data['ask'] != 0.0:
-                    pnl_calculation_price_per_share = (market_data['bid'] + market_data['ask']) / 2
-                    print(f"  DEBUG: PnL Price per share (preferring Mid): {pnl_calculation_price_per_share}")
-                elif market_data['last'] is not None and market_data['last'] != 0.0:
-                    pnl_calculation_price_per_share = market_data['last']
-                    print(f"  DEBUG: PnL Price per share (Mid not available, falling back to Last): {pnl_calculation_price_per_share}")
-                elif isinstance(current_market_price, (float, int)): # Fallback to best_market_price
-                     pnl_calculation_price_per_share = current_market_price
-                     print(f"  DEBUG: PnL Price per share (Last not available, falling back to Best Market Price): {pnl_calculation_price_per_share}")
-                else:
-                    print(f"  DEBUG: No valid PnL calculation price found for {p.contract.symbol}. All fallbacks failed.")
-                
-                
-                if position_qty_for_calc > 0: # Long position (bought asset)
-                    if isinstance(pnl_calculation_price_per_share, (float, int)):
-                        # PnL for long position: (Current Value per contract - Initial Cost per contract) * number of contracts
-                        unrealized_pnl_val = ((pnl_calculation_price_per_share * multiplier) - avg_cost_for_calc) * position_qty_for_calc
-                        print(f"  Calculated PnL (Long): {unrealized_pnl_val:.2f}")
-                    else:
-                        print(f"  WARNING: PnL calculation price per share for Long {p.contract.symbol} is not a number: {pnl_calculation_price_per_share}")
-
-                elif position_qty_for_calc < 0: # Short position (sold asset)
-                    if isinstance(pnl_calculation_price_per_share, (float, int)):
-                        # PnL for short position: (Initial Credit per contract - Current Cost to Close per contract) * number of contracts
-                        # Opraveno: Multiplikátor se aplikuje na celý rozdíl, nikoli jen na aktuální cenu
-                        unrealized_pnl_val = (avg_cost_for_calc - pnl_calculation_price_per_share) * abs(position_qty_for_calc) * multiplier
-                        print(f"  Calculated PnL (Short): {unrealized_pnl_val:.2f}")
-                    else:
-                        print(f"  WARNING: PnL calculation price per share for Short {p.contract.symbol} is not a number: {pnl_calculation_price_per_share}")
-                else: # Position is 0
-                    unrealized_pnl_val = 0.0
-                
-                current_unrealized_pnl_total += (unrealized_pnl_val if isinstance(unrealized_pnl_val, float) else 0.0)
-                print(f"  DEBUG: PnL component for {p.contract.symbol}: {unrealized_pnl_val:.2f}")
+    def load_live_positions(self, ticker, ib_live_positions_table, ib_live_positions_label):
+        """
+        Loads and displays live open positions from IB for a specific ticker.
 
-        except Exception as e:
-            print(f"Chyba při získávání tržních dat pro PnL {p.contract.symbol}: {e}")
-            self.chat_output.append(f"Chyba v IBManager.calculate_current_unrealized_pnl: {e}")
-            current_unrealized_pnl_total = "Chyba" # Indicate error to user
-            print(f"DEBUG: Exception in calculate_current_unrealized_pnl: {e}")
-
-        if isinstance(current_unrealized_pnl_total, float):
-            current_pnl_label.setText(f'Aktuální PnL ({ticker}): {current_unrealized_pnl_total:.2f} USD')
-        else:
-            current_pnl_label.setText(f'Aktuální PnL ({ticker}): {current_unrealized_pnl_total}') # Display "Chyba"
\ No newline at end of file
+        Args:
+            ticker (str): The ticker symbol to filter positions by.
+            ib_live_positions_table (QTableView): The table view with a LivePositionsModel.
+            ib_live_positions_label (QLabel): The label to update with status.
+        """
+        self.load_position_detail(ticker, ib_live_positions_table, ib_live_positions_label, None)
@@ -0,0 +1,174 @@
+# ib_session.py
+import asyncio
+from ib_insync import IB, util
+import config
+from request_scheduler import get_request_scheduler, GENERAL, HISTORICAL, BACKGROUND
+
+# IB error code sent when the requested client ID is already connected
+CLIENT_ID_IN_USE = 326
+# IB error codes of exceeded pacing limits
+MAX_MESSAGE_RATE_EXCEEDED = 100
+HISTORICAL_DATA_ERROR = 162 # Also used for other HMDS errors, see _on_error
+
+
+class IBSession:
+    """
+    Single managed connection to TWS/IB Gateway shared by all components.
+
+    Connection parameters come from config (IB_HOST, IB_PORT, IB_CLIENT_ID).
+    If the client ID is already in use, the next free one is tried. A lost
+    connection is re-established in the background with exponential backoff,
+    and a periodic health check detects connections that went silent.
+    """
+    def __init__(self, host=None, port=None, client_id=None):
+        """
+        Args:
+            host (str, optional): TWS host. Defaults to config.IB_HOST.
+            port (int, optional): TWS port. Defaults to config.IB_PORT.
+            client_id (int, optional): First client ID to try. Defaults to config.IB_CLIENT_ID.
+        """
+        self.ib = IB()
+        self.host = host or config.IB_HOST
+        self.port = port or config.IB_PORT
+        self.client_id = client_id or config.IB_CLIENT_ID
+        self.log = None # Optional widget with append() for status messages
+
+        self._closing = False
+        self._connecting = False
+        self._client_id_rejected = False
+        self._reconnect_task = None
+        self._health_task = None
+
+        self.ib.disconnectedEvent += self._on_disconnected
+        self.ib.errorEvent += self._on_error
+
+    def set_log(self, log):
+        """Sets the widget (QTextEdit or ThreadSafeLog) used for connection status messages."""
+        self.log = log
+
+    def _report(self, message):
+        print(message)
+        if self.log is not None:
+            self.log.append(message)
+
+    def is_connected(self):
+        """Checks if the IB connection is active."""
+        return self.ib.isConnected()
+
+    def connect(self):
+        """Connects synchronously (used once at startup). Returns True on success."""
+        return util.run(self.connect_async())
+
+    async def connect_async(self):
+        """
+        Connects to TWS, moving on to the next client ID if the current one is in use.
+
+        Returns:
+            bool: True if connected.
+        """
+        if self.is_connected():
+            return True
+        self._closing = False
+        self._connecting = True
+        try:
+            return await self._connect_with_free_client_id()
+        finally:
+            self._connecting = False
+
+    async def _connect_with_free_client_id(self):
+        for _ in range(config.IB_CLIENT_ID_ATTEMPTS):
+            self._client_id_rejected = False
+            try:
+                await self.ib.connectAsync(self.host, self.port, clientId=self.client_id, timeout=config.IB_CONNECT_TIMEOUT)
+                self._report(f"Connected to Interactive Brokers at {self.host}:{self.port} with Client ID: {self.client_id}.")
+                return True
+            except Exception as e:
+                if self._client_id_rejected:
+                    print(f"DEBUG: Client ID {self.client_id} is in use, trying {self.client_id + 1}.")
+                    self.client_id += 1
+                    continue
+                self._report(
+                    f"ERROR: Could not connect to IB. Ensure TWS/Gateway is running on "
+                    f"{self.host}:{self.port}. Error: {e}"
+                )
+                return False
+        self._report(f"ERROR: Could not connect to IB, no free client ID found after {config.IB_CLIENT_ID_ATTEMPTS} attempts.")
+        return False
+
+    def ensure_connected(self):
+        """
+        Returns True if connected. Otherwise starts a background reconnect
+        (if none is running) and returns False without blocking the caller.
+        """
+        if self.is_connected():
+            return True
+        self._schedule_reconnect()
+        return False
+
+    def disconnect(self):
+        """Closes the connection without reconnecting."""
+        self._closing = True
+        for task in (self._reconnect_task, self._health_task):
+            if task and not task.done():
+                task.cancel()
+        self.ib.disconnect()
+
+    def start_health_check(self):
+        """Starts the periodic health check on the asyncio loop."""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = util.getLoop().create_task(self._health_check_loop())
+
+    async def _health_check_loop(self):
+        while not self._closing:
+            await asyncio.sleep(config.IB_HEALTH_CHECK_INTERVAL)
+            if not self.is_connected():
+                self._schedule_reconnect()
+                continue
+            try:
+                # A connected socket may still be dead; ask TWS for its time
+                await get_request_scheduler().acquire(GENERAL, BACKGROUND)
+                await asyncio.wait_for(self.ib.reqCurrentTimeAsync(), config.IB_CONNECT_TIMEOUT)
+            except Exception as e:
+                self._report(f"IB health check failed ({e!r}), reconnecting...")
+                self.ib.disconnect()
+                self._schedule_reconnect()
+
+    def _on_error(self, req_id, error_code, error_string, contract):
+        if error_code == CLIENT_ID_IN_USE:
+            self._client_id_rejected = True
+        elif error_code == MAX_MESSAGE_RATE_EXCEEDED:
+            get_request_scheduler().throttle(None, config.IB_PACING_PENALTY_SECONDS)
+        elif error_code == HISTORICAL_DATA_ERROR and 'pacing violation' in error_string.lower():
+            get_request_scheduler().throttle(HISTORICAL, config.IB_PACING_PENALTY_SECONDS)
+
+    def _on_disconnected(self):
+        # Failed attempts inside connect_async also end in a disconnect; those are retried there
+        if not self._closing and not self._connecting:
+            self._report("Connection to IB lost, reconnecting in the background...")
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._closing or (self._reconnect_task and not self._reconnect_task.done()):
+            return
+        self._reconnect_task = util.getLoop().create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        """Reconnects with exponential backoff until connected or closed."""
+        delay = config.IB_RECONNECT_MIN_DELAY
+        while not self._closing and not self.is_connected():
+            await asyncio.sleep(delay)
+            if await self.connect_async():
+                return
+            delay = min(delay * 2, config.IB_RECONNECT_MAX_DELAY)
+            print(f"DEBUG: IB reconnect failed, next attempt in {delay}s.")
+
+
+_shared_session = None
+
+
+def get_shared_session():
+    """Returns the IBSession shared by all components of the application."""
+    global _shared_session
+    if _shared_session is None:
+        _shared_session = IBSession()
+    return _shared_session
@@ -0,0 +1,125 @@
+# iv_history_store.py
+import sqlite3 as sq
+import time
+from datetime import date, datetime, timedelta
+from ib_insync import Stock
+from bar_store import missing_days
+import config
+from request_scheduler import get_request_scheduler, HISTORICAL
+from db_access import get_database
+
+
+class IVHistoryStore:
+    """
+    Daily implied and historical volatility of underlyings, stored in SQLite
+    keyed by (symbol, date).
+
+    Reading the history needs no IB request. Backfilling asks IB only for
+    the days after the last stored one, and at most once per
+    config.IV_HISTORY_REFRESH_SECONDS, so a series that is up to date costs
+    no request at all.
+    """
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path (str): Path to the SQLite database holding the IVHistory table.
+        """
+        self.db_path = db_path
+        self.db = None
+        self._checked = {} # symbol -> time.monotonic() of the last backfill
+        try:
+            self.db = get_database(self.db_path)
+            self.db.execute_write('''
+                CREATE TABLE IF NOT EXISTS IVHistory (
+                    symbol TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    impliedVol REAL,
+                    historicalVol REAL,
+                    PRIMARY KEY (symbol, date)
+                )
+            ''')
+        except sq.Error as e:
+            print(f"WARNING: IV history is not available, database error: {e}")
+            self.db = None
+
+    def get_history(self, symbol, days=None):
+        """
+        Reads the stored history of a symbol from disk.
+
+        Args:
+            symbol (str): Underlying symbol.
+            days (int, optional): Calendar days to read. Defaults to config.IV_HISTORY_DAYS.
+
+        Returns:
+            list[tuple]: (date 'YYYY-MM-DD', impliedVol, historicalVol) ordered by date;
+                         the volatilities are annualized fractions or None.
+        """
+        if not self.db:
+            return []
+        days = config.IV_HISTORY_DAYS if days is None else days
+        since = (date.today() - timedelta(days=days)).isoformat()
+        try:
+            return self.db.query(
+                "SELECT date, impliedVol, historicalVol FROM IVHistory WHERE symbol = ? AND date >= ? ORDER BY date",
+                (symbol, since)
+            )
+        except sq.Error as e:
+            print(f"WARNING: Could not read IV history of {symbol}: {e}")
+            return []
+
+    def last_date(self, symbol):
+        """Returns the last stored date of a symbol as datetime.date, or None."""
+        if not self.db:
+            return None
+        row = self.db.query_one("SELECT MAX(date) FROM IVHistory WHERE symbol = ?", (symbol,))
+        return datetime.strptime(row[0], '%Y-%m-%d').date() if row and row[0] else None
+
+    async def backfill_async(self, ib, symbol):
+        """
+        Downloads the missing days of OPTION_IMPLIED_VOLATILITY and
+        HISTORICAL_VOLATILITY for a symbol and stores them.
+
+        Args:
+            ib (IB): The connected ib_insync IB instance.
+            symbol (str): Underlying symbol.
+
+        Returns:
+            int: Number of days written (0 if the series was already current).
+        """
+        if not self.db:
+            return 0
+        checked = self._checked.get(symbol)
+        if checked is not None and time.monotonic() - checked < config.IV_HISTORY_REFRESH_SECONDS:
+            return 0
+        days = missing_days(self.last_date(symbol), config.IV_HISTORY_BACKFILL_DAYS)
+        if days == 0:
+            self._checked[symbol] = time.monotonic()
+            print(f"DEBUG: IV history of {symbol} is current, no IB request.")
+            return 0
+
+        contract = Stock(symbol, 'SMART', 'USD')
+        rows = {} # date -> [impliedVol, historicalVol]
+        for column, what_to_show in enumerate(('OPTION_IMPLIED_VOLATILITY', 'HISTORICAL_VOLATILITY')):
+            await get_request_scheduler().acquire(HISTORICAL)
+            bars = await ib.reqHistoricalDataAsync(
+                contract, endDateTime='', durationStr=f'{days} D', barSizeSetting='1 day',
+                whatToShow=what_to_show, useRTH=True, formatDate=1
+            )
+            for bar in bars or []:
+                rows.setdefault(bar.date.isoformat(), [None, None])[column] = bar.close
+        self._checked[symbol] = time.monotonic()
+        print(f"DEBUG: IV history of {symbol}: requested {days} days, received {len(rows)}.")
+
+        if rows:
+            try:
+                # COALESCE keeps a stored value if only one of the two series arrived
+                await self.db.write_async(lambda conn: conn.executemany('''
+                    INSERT INTO IVHistory (symbol, date, impliedVol, historicalVol) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(symbol, date) DO UPDATE SET
+                        impliedVol = COALESCE(excluded.impliedVol, impliedVol),
+                        historicalVol = COALESCE(excluded.historicalVol, historicalVol)
+                ''', [(symbol, day, iv, hv) for day, (iv, hv) in rows.items()]))
+            except sq.Error as e:
+                print(f"WARNING: Could not store IV history of {symbol}: {e}")
+                return 0
+        return len(rows)
@@ -2,29 +2,25 @@
 import sys
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QHBoxLayout,
-    QTableWidget, QTableWidgetItem, QLineEdit, QTextEdit, QComboBox, QHeaderView,
+    QTableWidget, QTableView, QLineEdit, QTextEdit, QComboBox, QHeaderView,
     QMessageBox, QDialog, QFormLayout, QDialogButtonBox, QDateEdit
 )
 from PyQt6.QtCore import QDate
-from PyQt6.QtGui import QColor
 
 # Import the new manager classes and config
 from ib_manager import IBManager
+from async_tasks import AsyncTaskRunner, ThreadSafeLog, run_in_thread
+from request_scheduler import as_background
 from database_manager import DatabaseManager
 from openai_chat_manager import OpenAIChatManager
 from my_financial_data_manager import FinancialDataManager
+from portfolio_overview_window import PortfolioOverviewWindow
+from table_models import StrategiesModel, LivePositionsModel, TradeHistoryModel
+import flex_ingest
 import config
 
-# Import modules needed for the new script (kód číslo 2)
-# Ujistěte se, že jsou nainstalovány!
-# pip install ib_insync
-# pip install pandas
-# pip install sqlite3 (obvykle je součástí Pythonu)
-import ib_insync
-import pandas as pd
-import sqlite3 as sq
-from datetime import datetime
-import os
+from ib_insync import util
+import asyncio
 
 class AddStrategyDialog(QDialog):
     def __init__(self, parent=None):
@@ -69,10 +65,15 @@ class DeltaNeutralApp(QWidget):
         self.gpt_response_output.setPlaceholderText("Odpověď GPT se objeví zde.")
         self.gpt_response_output.setReadOnly(True)
 
+        # Log usable from worker threads (yfinance and DB queries run off the GUI thread)
+        self.thread_safe_log = ThreadSafeLog(self.chat_output)
+        # Runs IB/DB/provider coroutines on the asyncio loop integrated with Qt; results come back via signals
+        self.task_runner = AsyncTaskRunner()
+
         self.ib_manager = IBManager(self.chat_output)
         self.db_manager = DatabaseManager(config.DATABASE_PATH, self.chat_output)
         self.openai_manager = OpenAIChatManager(config.OPENAI_API_KEY, self.chat_output, self.gpt_response_output)
-        self.financial_data_manager = FinancialDataManager(self.chat_output)
+        self.financial_data_manager = FinancialDataManager(self.thread_safe_log)
 
         # NOVÉ: Proměnná pro uchování vybraných dat pozice pro GPT
         self.selected_position_for_gpt = None 
@@ -100,15 +101,16 @@ class DeltaNeutralApp(QWidget):
                 font-weight: bold;
             }
         """)
-        self.positions_table = QTableWidget()
-        self.positions_table.setColumnCount(3)
-        self.positions_table.setHorizontalHeaderLabels(['Ticker', 'Datum Vstup', 'Datum Výstup'])
-        # Povolíme editaci buněk v tabulce pro datumy
-        self.positions_table.setEditTriggers(QTableWidget.EditTrigger.AnyKeyPressed | QTableWidget.EditTrigger.DoubleClicked)
-        # Připojujeme on_position_click k cellClicked pro aktualizaci selected_position_for_gpt
-        self.positions_table.cellClicked.connect(self.on_position_click)
-        # Nový signál pro sledování změn v buňkách
-        self.positions_table.cellChanged.connect(self.on_position_cell_edited)
+        # Tabulky jsou QTableView nad modely (table_models), buňky se formátují jen pro viditelné řádky
+        self.positions_model = StrategiesModel(self)
+        self.positions_table = QTableView()
+        self.positions_table.setModel(self.positions_model)
+        # Povolíme editaci buněk v tabulce pro datumy (model povoluje jen sloupce s datem)
+        self.positions_table.setEditTriggers(QTableView.EditTrigger.AnyKeyPressed | QTableView.EditTrigger.DoubleClicked)
+        # Připojujeme on_position_click ke kliknutí pro aktualizaci selected_position_for_gpt
+        self.positions_table.clicked.connect(lambda index: self.on_position_click(index.row(), index.column()))
+        # Nový signál pro sledování změn v buňkách (s původní hodnotou pro identifikaci záznamu)
+        self.positions_model.cell_edited.connect(self.on_position_cell_edited)
         self.positions_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
 
         self.details_label = QLabel('Detaily vybrané pozice:')
@@ -146,13 +148,12 @@ class DeltaNeutralApp(QWidget):
         
         self.delta_breakeven_label = QLabel('Break-even (Při otevření strategie): N/A')
         self.current_pnl_label = QLabel('Aktuální PnL (Otevřené pozice z IB): N/A')
+        self.iv_history_label = QLabel(f'Historická IV ({config.IV_HISTORY_DAYS} dní): N/A')
 
         self.ib_live_positions_label = QLabel('Detailní živé pozice z IB:')
-        self.ib_live_positions_table = QTableWidget()
-        self.ib_live_positions_table.setColumnCount(8)
-        self.ib_live_positions_table.setHorizontalHeaderLabels([
-            'Symbol', 'Typ', 'Právo', 'Strike', 'Množství', 'Tržní hodnota', 'Prům. cena', 'Nerealizovaný PnL'
-        ])
+        self.ib_live_positions_model = LivePositionsModel(self)
+        self.ib_live_positions_table = QTableView()
+        self.ib_live_positions_table.setModel(self.ib_live_positions_model)
         live_header = self.ib_live_positions_table.horizontalHeader()
         live_header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
         live_header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
@@ -162,17 +163,19 @@ class DeltaNeutralApp(QWidget):
         live_header.setSectionResizeMode(5, QHeaderView.ResizeMode.ResizeToContents)
         live_header.setSectionResizeMode(6, QHeaderView.ResizeMode.ResizeToContents)
         live_header.setSectionResizeMode(7, QHeaderView.ResizeMode.ResizeToContents)
+        live_header.setSectionResizeMode(8, QHeaderView.ResizeMode.ResizeToContents)
+        live_header.setSectionResizeMode(9, QHeaderView.ResizeMode.ResizeToContents)
+        live_header.setSectionResizeMode(10, QHeaderView.ResizeMode.ResizeToContents)
 
         self.trade_history_label = QLabel('Historie obchodů pro vybraný Ticker:')
         
-        # NOVINKA: Změna počtu sloupců na 8, aby se vešel skrytý tradeId
-        self.trade_history_table = QTableWidget()
-        self.trade_history_table.setColumnCount(8) 
-        self.trade_history_table.setHorizontalHeaderLabels([
-            "Datum", "Symbol", "C/P", "Strike", "Množství", "Realizovaný PnL", "Avg Price", "Trade ID"
-        ])
+        # NOVINKA: 8 sloupců, aby se vešel skrytý tradeId; model načítá další stránky z DB při posunu
+        self.trade_history_model = TradeHistoryModel(self)
+        self.trade_history_table = QTableView()
+        self.trade_history_table.setModel(self.trade_history_model)
+        self.trade_history_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
         # NOVINKA: Skrytí sloupce "Trade ID"
-        self.trade_history_table.hideColumn(7)
+        self.trade_history_table.hideColumn(TradeHistoryModel.TRADE_ID_COLUMN)
         history_header = self.trade_history_table.horizontalHeader()
         history_header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
         history_header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
@@ -182,8 +185,8 @@ class DeltaNeutralApp(QWidget):
         history_header.setSectionResizeMode(5, QHeaderView.ResizeMode.ResizeToContents)
         history_header.setSectionResizeMode(6, QHeaderView.ResizeMode.ResizeToContents)
         
-        # Připojíme on_trade_history_click k cellClicked
-        self.trade_history_table.cellClicked.connect(self.on_trade_history_click)
+        # Připojíme on_trade_history_click ke kliknutí
+        self.trade_history_table.clicked.connect(lambda index: self.on_trade_history_click(index.row(), index.column()))
 
         button_layout = QHBoxLayout()
 
@@ -203,6 +206,10 @@ class DeltaNeutralApp(QWidget):
         load_live_ib_positions_button = QPushButton('Zobrazit živé pozice IB')
         load_live_ib_positions_button.clicked.connect(self.on_show_live_ib_positions_button_click)
         button_layout.addWidget(load_live_ib_positions_button)
+
+        portfolio_overview_button = QPushButton('Přehled portfolia')
+        portfolio_overview_button.clicked.connect(self.show_portfolio_overview)
+        button_layout.addWidget(portfolio_overview_button)
         
         # TLAČÍTKO PRO SPUŠTĚNÍ FLEXREPORTU
         run_flexreport_button = QPushButton('Spustit FlexReport (Kód 2)')
@@ -228,6 +235,7 @@ class DeltaNeutralApp(QWidget):
         
         left_layout.addWidget(self.delta_breakeven_label)
         left_layout.addWidget(self.current_pnl_label)
+        left_layout.addWidget(self.iv_history_label)
         
         left_layout.addWidget(self.ib_live_positions_label)
         left_layout.addWidget(self.ib_live_positions_table)
@@ -268,27 +276,20 @@ class DeltaNeutralApp(QWidget):
 
         self.setLayout(main_layout)
 
-    def on_position_cell_edited(self, row, column):
+    def on_position_cell_edited(self, row, column, old_value):
         """
-        Handles cell edits in the positions table.
+        Handles cell edits in the positions table (StrategiesModel.cell_edited).
         Updates the database with the new data.
         """
         # Ignorovat sloupce, které by neměly být editovatelné (např. Ticker)
         if column != 1 and column != 2:
             return
 
-        # Získáme všechny hodnoty z řádku, abychom měli unikátní identifikátor
-        ticker = self.positions_table.item(row, 0).text()
-        new_value = self.positions_table.item(row, column).text()
-        
-        # Získáme starou hodnotu 'date_open' pro identifikaci
-        # Uložíme si ji do proměnné před jakoukoliv změnou
-        original_date_open_item = self.positions_table.item(row, 1)
-        original_date_close_item = self.positions_table.item(row, 2)
-        
-        # Získáme hodnoty pro primární klíč
-        original_date_open = original_date_open_item.text() if original_date_open_item else None
-        original_date_close = original_date_close_item.text() if original_date_close_item else ''
+        # Řádek modelu už obsahuje novou hodnotu; klíč záznamu tvoří ticker a PŮVODNÍ datum otevření
+        ticker, date_open, date_close = self.positions_model.strategy(row)
+        new_value = date_open if column == 1 else date_close
+        original_date_open = old_value if column == 1 else date_open
+        original_date_close = old_value if column == 2 else date_close
 
         # Určíme, který sloupec se změnil
         column_name = 'date_open' if column == 1 else 'date_close'
@@ -314,23 +315,9 @@ class DeltaNeutralApp(QWidget):
 
     def load_dn_strategies(self):
         """Delegates to DatabaseManager to load strategy positions."""
-        # Odpojení signálu, abychom zabránili nechtěnému spuštění při načítání dat
-        try:
-            self.positions_table.cellChanged.disconnect(self.on_position_cell_edited)
-        except TypeError:
-            pass # Signál není připojen, neřešit
-        
-        # Využijeme metodu, která načte VŠECHNY DN záznamy, včetně uzavřených
-        entries = self.db_manager.get_all_dn_entries()
-        self.positions_table.setRowCount(len(entries))
-        for i, entry in enumerate(entries):
-            date_open, ticker, date_close = entry
-            self.positions_table.setItem(i, 0, QTableWidgetItem(ticker))
-            self.positions_table.setItem(i, 1, QTableWidgetItem(date_open))
-            self.positions_table.setItem(i, 2, QTableWidgetItem(date_close))
-
-        # Znovu připojení signálu po načtení dat
-        self.positions_table.cellChanged.connect(self.on_position_cell_edited)
+        # Využijeme metodu, která načte VŠECHNY DN záznamy, včetně uzavřených.
+        # Nastavení řádků modelu nevyvolá cell_edited, to vzniká jen editací v tabulce.
+        self.positions_model.set_rows(self.db_manager.get_all_dn_entries())
         # Reset selected position data when strategies are reloaded
         self.selected_position_for_gpt = None 
 
@@ -339,11 +326,7 @@ class DeltaNeutralApp(QWidget):
         # Použijeme self.selected_position_for_gpt pro získání tickeru, pokud je pozice vybrána
         if self.selected_position_for_gpt and 'ticker' in self.selected_position_for_gpt:
             ticker = self.selected_position_for_gpt['ticker']
-            self.ib_manager.load_live_positions(
-                ticker,
-                self.ib_live_positions_table,
-                self.ib_live_positions_label
-            )
+            self.start_position_detail_load(ticker)
         else:
             QMessageBox.information(
                 self, "Výběr pozice",
@@ -351,17 +334,23 @@ class DeltaNeutralApp(QWidget):
             )
             return
 
+    def show_portfolio_overview(self):
+        """Otevře přehled všech otevřených strategií (jedno dávkové obnovení z IB)."""
+        self.portfolio_overview_window = PortfolioOverviewWindow(
+            self.ib_manager, self.db_manager, self.task_runner, self.chat_output, self
+        )
+        self.portfolio_overview_window.show()
+
     def on_position_click(self, row, column):
         """
         Handle the selection of a strategy position, display its details,
         and trigger loading of related IB live positions and historical trades.
         Also updates self.selected_position_for_gpt.
         """
-        ticker = self.positions_table.item(row, 0).text()
-        date_open = self.positions_table.item(row, 1).text()
-        
-        date_close_item = self.positions_table.item(row, 2)
-        date_close = date_close_item.text() if date_close_item and date_close_item.text() else ''
+        strategy = self.positions_model.strategy(row)
+        if strategy is None:
+            return
+        ticker, date_open, date_close = strategy
 
         # Uložíme vybranou pozici do instanční proměnné
         self.selected_position_for_gpt = {
@@ -378,15 +367,10 @@ class DeltaNeutralApp(QWidget):
             details_text += f"Datum uzavření strategie: {date_close}\n"
         self.details_text.setText(details_text)
 
-        # Load live IB positions for the selected ticker
-        self.ib_manager.load_live_positions(
-            ticker,
-            self.ib_live_positions_table,
-            self.ib_live_positions_label
-        )
-
-        # Calculate and display current unrealized PnL from IB
-        self.ib_manager.calculate_current_unrealized_pnl(ticker, self.current_pnl_label)
+        # All IB/DB/provider work runs asynchronously; the click returns immediately
+        # and the results arrive through signals.
+        self.start_position_detail_load(ticker)
+        self.start_iv_history_load(ticker)
 
         # Load historical trades and PnL summary from DB for the selected strategy
         position_data_for_db = {
@@ -394,26 +378,66 @@ class DeltaNeutralApp(QWidget):
             'date_open': date_open,
             'date_close': date_close # Posíláme i date_close
         }
-        self.db_manager.load_trade_history_and_summary(
-            position_data_for_db,
-            self.summary_table,
-            self.trade_history_table
-        )
-        
+        self.start_trade_history_load(position_data_for_db)
+
         # Load and display financial events
-        earnings_date = self.financial_data_manager.get_next_earnings_date(ticker)
-        self.next_earnings_label.setText(f"Další Earnings: {earnings_date}")
+        self.next_earnings_label.setText("Další Earnings: Načítám...")
+        self.task_runner.run(
+            'financial_events',
+            self.financial_data_manager.get_financial_events_async(ticker),
+            self._on_financial_events_loaded,
+            lambda error: self.chat_output.append(f"<span style='color:red;'>Chyba při načítání finančních událostí: {error}</span>")
+        )
+
+        self.delta_breakeven_label.setText(f'Break-even (Při otevření pro {ticker}): N/A (Vyžaduje detailní data o legách strategie)')
+
+        self.show_news_button.setEnabled(True)
+
+    def start_position_detail_load(self, ticker):
+        """Starts loading live IB positions and the unrealized PnL from one shared snapshot."""
+        widgets = (self.ib_live_positions_table, self.ib_live_positions_label, self.current_pnl_label)
+        self.ib_manager.show_position_detail_loading(ticker, *widgets)
+        self.task_runner.run(
+            'position_detail',
+            self.ib_manager.get_position_snapshot_async(ticker),
+            lambda snapshot: self.ib_manager.render_position_detail(ticker, snapshot, *widgets),
+            lambda error: self.ib_manager.show_position_detail_error(ticker, error, *widgets)
+        )
+
+    def start_iv_history_load(self, ticker):
+        """Shows the stored IV history at once, then backfills the missing days from IB."""
+        self.ib_manager.render_iv_history(ticker, self.ib_manager.get_iv_history(ticker), self.iv_history_label)
+        self.task_runner.run(
+            'iv_history',
+            as_background(self.ib_manager.backfill_iv_history_async(ticker)),
+            lambda history: self._on_iv_history_backfilled(ticker, history),
+            lambda error: self.chat_output.append(f"<span style='color:red;'>Chyba při načítání historické IV: {error}</span>")
+        )
+
+    def _on_iv_history_backfilled(self, ticker, history):
+        """Re-renders the IV history after a backfill; None means IB is disconnected and the stored data stays shown."""
+        if history is not None:
+            self.ib_manager.render_iv_history(ticker, history, self.iv_history_label)
+
+    def start_trade_history_load(self, position_data_for_db):
+        """Starts loading the trade history and PnL summary of a strategy from the DB."""
+        self.task_runner.run(
+            'trade_history',
+            self.db_manager.fetch_trade_history_and_summary_async(position_data_for_db),
+            lambda data: self.db_manager.render_trade_history_and_summary(data, self.summary_table, self.trade_history_table),
+            lambda error: self.chat_output.append(f"<span style='color:red;'>Chyba při načítání historie obchodů: {error}</span>")
+        )
 
-        dividend_info = self.financial_data_manager.get_next_dividend_info(ticker)
+    def _on_financial_events_loaded(self, events):
+        """Displays the earnings and dividend info loaded by FinancialDataManager."""
+        self.next_earnings_label.setText(f"Další Earnings: {events['earnings_date']}")
+
+        dividend_info = events['dividend_info']
         amount_display = f"{dividend_info['amount']:.2f}" if isinstance(dividend_info['amount'], (int, float)) else str(dividend_info['amount'])
         self.next_dividend_date_label.setText(f"Další Dividenda (Ex-Date): {dividend_info['date']}")
         self.dividend_amount_label.setText(f"Částka Dividendy: {amount_display}")
         self.dividend_yield_label.setText(f"Dividendový Výnos: {dividend_info['yield_percent']}")
 
-        self.delta_breakeven_label.setText(f'Break-even (Při otevření pro {ticker}): N/A (Vyžaduje detailní data o legách strategie)')
-
-        self.show_news_button.setEnabled(True)
-
     def on_trade_history_click(self, row, column):
         """Zpracuje kliknutí na řádek v tabulce historie obchodů."""
         # Tato metoda zatím nic nedělá, ale může být použita v budoucnu
@@ -424,17 +448,15 @@ class DeltaNeutralApp(QWidget):
         """
         Smaže vybraný záznam z tabulky DN a z databáze po potvrzení.
         """
-        row_index = self.positions_table.currentRow()
+        row_index = self.positions_table.currentIndex().row()
         if row_index == -1:
             self.chat_output.append("<span style='color:orange;'>Prosím, vyberte záznam, který chcete smazat.</span>")
             return
 
-        date_open_item = self.positions_table.item(row_index, 1)
-        ticker_item = self.positions_table.item(row_index, 0)
+        strategy = self.positions_model.strategy(row_index)
 
-        if date_open_item and ticker_item:
-            date_open = date_open_item.text()
-            ticker = ticker_item.text()
+        if strategy and strategy[0] and strategy[1]:
+            ticker, date_open, _ = strategy
             
             # Zobrazit dialog pro potvrzení smazání
             confirm_dialog = QMessageBox()
@@ -457,18 +479,18 @@ class DeltaNeutralApp(QWidget):
         """
         Smaže vybraný záznam z tabulky historie obchodů a z databáze po potvrzení.
         """
-        row_index = self.trade_history_table.currentRow()
+        row_index = self.trade_history_table.currentIndex().row()
         if row_index == -1:
             self.chat_output.append("<span style='color:orange;'>Prosím, vyberte záznam z historie obchodů, který chcete smazat.</span>")
             return
             
-        # NOVINKA: Získání Trade ID ze skrytého sloupce (index 7)
-        trade_id_item = self.trade_history_table.item(row_index, 7) 
+        # NOVINKA: Trade ID je ve skrytém sloupci, čteme ho přímo z řádku modelu
+        trade = self.trade_history_model.row_data(row_index)
         
         # Zkontrolujeme, zda máme data pro smazání
-        if trade_id_item and trade_id_item.text():
-            trade_id = trade_id_item.text()
-            symbol = self.trade_history_table.item(row_index, 1).text()
+        if trade and trade[TradeHistoryModel.TRADE_ID_COLUMN] is not None:
+            trade_id = trade[TradeHistoryModel.TRADE_ID_COLUMN]
+            symbol = trade[1]
             
             # Zobrazit dialog pro potvrzení smazání
             confirm_dialog = QMessageBox()
@@ -479,79 +501,65 @@ class DeltaNeutralApp(QWidget):
             confirm_dialog.setDefaultButton(QMessageBox.StandardButton.No)
             
             if confirm_dialog.exec() == QMessageBox.StandardButton.Yes:
-                try:
-                    conn = sq.connect(config.DATABASE_PATH)
-                    cursor = conn.cursor()
-                    
-                    # Použijeme Trade ID pro přesné smazání
-                    cursor.execute("""
-                        DELETE FROM IBFlexQueryCZK
-                        WHERE tradeId = ?
-                    """, (trade_id,))
-                    
-                    conn.commit()
-                    conn.close()
-                    
-                    self.chat_output.append(f"<span style='color:green;'>Záznam pro '{symbol}' s ID '{trade_id}' byl úspěšně smazán z historie obchodů.</span>")
-                    
-                    # Znovu načteme historii obchodů, abychom aktualizovali tabulku
-                    if self.selected_position_for_gpt:
-                        position_data_for_db = {
-                            'ticker': self.selected_position_for_gpt['ticker'],
-                            'date_open': self.selected_position_for_gpt['date_open'],
-                            'date_close': self.selected_position_for_gpt['date_close']
-                        }
-                        self.db_manager.load_trade_history_and_summary(
-                            position_data_for_db,
-                            self.summary_table,
-                            self.trade_history_table
-                        )
-                except Exception as e:
-                    self.chat_output.append(f"<span style='color:red;'>Nepodařilo se smazat záznam z historie: {e}</span>")
+                # Použijeme Trade ID pro přesné smazání; zápis čeká ve frontě zapisujícího threadu
+                # databáze (např. za běžícím FlexReportem), GUI mezitím nezamrzá
+                self.task_runner.run(
+                    'delete_trade',
+                    self.db_manager.delete_trade_async(trade_id),
+                    lambda _: self._on_trade_history_entry_deleted(symbol, trade_id),
+                    lambda error: self.chat_output.append(f"<span style='color:red;'>Nepodařilo se smazat záznam z historie: {error}</span>")
+                )
         else:
             self.chat_output.append("<span style='color:red;'>Chyba: Vybraný řádek historie neobsahuje platná data pro smazání.</span>")
 
+    def _on_trade_history_entry_deleted(self, symbol, trade_id):
+        self.chat_output.append(f"<span style='color:green;'>Záznam pro '{symbol}' s ID '{trade_id}' byl úspěšně smazán z historie obchodů.</span>")
+
+        # Znovu načteme historii obchodů, abychom aktualizovali tabulku
+        if self.selected_position_for_gpt:
+            position_data_for_db = {
+                'ticker': self.selected_position_for_gpt['ticker'],
+                'date_open': self.selected_position_for_gpt['date_open'],
+                'date_close': self.selected_position_for_gpt['date_close']
+            }
+            self.start_trade_history_load(position_data_for_db)
+
     def on_run_flexreport(self):
         """
-        NOVÁ METODA pro spuštění FlexReport skriptu.
-        Opravená verze s kódem uvnitř metody.
+        Stáhne FlexReport a v pracovním vlákně ho po částech vloží/aktualizuje
+        podle tradeId (viz flex_ingest); GUI mezitím nezamrzá.
         """
-        conn = None # Zajišťujeme, že proměnná conn je inicializována
         self.chat_output.append("<span style='color:blue;'>Spouštím stahování a ukládání FlexReportu...</span>")
-        
-        try:
-            # Získání hodnot z konfiguračního souboru a odstranění bílých znaků
-            token = config.TOKEN.strip()
-            queryid = config.QUERY_ID.strip()
-            database_path = config.DATABASE_PATH # Správná proměnná z config.py
-
-            # Připojení k databázi SQLite
-            conn = sq.connect(database_path)
-            cur = conn.cursor()
-            
-            self.chat_output.append("Všechna data z tabulky 'IBFlexQueryCZK' byla smazána.")
-            cur.execute('''DELETE FROM IBFlexQueryCZK''')
-            conn.commit()
+        # Získání hodnot z konfiguračního souboru a odstranění bílých znaků
+        token = config.TOKEN.strip()
+        queryid = config.QUERY_ID.strip()
+        self.task_runner.run(
+            'flex_report',
+            self._run_flexreport_async(token, queryid),
+            self._on_flexreport_done,
+            self._on_flexreport_error
+        )
 
-            # Stažení nových dat z FlexReportu
-            fr = ib_insync.FlexReport(token, queryid)
-            pdtrades = fr.df('Trade')
-            
-            self.chat_output.append(f"Úspěšně staženo {len(pdtrades)} záznamů z FlexReportu.")
-            
-            # Vložení nových dat do databáze (smazání předchozích a vložení nových)
-            pdtrades.to_sql('IBFlexQueryCZK', conn, if_exists='replace', index=False)
+    @staticmethod
+    async def _run_flexreport_async(token, queryid):
+        return await run_in_thread(flex_ingest.run_flex_report, token, queryid, config.DATABASE_PATH)
 
-            # Získání počtu nově přidaných řádků
-            self.chat_output.append(f"Úspěšně vloženo {len(pdtrades)} nových obchodů do databáze 'IBFlexQueryCZK'.")
-            
-        except Exception as e:
-            self.chat_output.append(f"<span style='color:red;'>Chyba při spouštění FlexReport skriptu: {e}</span>")
-            print(f"Chyba při spouštění FlexReport skriptu: {e}", file=sys.stderr)
-        finally:
-            if conn:
-                conn.close()
-        
+    def _on_flexreport_done(self, counts):
+        if counts.get('duplicate'):
+            self.chat_output.append(
+                f"FlexReport ({counts['downloaded']} záznamů) je shodný s již načteným reportem, databáze se nemění."
+            )
+            return
+        self.chat_output.append(f"Úspěšně staženo {counts['downloaded']} záznamů z FlexReportu.")
+        self.chat_output.append(
+            f"Tabulka 'IBFlexQueryCZK': vloženo {counts['inserted']} nových obchodů, "
+            f"aktualizováno {counts['updated']}, beze změny {counts['unchanged']}"
+            + (f", přeskočeno {counts['skipped']} bez tradeID." if counts['skipped'] else ".")
+        )
+
+    def _on_flexreport_error(self, error):
+        self.chat_output.append(f"<span style='color:red;'>Chyba při spouštění FlexReport skriptu: {error}</span>")
+        print(f"Chyba při spouštění FlexReport skriptu: {error}", file=sys.stderr)
 
     def on_ask_gpt(self):
         """
@@ -579,39 +587,25 @@ class DeltaNeutralApp(QWidget):
             context_data += f"- Částka Dividendy: {self.dividend_amount_label.text().replace('Částka Dividendy: ', '')}\n"
             context_data += f"- Dividendový Výnos: {self.dividend_yield_label.text().replace('Dividendový Výnos: ', '')}\n"
             context_data += f"- Aktuální Nerealizovaný PnL: {self.current_pnl_label.text().replace('Aktuální PnL (Otevřené pozice z IB): ', '')}\n"
+            context_data += f"- {self.iv_history_label.text()}\n"
             
             live_positions_data = []
-            for r in range(self.ib_live_positions_table.rowCount()):
+            live_model = self.ib_live_positions_model
+            for r in range(live_model.rowCount()):
                 # Upravená kontrola pro zohlednění prázdných "Právo" a "Strike" pro akcie
-                symbol_item = self.ib_live_positions_table.item(r, 0)
-                sec_type_item = self.ib_live_positions_table.item(r, 1)
-                right_item = self.ib_live_positions_table.item(r, 2)
-                strike_item = self.ib_live_positions_table.item(r, 3)
-                qty_item = self.ib_live_positions_table.item(r, 4)
-                market_val_item = self.ib_live_positions_table.item(r, 5)
-                avg_cost_item = self.ib_live_positions_table.item(r, 6)
-                unrealized_pnl_item = self.ib_live_positions_table.item(r, 7)
+                if live_model.row_data(r) is None: # Řádek se zprávou (načítání, chyba, žádné pozice)
+                    continue
+                symbol, sec_type, right, strike, qty, market_val, avg_cost, unrealized_pnl, delta, _, iv = (
+                    live_model.display_text(r, column) for column in range(live_model.columnCount())
+                )
 
                 # Zajištění, že existují základní položky a jejich text
-                if (symbol_item and symbol_item.text() and 
-                    sec_type_item and sec_type_item.text() and
-                    qty_item and qty_item.text() and
-                    market_val_item and market_val_item.text() and
-                    avg_cost_item and avg_cost_item.text() and
-                    unrealized_pnl_item and unrealized_pnl_item.text()):
-                    
-                    symbol = symbol_item.text()
-                    sec_type = sec_type_item.text()
-                    right = right_item.text() if right_item else "" # Prázdný string, pokud položka neexistuje
-                    strike = strike_item.text() if strike_item else "" # Prázdný string, pokud položka neexistuje
-                    qty = qty_item.text()
-                    market_val = market_val_item.text()
-                    avg_cost = avg_cost_item.text()
-                    unrealized_pnl = unrealized_pnl_item.text()
+                if symbol and sec_type and qty and market_val and avg_cost and unrealized_pnl:
                     
                     live_positions_data.append(
                         f"  - {symbol} ({sec_type}, Právo='{right}', Strike='{strike}'): Množství={qty}, "
-                        f"Tržní hodnota={market_val}, Prům. cena={avg_cost}, Nerealizovaný PnL={unrealized_pnl}"
+                        f"Tržní hodnota={market_val}, Prům. cena={avg_cost}, Nerealizovaný PnL={unrealized_pnl}, "
+                        f"Delta={delta}, IV={iv}"
                     )
                 else:
                     self.chat_output.append(f"<span style='color:orange;'>Upozornění: Některá data živých pozic jsou neúplná v řádku {r}.</span>")
@@ -664,6 +658,12 @@ class DeltaNeutralApp(QWidget):
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
+    # Combined Qt/asyncio event loop: Qt events are processed from the asyncio loop,
+    # nested loops are allowed so the blocking ib_insync calls keep working.
+    util.patchAsyncio()
+    util.useQt('PyQt6')
     ex = DeltaNeutralApp()
     ex.show()
-    sys.exit(app.exec())
+    app.lastWindowClosed.connect(asyncio.get_event_loop().stop)
+    util.run() # Runs the asyncio loop until the last window is closed
+    sys.exit(0)
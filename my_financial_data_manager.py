@@ -1,8 +1,10 @@
 # my_financial_data_manager.py
+import asyncio
 import yfinance as yf
 from datetime import datetime, timedelta
 import pandas as pd # Importujeme pandas pro práci s DataFrame
 import config # Pro získání API klíče, pokud by bylo potřeba (momentálně se nepoužívá, ale je dobré ho tam mít)
+from async_tasks import run_in_thread
 
 class FinancialDataManager:
     def __init__(self, chat_output_widget):
@@ -10,10 +12,24 @@ class FinancialDataManager:
         Inicializuje FinancialDataManager pro získávání finančních dat.
 
         Args:
-            chat_output_widget (QTextEdit): Widget pro výstup zpráv.
+            chat_output_widget (QTextEdit or ThreadSafeLog): Widget pro výstup zpráv.
+                Pro asynchronní varianty je nutný ThreadSafeLog, protože yfinance běží v pracovním vlákně.
         """
         self.chat_output = chat_output_widget
 
+    async def get_financial_events_async(self, ticker):
+        """
+        Souběžně získá datum příštích earnings a informace o dividendě (v pracovních vláknech).
+
+        Returns:
+            dict: {'earnings_date': str, 'dividend_info': dict}
+        """
+        earnings_date, dividend_info = await asyncio.gather(
+            run_in_thread(self.get_next_earnings_date, ticker),
+            run_in_thread(self.get_next_dividend_info, ticker)
+        )
+        return {'earnings_date': earnings_date, 'dividend_info': dividend_info}
+
     def get_next_earnings_date(self, ticker):
         """
         Získá datum příštích earnings pro daný ticker pomocí yfinance.
@@ -0,0 +1,283 @@
+# parquet_export.py
+import math
+import os
+import shutil
+import sqlite3 as sq
+import sys
+from datetime import datetime
+import config
+from db_access import connect_read_only
+from db_migrations import TRADE_DAY_COLUMN
+from flex_ingest import TABLE
+from trade_archives import UNIFIED_VIEW, TradeArchives
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError: # Optional dependency, only needed for the export and its queries
+    pa = ds = None
+
+TRADES = 'trades'
+POSITION_SNAPSHOTS = 'position_snapshots'
+BATCH_ROWS = 50000
+# Declared INTEGER by the base table, but Flex reports fractional quantities (e.g. fractional shares)
+FRACTIONAL_COLUMNS = ('quantity',)
+
+
+def available():
+    """True if pyarrow is installed."""
+    return pa is not None
+
+
+def _require():
+    if pa is None:
+        raise ImportError("The Parquet export needs the pyarrow package (pip install pyarrow).")
+
+
+def _partitioning():
+    # year=2024/underlying=GOOG/...; explicit types, so a numeric-looking symbol stays a string
+    return ds.partitioning(pa.schema([('year', pa.int32()), ('underlying', pa.string())]), flavor='hive')
+
+
+def _float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None # None, '' or "N/A"
+    return None if math.isnan(number) else number
+
+
+def _int(value):
+    number = _float(value)
+    return None if number is None else int(number)
+
+
+def _text(value):
+    return None if value is None or value == '' else str(value)
+
+
+def _arrow_type(column, declared_type):
+    """Arrow type and converter of a column by its SQLite declared type."""
+    declared_type = (declared_type or '').upper()
+    if column.lower() == 'tradedate':
+        return pa.string(), _text # Exported as 'YYYY-MM-DD' whatever the table stores (INTEGER 20240131 in older tables)
+    if column.lower() in FRACTIONAL_COLUMNS:
+        return pa.float64(), _float
+    if column.lower() == 'tradeid' or 'INT' in declared_type:
+        return pa.int64(), _int
+    if any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB', 'NUM')):
+        return pa.float64(), _float
+    return pa.string(), _text
+
+
+def _trade_batches(cursor, converters, schema):
+    while True:
+        rows = cursor.fetchmany(BATCH_ROWS)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        arrays = [pa.array([convert(value) for value in values], type=field.type)
+                  for values, convert, field in zip(columns, converters, schema)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def export_trades(conn, directory=None):
+    """
+    Exports all trades to Parquet files partitioned by year and underlying
+    (the underlying symbol, or the symbol itself for stocks). Reads the TEMP
+    view over the live table and the attached archives when it exists (see
+    trade_archives), otherwise the live table. The rows are streamed in
+    batches; the previous export is replaced only once the new one is complete.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the live database, e.g. from
+                                   db_access.connect_read_only, with the archives
+                                   attached by TradeArchives.attach (or without
+                                   them for only the live table).
+        directory (str, optional): Export root. Defaults to config.PARQUET_EXPORT_DIR.
+
+    Returns:
+        int: Number of exported trades.
+
+    Raises:
+        ImportError: pyarrow is not installed.
+    """
+    _require()
+    directory = config.PARQUET_EXPORT_DIR if directory is None else directory
+    target = os.path.join(directory, TRADES)
+    staging = target + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+
+    has_view = conn.execute(
+        "SELECT 1 FROM sqlite_temp_master WHERE type = 'view' AND name = ?", (UNIFIED_VIEW,)
+    ).fetchone()
+    source = UNIFIED_VIEW if has_view else TABLE
+    # Declared types of the live table (the view has the same columns)
+    declared = [(row[1], row[2]) for row in conn.execute(f"PRAGMA main.table_info({TABLE})")]
+    fields, converters = [], []
+    for column, declared_type in declared:
+        arrow_type, convert = _arrow_type(column, declared_type)
+        fields.append(pa.field(column, arrow_type))
+        converters.append(convert)
+    fields += [pa.field('year', pa.int32()), pa.field('underlying', pa.string())]
+    converters += [_int, _text]
+    schema = pa.schema(fields)
+
+    # The view already reads tradeDate as tradeDay
+    columns = ', '.join(f"{TRADE_DAY_COLUMN} AS {column}" if column.lower() == 'tradedate' and source == TABLE else column
+                        for column, _ in declared)
+    cursor = conn.execute(f"""
+        SELECT {columns}, CAST(substr(tradeDate, 1, 4) AS INTEGER),
+               COALESCE(NULLIF(underlyingSymbol, ''), symbol)
+        FROM {source}
+        WHERE tradeDate IS NOT NULL
+    """)
+    exported = 0
+
+    def counted(batches):
+        nonlocal exported
+        for batch in batches:
+            exported += batch.num_rows
+            yield batch
+
+    ds.write_dataset(
+        counted(_trade_batches(cursor, converters, schema)), staging, schema=schema, format='parquet',
+        partitioning=_partitioning(), existing_data_behavior='error'
+    )
+
+    shutil.rmtree(target, ignore_errors=True)
+    if os.path.exists(staging):
+        os.replace(staging, target)
+    print(f"DEBUG: Parquet export: {exported} trades from {source} written to {target}.")
+    return exported
+
+
+def _snapshot_schema():
+    return pa.schema([
+        ('taken_at', pa.timestamp('s')), ('year', pa.int32()), ('underlying', pa.string()),
+        ('symbol', pa.string()), ('secType', pa.string()), ('conId', pa.int64()),
+        ('right', pa.string()), ('strike', pa.float64()), ('expiry', pa.string()),
+        ('position', pa.float64()), ('avgCost', pa.float64()), ('marketValue', pa.float64()),
+        ('unrealizedPnl', pa.float64()), ('iv', pa.float64()), ('delta', pa.float64()),
+        ('positionDelta', pa.float64()), ('gamma', pa.float64()), ('theta', pa.float64()),
+        ('vega', pa.float64()), ('underlying_price', pa.float64()),
+    ])
+
+
+def export_position_snapshots(snapshots, directory=None, taken_at=None):
+    """
+    Appends position snapshots (IBManager.get_position_snapshot_async, or the
+    'strategies' of get_portfolio_snapshot_async), one row per leg, to the
+    Parquet export partitioned by year and underlying.
+
+    Args:
+        snapshots (list[dict]): Position snapshots.
+        directory (str, optional): Export root. Defaults to config.PARQUET_EXPORT_DIR.
+        taken_at (datetime, optional): Time of the snapshots. Defaults to now.
+
+    Returns:
+        int: Number of exported legs.
+
+    Raises:
+        ImportError: pyarrow is not installed.
+    """
+    _require()
+    directory = config.PARQUET_EXPORT_DIR if directory is None else directory
+    taken_at = (taken_at or datetime.now()).replace(microsecond=0)
+    rows = []
+    for snapshot in snapshots:
+        for leg in snapshot['legs']:
+            contract = leg['contract']
+            rows.append({
+                'taken_at': taken_at, 'year': taken_at.year, 'underlying': snapshot['ticker'],
+                'symbol': _text(contract.symbol), 'secType': _text(contract.secType), 'conId': _int(contract.conId),
+                'right': _text(contract.right), 'strike': _float(contract.strike),
+                'expiry': _text(contract.lastTradeDateOrContractMonth),
+                'position': _float(leg['position']), 'avgCost': _float(leg['avgCost']),
+                'marketValue': _float(leg['marketValue']), 'unrealizedPnl': _float(leg['unrealizedPnl']),
+                'iv': _float(leg['iv']), 'delta': _float(leg['delta']), 'positionDelta': _float(leg['positionDelta']),
+                'gamma': _float(leg.get('gamma')), 'theta': _float(leg.get('theta')), 'vega': _float(leg.get('vega')),
+                'underlying_price': _float(snapshot.get('underlying_price')),
+            })
+    if not rows:
+        return 0
+    ds.write_dataset(
+        pa.Table.from_pylist(rows, schema=_snapshot_schema()), os.path.join(directory, POSITION_SNAPSHOTS),
+        format='parquet', partitioning=_partitioning(),
+        # A new file per export; the previous snapshots stay
+        basename_template=f"snapshot-{taken_at:%Y%m%d-%H%M%S}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore'
+    )
+    print(f"DEBUG: Parquet export: {len(rows)} legs of {len(snapshots)} position snapshots appended.")
+    return len(rows)
+
+
+def dataset(name=TRADES, directory=None):
+    """Opens an exported dataset (TRADES or POSITION_SNAPSHOTS) as a pyarrow dataset."""
+    _require()
+    directory = config.PARQUET_EXPORT_DIR if directory is None else directory
+    return ds.dataset(os.path.join(directory, name), format='parquet', partitioning=_partitioning())
+
+
+def scan(columns, years=None, underlyings=None, name=TRADES, directory=None, filter=None):
+    """
+    Reads only the given columns of the partitions of the given years and
+    underlyings; the other files are not opened at all.
+
+    Args:
+        columns (list[str]): Columns to read ('year' and 'underlying' included).
+        years (iterable[int], optional): Only these years.
+        underlyings (iterable[str], optional): Only these underlyings.
+        name (str): TRADES or POSITION_SNAPSHOTS.
+        directory (str, optional): Export root. Defaults to config.PARQUET_EXPORT_DIR.
+        filter (pyarrow.dataset.Expression, optional): Additional row filter.
+
+    Returns:
+        pyarrow.Table
+    """
+    expression = filter
+    for field, values in (('year', years), ('underlying', underlyings)):
+        if values is not None:
+            condition = ds.field(field).isin(list(values))
+            expression = condition if expression is None else expression & condition
+    return dataset(name, directory).to_table(columns=list(columns), filter=expression)
+
+
+def summarize(sums, group_by=('underlying',), years=None, underlyings=None, directory=None):
+    """
+    Sums trade columns per group, e.g. summarize(['fifoPnlRealized'], ['year']).
+
+    Returns:
+        pyarrow.Table: The group columns and '<column>_sum' for every summed column.
+    """
+    table = scan(list(group_by) + list(sums), years, underlyings, TRADES, directory)
+    return table.group_by(list(group_by)).aggregate([(column, 'sum') for column in sums])
+
+
+def pnl_summary(group_by=('underlying',), years=None, underlyings=None, directory=None):
+    """Realized PnL, net cash and FX PnL of the exported trades per group."""
+    return summarize(('fifoPnlRealized', 'netCash', 'fxPnL'), group_by, years, underlyings, directory)
+
+
+def commission_summary(group_by=('year',), years=None, underlyings=None, directory=None):
+    """Commissions of the exported trades per group."""
+    return summarize(('ibCommission',), group_by, years, underlyings, directory)
+
+
+if __name__ == '__main__':
+    # Export obchodů (živá tabulka + archivní databáze) do config.PARQUET_EXPORT_DIR
+    if not available():
+        print("Pro export do Parquet je potřeba balíček pyarrow (pip install pyarrow).")
+        sys.exit(1)
+    # Všechny zdrojové databáze se otevírají jen pro čtení, export je nemění
+    try:
+        conn = connect_read_only(config.DATABASE_PATH)
+        try:
+            TradeArchives(config.DATABASE_PATH).attach(conn)
+            count = export_trades(conn)
+        finally:
+            conn.close()
+    except sq.Error as e:
+        print(f"Chyba při čtení databáze {config.DATABASE_PATH}: {e}")
+        sys.exit(1)
+    print(f"Exportováno {count} obchodů do {os.path.join(config.PARQUET_EXPORT_DIR, TRADES)}.")
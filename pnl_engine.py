@@ -0,0 +1,86 @@
+# pnl_engine.py
+import numpy as np
+
+
+def to_float_array(values):
+    """
+    Converts a sequence of numbers/None to a float64 array; None and
+    non-numeric values become NaN.
+    """
+    return np.array(
+        [float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan for v in values],
+        dtype=np.float64
+    )
+
+
+def _usable(prices):
+    """Mask of prices that can be used: present (not NaN) and non-zero."""
+    return ~np.isnan(prices) & (prices != 0.0)
+
+
+def compute_position_values(quantity, avg_cost, bid, ask, last, close, multiplier):
+    """
+    Computes mark price, market value and unrealized PnL for a whole portfolio
+    in one vectorized pass. All arguments are equally long float arrays;
+    missing prices are NaN.
+
+    Semantics (same as the original per-leg code in IBManager):
+      * mark price (market value): Last -> Mid -> Bid -> Ask -> Close
+      * PnL price: Mid -> Last -> mark price
+      * long:  (price * multiplier - avgCost) * quantity
+      * short: (avgCost - price) * |quantity| * multiplier
+      * zero quantity: PnL 0.0
+      * market value: mark price * quantity * multiplier
+
+    Args:
+        quantity, avg_cost: Position size and IB avgCost (missing values count as 0).
+        bid, ask, last, close: Quote fields.
+        multiplier: Contract multipliers.
+
+    Returns:
+        dict: 'mark_price', 'pnl_price', 'market_value', 'unrealized_pnl' arrays;
+              NaN marks a value that could not be computed ("N/A").
+    """
+    quantity = np.nan_to_num(np.asarray(quantity, dtype=np.float64), nan=0.0)
+    avg_cost = np.nan_to_num(np.asarray(avg_cost, dtype=np.float64), nan=0.0)
+    bid = np.asarray(bid, dtype=np.float64)
+    ask = np.asarray(ask, dtype=np.float64)
+    last = np.asarray(last, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    multiplier = np.asarray(multiplier, dtype=np.float64)
+
+    has_mid = _usable(bid) & _usable(ask)
+    mid = np.where(has_mid, (bid + ask) / 2, np.nan)
+
+    # np.select picks the first matching condition, i.e. the priority order
+    mark_price = np.select(
+        [_usable(last), has_mid, _usable(bid), _usable(ask), _usable(close)],
+        [last, mid, bid, ask, close],
+        default=np.nan
+    )
+    pnl_price = np.select(
+        [has_mid, _usable(last)],
+        [mid, last],
+        default=mark_price
+    )
+
+    long_pnl = (pnl_price * multiplier - avg_cost) * quantity
+    short_pnl = (avg_cost - pnl_price) * np.abs(quantity) * multiplier
+    unrealized_pnl = np.select([quantity > 0, quantity < 0], [long_pnl, short_pnl], default=0.0)
+
+    market_value = mark_price * quantity * multiplier
+
+    return {
+        'mark_price': mark_price,
+        'pnl_price': pnl_price,
+        'market_value': market_value,
+        'unrealized_pnl': unrealized_pnl
+    }
+
+
+def totals(values):
+    """Sums the market value and unrealized PnL arrays, skipping "N/A" (NaN) entries."""
+    return {
+        'market_value': float(np.nansum(values['market_value'])),
+        'unrealized_pnl': float(np.nansum(values['unrealized_pnl']))
+    }
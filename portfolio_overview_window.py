@@ -0,0 +1,161 @@
+# portfolio_overview_window.py
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QTableWidget, QTableWidgetItem,
+    QHeaderView, QPushButton
+)
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QColor
+import config
+import parquet_export
+from async_tasks import run_in_thread
+
+
+def _format_number(value, digits=2):
+    """Formátuje číslo na daný počet desetinných míst, ostatní hodnoty (např. "N/A") ponechá."""
+    return f"{value:.{digits}f}" if isinstance(value, float) else str(value)
+
+
+class PortfolioOverviewWindow(QDialog):
+    def __init__(self, ib_manager, db_manager, task_runner, chat_output_widget, parent=None):
+        """
+        Inicializuje okno s přehledem všech otevřených strategií.
+
+        Všechny strategie se obnovují jedním dávkovým požadavkem na pozice a
+        tržní data (IBManager.get_portfolio_snapshot_async), ne postupným
+        načítáním detailu každé strategie.
+
+        Args:
+            ib_manager (IBManager): Správce připojení k IB.
+            db_manager (DatabaseManager): Správce databáze (zdroj otevřených strategií).
+            task_runner (AsyncTaskRunner): Spouštěč asynchronních úloh hlavního okna.
+            chat_output_widget (QTextEdit): Odkaz na hlavní chatovací výstup pro logování.
+            parent (QWidget): Nadřazený widget.
+        """
+        super().__init__(parent)
+        self.setWindowTitle("Přehled portfolia")
+        self.setGeometry(200, 200, 900, 500)
+
+        self.ib_manager = ib_manager
+        self.db_manager = db_manager
+        self.task_runner = task_runner
+        self.chat_output = chat_output_widget
+        self.strategies = [] # [(ticker, date_open)]
+
+        self.setup_ui()
+        self.refresh()
+
+    def setup_ui(self):
+        """Nastaví prvky uživatelského rozhraní pro okno přehledu."""
+        self.main_layout = QVBoxLayout(self)
+
+        self.title_label = QLabel("Přehled otevřených strategií")
+        self.title_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.title_label.setStyleSheet("font-size: 16pt; margin-bottom: 10px;")
+        self.main_layout.addWidget(self.title_label)
+
+        self.overview_table = QTableWidget()
+        self.overview_table.setColumnCount(7)
+        self.overview_table.setHorizontalHeaderLabels([
+            "Ticker", "Datum Vstup", "Počet leg", "Delta pozice", "Delta ($)", "Tržní hodnota", "Nerealizovaný PnL"
+        ])
+        for column in range(self.overview_table.columnCount()):
+            self.overview_table.horizontalHeader().setSectionResizeMode(column, QHeaderView.ResizeMode.ResizeToContents)
+        self.overview_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.overview_table.verticalHeader().setVisible(False)
+        self.overview_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.main_layout.addWidget(self.overview_table)
+
+        bottom_layout = QHBoxLayout()
+        self.total_label = QLabel("Portfolio: N/A")
+        bottom_layout.addWidget(self.total_label)
+        bottom_layout.addStretch()
+        self.refresh_button = QPushButton("Obnovit")
+        self.refresh_button.clicked.connect(self.refresh)
+        bottom_layout.addWidget(self.refresh_button)
+        self.main_layout.addLayout(bottom_layout)
+
+    def refresh(self):
+        """Načte otevřené strategie z DB a spustí jejich dávkové obnovení z IB."""
+        # Více záznamů se stejným tickerem sdílí tytéž pozice v IB, zobrazíme ticker jednou
+        self.strategies = []
+        seen = set()
+        for date_open, ticker, _ in self.db_manager.get_open_dn_entries():
+            if ticker not in seen:
+                seen.add(ticker)
+                self.strategies.append((ticker, date_open))
+
+        self.total_label.setText("Portfolio: Načítám...")
+        self.refresh_button.setEnabled(False)
+        self.task_runner.run(
+            'portfolio_overview',
+            self.ib_manager.get_portfolio_snapshot_async([ticker for ticker, _ in self.strategies]),
+            self.render_portfolio,
+            self.show_error
+        )
+
+    def render_portfolio(self, portfolio):
+        """Zobrazí výsledek IBManager.get_portfolio_snapshot_async (None = IB odpojeno)."""
+        self.refresh_button.setEnabled(True)
+        self.overview_table.clearSpans()
+        if portfolio is None:
+            self._show_message("IB není připojeno.")
+            self.total_label.setText("Portfolio: IB odpojeno")
+            return
+        if not self.strategies:
+            self._show_message("Žádné otevřené strategie.")
+            self.total_label.setText("Portfolio: (Žádné)")
+            return
+
+        self.overview_table.setRowCount(len(self.strategies))
+        for row_idx, ((ticker, date_open), snapshot) in enumerate(zip(self.strategies, portfolio['strategies'])):
+            pnl_item = QTableWidgetItem(_format_number(snapshot['total_unrealized_pnl']))
+            if snapshot['total_unrealized_pnl'] > 0:
+                pnl_item.setBackground(QColor(190, 255, 190)) # Světle zelená
+            elif snapshot['total_unrealized_pnl'] < 0:
+                pnl_item.setBackground(QColor(255, 190, 190)) # Světle červená
+
+            self.overview_table.setItem(row_idx, 0, QTableWidgetItem(ticker))
+            self.overview_table.setItem(row_idx, 1, QTableWidgetItem(date_open))
+            self.overview_table.setItem(row_idx, 2, QTableWidgetItem(str(len(snapshot['legs']))))
+            self.overview_table.setItem(row_idx, 3, QTableWidgetItem(_format_number(snapshot['total_delta'])))
+            self.overview_table.setItem(row_idx, 4, QTableWidgetItem(_format_number(snapshot['dollar_delta'], 0)))
+            self.overview_table.setItem(row_idx, 5, QTableWidgetItem(_format_number(snapshot['total_market_value'])))
+            self.overview_table.setItem(row_idx, 6, pnl_item)
+
+        self.total_label.setText(
+            f"Portfolio: Delta ($) {_format_number(portfolio['total_dollar_delta'], 0)}, "
+            f"Tržní hodnota {_format_number(portfolio['total_market_value'])} USD, "
+            f"Nerealizovaný PnL {_format_number(portfolio['total_unrealized_pnl'])} USD"
+        )
+        self.chat_output.append(f"Přehled portfolia obnoven ({len(self.strategies)} strategií).")
+
+        # Snímek pozic se připojí k exportu do Parquet (pro offline analýzu), mimo GUI vlákno
+        if config.PARQUET_EXPORT_SNAPSHOTS and parquet_export.available():
+            self.task_runner.run(
+                'portfolio_snapshot_export',
+                self._export_snapshots_async(portfolio['strategies']),
+                lambda count: None,
+                self._on_snapshot_export_error
+            )
+
+    @staticmethod
+    async def _export_snapshots_async(snapshots):
+        return await run_in_thread(parquet_export.export_position_snapshots, snapshots)
+
+    def _on_snapshot_export_error(self, error):
+        self.chat_output.append(f"<span style='color:orange;'>Snímek portfolia se nepodařilo uložit do Parquet: {error}</span>")
+
+    def show_error(self, error):
+        """Zobrazí chybu při obnovení přehledu."""
+        self.refresh_button.setEnabled(True)
+        self._show_message(f"Chyba při načítání přehledu portfolia: {error}")
+        self.total_label.setText("Portfolio: Chyba")
+        self.chat_output.append(f"<span style='color:red;'>Chyba při načítání přehledu portfolia: {error}</span>")
+
+    def _show_message(self, message):
+        """Zobrazí jednu zprávu přes všechny sloupce tabulky."""
+        self.overview_table.setRowCount(1)
+        message_item = QTableWidgetItem(message)
+        message_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.overview_table.setItem(0, 0, message_item)
+        self.overview_table.setSpan(0, 0, 1, self.overview_table.columnCount())
@@ -0,0 +1,158 @@
+# price_fallback.py
+import asyncio
+import math
+import time
+from ib_insync import Stock
+import config
+from request_scheduler import get_request_scheduler, MARKET_DATA, HISTORICAL
+
+# Price sources in priority order; a lower-priority answer is only used
+# once every higher-priority source of the leg has finished without a price
+SOURCES = ('snapshot', 'intraday_bars', 'daily_close')
+
+
+def _positive(value):
+    """Returns the value if it is a usable price (not None/NaN and > 0), else None."""
+    return value if value is not None and not math.isnan(value) and value > 0 else None
+
+
+class FallbackPriceResolver:
+    """
+    Resolves a current price for many contracts at once, also when the market
+    is closed.
+
+    For every contract all sources (market data snapshot, hourly option bars,
+    last daily close / intrinsic value from the underlying) are requested
+    concurrently. Each contract takes the highest-priority answer available
+    within one shared deadline, so an off-hours refresh costs a few seconds
+    in total instead of several seconds per leg.
+    """
+    def __init__(self, ib, contract_cache, bar_store):
+        """
+        Args:
+            ib (IB): The connected ib_insync IB instance.
+            contract_cache (ContractCache): Qualifies underlyings for the bar store.
+            bar_store (BarStore): Local daily bars; only their missing tail is requested from IB.
+        """
+        self.ib = ib
+        self.contract_cache = contract_cache
+        self.bar_store = bar_store
+
+    async def resolve(self, contracts, deadline=None):
+        """
+        Args:
+            contracts (list[Contract]): Contracts with their exchange filled in.
+            deadline (float, optional): Seconds for the whole batch.
+                                        Defaults to config.PRICE_FALLBACK_DEADLINE.
+
+        Returns:
+            list[tuple]: (price or None, source name or None) per contract, same order.
+        """
+        if not contracts:
+            return []
+        deadline = config.PRICE_FALLBACK_DEADLINE if deadline is None else deadline
+        end = time.monotonic() + deadline
+
+        # Underlying closes are shared by all options on the same symbol
+        underlying_closes = {}
+        tasks = [] # per contract: {source: Task}
+        for contract in contracts:
+            sources = {'snapshot': asyncio.ensure_future(self._snapshot_price(contract))}
+            if contract.secType == 'STK':
+                sources['daily_close'] = asyncio.ensure_future(self._last_daily_close(contract))
+            elif contract.secType == 'OPT':
+                sources['intraday_bars'] = asyncio.ensure_future(self._last_traded_bar(contract))
+                if contract.symbol not in underlying_closes:
+                    underlying_closes[contract.symbol] = asyncio.ensure_future(
+                        self._last_daily_close(Stock(contract.symbol, 'SMART', 'USD')))
+                sources['daily_close'] = asyncio.ensure_future(
+                    self._intrinsic_value(contract, underlying_closes[contract.symbol]))
+            tasks.append(sources)
+
+        all_tasks = [t for sources in tasks for t in sources.values()] + list(underlying_closes.values())
+        pending = set(all_tasks)
+        while pending and not all(self._decided(sources) for sources in tasks):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                print(f"DEBUG: Price fallback deadline ({deadline}s) reached, using the best answers so far.")
+                break
+            _, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in pending:
+            task.cancel()
+
+        results = []
+        for contract, sources in zip(contracts, tasks):
+            result = (None, None)
+            for source in SOURCES:
+                price = self._result(sources.get(source))
+                if price is not None:
+                    result = (price, source)
+                    break
+            print(f"DEBUG: {contract.symbol} {contract.secType} {contract.right} {contract.strike}: price {result[0]} from {result[1]}")
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _result(task):
+        """Price of a finished source task, or None."""
+        if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+            return None
+        return task.result()
+
+    def _decided(self, sources):
+        """
+        A contract is decided once a source has a price and every
+        higher-priority source has finished without one.
+        """
+        for source in SOURCES:
+            task = sources.get(source)
+            if task is None:
+                continue
+            if not task.done():
+                return False
+            if self._result(task) is not None:
+                return True
+        return True # Every source finished without a price
+
+    async def _snapshot_price(self, contract):
+        """Market data snapshot: market price, last, mid, then close."""
+        await get_request_scheduler().acquire(MARKET_DATA)
+        [ticker] = await self.ib.reqTickersAsync(contract)
+        price = _positive(ticker.marketPrice()) or _positive(ticker.last)
+        if price is None and _positive(ticker.bid) and _positive(ticker.ask):
+            price = (ticker.bid + ticker.ask) / 2
+        return price or _positive(ticker.close)
+
+    async def _last_traded_bar(self, contract):
+        """Close of the last hourly bar with trades in the last two days."""
+        await get_request_scheduler().acquire(HISTORICAL)
+        bars = await self.ib.reqHistoricalDataAsync(
+            contract, endDateTime='', durationStr='2 D', barSizeSetting='1 hour',
+            whatToShow='TRADES', useRTH=True, formatDate=1
+        )
+        for bar in reversed(bars or []):
+            if bar.close > 0 and bar.volume > 0:
+                return bar.close
+        return None
+
+    async def _last_daily_close(self, contract):
+        """Close of the last daily bar, served from the local bar store."""
+        if not contract.conId and not await self.contract_cache.qualify_async(self.ib, [contract]):
+            return None
+        return await self.bar_store.last_close_async(self.ib, contract)
+
+    @staticmethod
+    async def _intrinsic_value(contract, underlying_close):
+        """
+        Estimate for an option from the underlying's last close: its intrinsic
+        value, or 0.01 for an out-of-the-money option.
+        """
+        underlying_price = await asyncio.shield(underlying_close)
+        if underlying_price is None:
+            return None
+        if contract.right == 'C':
+            intrinsic = max(0, underlying_price - contract.strike)
+        else:
+            intrinsic = max(0, contract.strike - underlying_price)
+        return intrinsic if intrinsic > 0 else 0.01 # Minimal value for OTM options
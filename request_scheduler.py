@@ -0,0 +1,249 @@
+# request_scheduler.py
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+import config
+
+# Request classes (keys of config.IB_PACING)
+MARKET_DATA = 'market_data'
+CONTRACT_DETAILS = 'contract_details'
+HISTORICAL = 'historical'
+GENERAL = 'general'
+
+# Priorities: a lower value is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Priority of the requests made by the current asyncio task (tasks inherit it from their creator)
+request_priority = contextvars.ContextVar('request_priority', default=INTERACTIVE)
+# SharedPriority of the request the current task runs for several callers (see async_tasks.SingleFlight)
+shared_priority = contextvars.ContextVar('shared_priority', default=None)
+
+
+class SharedPriority:
+    """
+    Priority of a request shared by several callers: that of its most urgent
+    caller. A request started by a background refresh is raised to
+    INTERACTIVE as soon as a user action joins it, including the IB requests
+    it is already waiting for.
+    """
+    def __init__(self, priority, parent=None):
+        """
+        Args:
+            priority (int): Priority of the caller that started the request.
+            parent (SharedPriority, optional): The shared request this one was started from.
+        """
+        self.priority = priority
+        self.parent = parent
+
+    @property
+    def value(self):
+        return self.priority if self.parent is None else min(self.priority, self.parent.value)
+
+    def raise_to(self, priority):
+        """Raises the priority for a more urgent caller (a lower priority is kept as it is)."""
+        if priority < self.priority:
+            self.priority = priority
+            get_request_scheduler().reprioritize()
+
+
+def current_priority():
+    """Priority of the IB requests made by the current task."""
+    shared = shared_priority.get()
+    return request_priority.get() if shared is None else shared.value
+
+
+class TokenBucket:
+    """Token bucket: `rate` tokens per second, at most `burst` tokens stored."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        blocked = max(0.0, self.blocked_until - time.monotonic())
+        if self.tokens >= 1:
+            return blocked
+        return max(blocked, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Stops handing out tokens for a while (after IB reported a pacing violation)."""
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RequestScheduler:
+    """
+    Central pacing of IB requests.
+
+    Every request class has its own token bucket (config.IB_PACING) and all
+    requests also share the bucket of IB's overall message rate
+    (config.IB_MAX_MESSAGES_PER_SECOND). Waiting requests are served by
+    priority, so interactive detail views overtake background prefetch, and
+    in FIFO order within a priority.
+    """
+    def __init__(self, pacing=None, max_messages_per_second=None):
+        """
+        Args:
+            pacing (dict, optional): {request class: {'rate': float, 'burst': int}}.
+                                     Defaults to config.IB_PACING.
+            max_messages_per_second (float, optional): Overall message rate.
+                                     Defaults to config.IB_MAX_MESSAGES_PER_SECOND.
+        """
+        pacing = config.IB_PACING if pacing is None else pacing
+        rate = config.IB_MAX_MESSAGES_PER_SECOND if max_messages_per_second is None else max_messages_per_second
+        self._buckets = {name: TokenBucket(limits['rate'], limits['burst']) for name, limits in pacing.items()}
+        self._messages = TokenBucket(rate, rate)
+        self._queues = {name: [] for name in pacing} # request class -> heap of (priority, seq, future, queued_at, shared)
+        self._timers = {} # request class -> asyncio.TimerHandle of the pending wake-up
+        self._seq = itertools.count()
+        self._stats = {name: {'dispatched': 0, 'queued': 0, 'total_wait': 0.0, 'max_depth': 0} for name in pacing}
+
+    async def acquire(self, request_class, priority=None):
+        """
+        Waits until a request of the given class may be sent.
+
+        Args:
+            request_class (str): One of the request classes (e.g. HISTORICAL).
+            priority (int, optional): INTERACTIVE or BACKGROUND. Defaults to the
+                                      priority of the current task (current_priority).
+        """
+        shared = shared_priority.get() if priority is None else None
+        priority = current_priority() if priority is None else priority
+        if not self._queues[request_class] and self._ready(request_class):
+            self._dispatch(request_class, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[request_class]
+        heapq.heappush(queue, (priority, next(self._seq), future, time.monotonic(), shared))
+        stats = self._stats[request_class]
+        stats['queued'] += 1
+        stats['max_depth'] = max(stats['max_depth'], len(queue))
+        print(f"DEBUG: Request scheduler: {request_class} request queued (priority {priority}, depth {len(queue)}).")
+        self._wake(request_class)
+        await future
+
+    async def run(self, request_class, coro_factory, priority=None):
+        """Acquires a slot, then awaits coro_factory() and returns its result."""
+        await self.acquire(request_class, priority)
+        return await coro_factory()
+
+    def throttle(self, request_class, seconds):
+        """
+        Pauses a request class after IB reported a pacing violation; None pauses
+        all requests (overall message rate exceeded).
+        """
+        print(f"DEBUG: Request scheduler: {request_class or 'all requests'} paused for {seconds}s.")
+        if request_class is None:
+            self._messages.block(seconds)
+            for name in self._queues:
+                self._wake(name)
+        else:
+            self._buckets[request_class].block(seconds)
+            self._wake(request_class)
+
+    def reprioritize(self):
+        """Re-sorts the waiting requests whose shared priority was raised (SharedPriority.raise_to)."""
+        for name, queue in self._queues.items():
+            raised = 0
+            for i, (priority, seq, future, queued_at, shared) in enumerate(queue):
+                if shared is not None and shared.value != priority:
+                    queue[i] = (shared.value, seq, future, queued_at, shared)
+                    raised += 1
+            if raised:
+                heapq.heapify(queue)
+                print(f"DEBUG: Request scheduler: {raised} waiting {name} requests raised to priority {queue[0][0]}.")
+
+    def queue_depth(self, request_class):
+        """Number of waiting requests per priority: {INTERACTIVE: n, BACKGROUND: n}."""
+        depth = {INTERACTIVE: 0, BACKGROUND: 0}
+        for priority, _, future, _, _ in self._queues[request_class]:
+            if not future.done():
+                depth[priority] = depth.get(priority, 0) + 1
+        return depth
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Per request class: 'interactive' and 'background' queue depth,
+                  'dispatched', 'queued' (had to wait), 'avg_wait' (seconds) and 'max_depth'.
+        """
+        result = {}
+        for name, stats in self._stats.items():
+            depth = self.queue_depth(name)
+            result[name] = {
+                'interactive': depth[INTERACTIVE],
+                'background': depth[BACKGROUND],
+                'dispatched': stats['dispatched'],
+                'queued': stats['queued'],
+                'avg_wait': stats['total_wait'] / stats['dispatched'] if stats['dispatched'] else 0.0,
+                'max_depth': stats['max_depth']
+            }
+        return result
+
+    def _ready(self, request_class):
+        return self._buckets[request_class].wait_time() == 0 and self._messages.wait_time() == 0
+
+    def _dispatch(self, request_class, waited):
+        self._buckets[request_class].take()
+        self._messages.take()
+        stats = self._stats[request_class]
+        stats['dispatched'] += 1
+        stats['total_wait'] += waited
+
+    def _wake(self, request_class):
+        """Releases waiting requests while tokens last, then schedules the next wake-up."""
+        timer = self._timers.pop(request_class, None)
+        if timer is not None:
+            timer.cancel()
+        queue = self._queues[request_class]
+        while queue:
+            if queue[0][2].done(): # Cancelled while waiting
+                heapq.heappop(queue)
+                continue
+            if not self._ready(request_class):
+                break
+            _, _, future, queued_at, _ = heapq.heappop(queue)
+            self._dispatch(request_class, time.monotonic() - queued_at)
+            future.set_result(None)
+
+        if queue:
+            delay = max(self._buckets[request_class].wait_time(), self._messages.wait_time(), 0.001)
+            self._timers[request_class] = asyncio.get_running_loop().call_later(delay, self._wake, request_class)
+
+
+async def as_background(coro):
+    """Runs a coroutine with BACKGROUND priority for all IB requests it makes."""
+    token = request_priority.set(BACKGROUND)
+    shared_token = shared_priority.set(None)
+    try:
+        return await coro
+    finally:
+        shared_priority.reset(shared_token)
+        request_priority.reset(token)
+
+
+_request_scheduler = None
+
+
+def get_request_scheduler():
+    """Returns the RequestScheduler shared by all components of the application."""
+    global _request_scheduler
+    if _request_scheduler is None:
+        _request_scheduler = RequestScheduler()
+    return _request_scheduler
@@ -0,0 +1,240 @@
+# table_models.py
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt6.QtGui import QColor
+import config
+
+
+def _number(value, digits=2, default="N/A"):
+    """Formats a float to the given number of decimals; other values (e.g. "N/A") are shown as they are."""
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return default if value is None else str(value)
+
+
+def _pnl_color(value):
+    """Red for a loss, green for a profit, default color otherwise."""
+    if isinstance(value, (int, float)):
+        return QColor('red') if value < 0 else QColor('green')
+    return None
+
+
+class RowTableModel(QAbstractTableModel):
+    """
+    Read-only table model over a list of row objects (tuples or dicts).
+
+    Cells are formatted only when the view asks for them, i.e. for the
+    visible rows, instead of building an item per cell up front. Each
+    column is (header, format(row) -> str, color(row) -> QColor or None).
+    A model can also show a single message row instead of data.
+    """
+    def __init__(self, columns, parent=None):
+        super().__init__(parent)
+        self._columns = columns
+        self._rows = []
+        self._message = None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return 1 if self._message is not None else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._columns)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self._columns[section][0]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if self._message is not None:
+            return self._message if role == Qt.ItemDataRole.DisplayRole and index.column() == 0 else None
+        row = self._rows[index.row()]
+        _, formatter, color = self._columns[index.column()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return formatter(row)
+        if role == Qt.ItemDataRole.ForegroundRole and color is not None:
+            return color(row)
+        return None
+
+    def set_rows(self, rows):
+        """Replaces all rows (the list is kept, not copied)."""
+        self.beginResetModel()
+        self._rows = rows
+        self._message = None
+        self.endResetModel()
+
+    def set_message(self, message):
+        """Shows a single message row instead of the data."""
+        self.beginResetModel()
+        self._rows = []
+        self._message = message
+        self.endResetModel()
+
+    def clear(self):
+        self.set_rows([])
+
+    def row_data(self, row):
+        """Returns the row object of a data row, or None (message row, out of range)."""
+        if self._message is not None or not 0 <= row < len(self._rows):
+            return None
+        return self._rows[row]
+
+    def display_text(self, row, column):
+        """Formatted text of a cell, as shown in the view."""
+        index = self.index(row, column)
+        return self.data(index) if index.isValid() else None
+
+
+class PagedRowTableModel(RowTableModel):
+    """
+    RowTableModel that loads its rows page by page: the view calls
+    canFetchMore/fetchMore when it scrolls to the end, and only then is the
+    next page read (e.g. by LIMIT/OFFSET from SQLite).
+    """
+    def __init__(self, columns, page_size=None, parent=None):
+        super().__init__(columns, parent)
+        self.page_size = config.TABLE_PAGE_SIZE if page_size is None else page_size
+        self._fetch_page = None
+
+    def set_first_page(self, rows, fetch_page):
+        """
+        Args:
+            rows (list): The first page (at most page_size rows).
+            fetch_page (callable): fetch_page(offset, limit) -> list of rows, for the next pages.
+        """
+        self.set_rows(list(rows))
+        self._fetch_page = fetch_page if len(rows) >= self.page_size else None
+
+    def set_rows(self, rows):
+        self._fetch_page = None
+        super().set_rows(rows)
+
+    def set_message(self, message):
+        self._fetch_page = None
+        super().set_message(message)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._fetch_page is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._fetch_page is None:
+            return
+        try:
+            rows = self._fetch_page(len(self._rows), self.page_size)
+        except Exception as e:
+            print(f"WARNING: Could not load the next page of the table: {e}")
+            rows = []
+        if len(rows) < self.page_size:
+            self._fetch_page = None # Last page
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(rows) - 1)
+            self._rows.extend(rows)
+            self.endInsertRows()
+
+
+# Trade history rows: (tradeDay, symbol, putCall, strike, quantity, fifoPnlRealized, tradePrice, tradeId)
+TRADE_HISTORY_COLUMNS = [
+    ("Datum", lambda r: str(r[0]), None),
+    ("Symbol", lambda r: str(r[1]), None),
+    ("C/P", lambda r: str(r[2]), None),
+    ("Strike", lambda r: str(r[3]), None),
+    ("Množství", lambda r: str(r[4]), None),
+    ("Realizovaný PnL", lambda r: _number(r[5], default="0.00"), lambda r: _pnl_color(r[5])),
+    ("Avg Price", lambda r: _number(r[6], default="0.00"), None),
+    ("Trade ID", lambda r: str(r[7]), None),
+]
+
+
+class TradeHistoryModel(PagedRowTableModel):
+    """Trade history of a strategy, paged from SQLite (see DatabaseManager.fetch_trade_page)."""
+    TRADE_ID_COLUMN = 7
+
+    def __init__(self, parent=None):
+        super().__init__(TRADE_HISTORY_COLUMNS, parent=parent)
+
+
+def _leg_text(key, digits=2):
+    return lambda leg: _number(leg[key], digits)
+
+
+def _option_only(leg, text):
+    return text if leg['contract'].secType in ("OPT", "FOP") else ""
+
+
+# Live position rows: the leg dicts of IBManager position snapshots
+LIVE_POSITION_COLUMNS = [
+    ('Symbol', lambda leg: leg['contract'].symbol, None),
+    ('Typ', lambda leg: leg['contract'].secType, None),
+    ('Právo', lambda leg: _option_only(leg, leg['contract'].right), None),
+    ('Strike', lambda leg: _option_only(leg, str(leg['contract'].strike)), None),
+    ('Množství', lambda leg: str(leg['position']), None),
+    ('Tržní hodnota', _leg_text('marketValue'), None),
+    ('Prům. cena', lambda leg: _number(leg['avgCost']) if isinstance(leg['avgCost'], float) else "N/A", None),
+    ('Nerealizovaný PnL', _leg_text('unrealizedPnl'), None),
+    ('Delta', _leg_text('delta', 3), None),
+    ('Delta pozice', _leg_text('positionDelta'), None),
+    ('IV', lambda leg: f"{leg['iv'] * 100:.1f} %" if isinstance(leg['iv'], float) else str(leg['iv']), None),
+]
+
+
+class LivePositionsModel(RowTableModel):
+    """Legs of a position snapshot (IBManager.get_position_snapshot_async)."""
+    def __init__(self, parent=None):
+        super().__init__(LIVE_POSITION_COLUMNS, parent)
+
+
+# Strategy rows: [date_open, ticker, date_close] as read from DeltaNeutralStrategies
+STRATEGY_COLUMNS = [
+    ('Ticker', lambda r: r[1] or '', None),
+    ('Datum Vstup', lambda r: r[0] or '', None),
+    ('Datum Výstup', lambda r: r[2] or '', None),
+]
+_STRATEGY_FIELDS = {0: 1, 1: 0, 2: 2} # view column -> index in the row
+
+
+class StrategiesModel(RowTableModel):
+    """
+    Delta neutral strategies; the dates are editable. An edit changes the
+    row in place and emits cell_edited(row, column, old value), so the
+    database can be updated with the original key of the row.
+    """
+    cell_edited = pyqtSignal(int, int, object)
+    EDITABLE_COLUMNS = (1, 2)
+
+    def __init__(self, parent=None):
+        super().__init__(STRATEGY_COLUMNS, parent)
+
+    def set_rows(self, rows):
+        super().set_rows([list(row) for row in rows])
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and self._message is None and index.column() in self.EDITABLE_COLUMNS:
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.EditRole:
+            role = Qt.ItemDataRole.DisplayRole
+        return super().data(index, role)
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.EditRole or not index.isValid() or index.column() not in self.EDITABLE_COLUMNS:
+            return False
+        row = self._rows[index.row()]
+        field = _STRATEGY_FIELDS[index.column()]
+        old_value = row[field]
+        if value == (old_value or ''):
+            return False
+        row[field] = value
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
+        self.cell_edited.emit(index.row(), index.column(), old_value)
+        return True
+
+    def strategy(self, row):
+        """Returns (ticker, date_open, date_close) of a row, or None."""
+        values = self.row_data(row)
+        return None if values is None else (values[1], values[0], values[2] or '')
@@ -0,0 +1,53 @@
+# test_database_manager.py
+import sqlite3 as sq
+import pytest
+
+pytest.importorskip('PyQt6')
+pytest.importorskip('ib_insync')
+import db_migrations
+from database_manager import TRADE_HISTORY_SQL, TRADE_SUMMARY_SQL, TRADE_HISTORY_COLUMNS, TRADE_HISTORY_ORDER, TRADE_WINDOW
+from trade_archives import TradeArchives
+
+WINDOW = ('GOOG', '2024-01-01', '2024-12-31')
+
+
+def _database(path, rows):
+    conn = sq.connect(path)
+    db_migrations.migrate(conn)
+    conn.executemany("INSERT INTO IBFlexQueryCZK (tradeDate, underlyingSymbol, tradeId, fifoPnlRealized) "
+                     "VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    return conn
+
+
+def test_trade_queries_use_the_index(tmp_path):
+    conn = _database(str(tmp_path / 'live.db'), [('2024-01-31', 'GOOG', 1, 10.0)])
+
+    history = db_migrations.query_plan(conn, TRADE_HISTORY_SQL, WINDOW + (50, 0))
+    summary = db_migrations.query_plan(conn, TRADE_SUMMARY_SQL, WINDOW)
+    assert db_migrations.uses_index(history), history
+    assert db_migrations.uses_index(summary), summary
+
+
+def test_live_trades_take_precedence_over_archives(tmp_path):
+    archive = _database(str(tmp_path / 'IBFlexQuery_2023.db'), [
+        ('2023-12-29', 'GOOG', 1, 1.0),  # Also in the live table, with a different value
+        ('2024-01-02', 'GOOG', 2, 2.0),
+        ('2023-06-30', 'AAPL', 3, 3.0),
+    ])
+    archive.close()
+    live = _database(str(tmp_path / 'live.db'), [('2023-12-29', 'GOOG', 1, 10.0), ('2024-02-01', 'GOOG', 4, 4.0)])
+    archives = TradeArchives(str(tmp_path / 'live.db'), [str(tmp_path / 'IBFlexQuery_*.db')], str(tmp_path / 'cache'))
+    archives.attach(live)
+
+    sql, params = archives.union_sql(TRADE_HISTORY_COLUMNS, TRADE_WINDOW, ('GOOG', '2023-01-01', '2024-12-31'),
+                                     '2023-01-01', '2024-12-31')
+    rows = live.execute(f"{sql} {TRADE_HISTORY_ORDER}", params).fetchall()
+    assert [(row[0], row[5], row[7]) for row in rows] == [
+        ('2023-12-29', 10.0, 1), ('2024-01-02', 2.0, 2), ('2024-02-01', 4.0, 4)
+    ]
+    plan = db_migrations.query_plan(live, f"{sql} {TRADE_HISTORY_ORDER}", params)
+    assert db_migrations.uses_index(plan), plan
+
+    assert archives.overlapping('2025-01-01', '2025-12-31') == []
+    assert live.execute("SELECT COUNT(*) FROM temp.IBFlexQueryAll").fetchone()[0] == 4
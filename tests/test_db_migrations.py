@@ -0,0 +1,89 @@
+# test_db_migrations.py
+import sqlite3 as sq
+import db_migrations
+
+# A table of the former to_sql with a view of the user reading the stored 20240131
+LEGACY_SCHEMA = [
+    """
+    CREATE TABLE IBFlexQueryCZK (
+        tradeDate INTEGER, symbol TEXT, underlyingSymbol TEXT, putCall TEXT, strike REAL, quantity REAL,
+        fifoPnlRealized REAL, tradePrice REAL, tradeID INTEGER, netCash REAL, fxPnL REAL
+    )
+    """,
+    """
+    CREATE VIEW trader1 AS
+    SELECT symbol, DATE(SUBSTR(tradeDate, 1, 4) || '-' || SUBSTR(tradeDate, 5, 2) || '-' || SUBSTR(tradeDate, 7, 2)) AS tradeDate
+    FROM IBFlexQueryCZK
+    """,
+]
+LEGACY_ROWS = [
+    (20240131, 'GOOG  240216C00150000', 'GOOG', 'C', 150.0, -1, 120.0, 2.5, 1, 250.0, 1.0),
+    (20240205, 'GOOG  240216C00150000', 'GOOG', 'C', 150.0, 1, 0.0, 1.3, 2, -130.0, 0.0),
+    (20231229, 'GOOG', 'GOOG', None, None, 10, 0.0, 140.0, 3, -1400.0, 0.0),
+]
+
+
+def _legacy_db(path):
+    conn = sq.connect(path)
+    for statement in LEGACY_SCHEMA:
+        conn.execute(statement)
+    conn.executemany(f"INSERT INTO IBFlexQueryCZK VALUES ({', '.join('?' * 11)})", LEGACY_ROWS)
+    conn.commit()
+    return conn
+
+
+def test_migrate_is_idempotent(tmp_path):
+    conn = sq.connect(str(tmp_path / 'new.db'))
+    versions = [number for number, _, _ in db_migrations.MIGRATIONS]
+
+    assert db_migrations.migrate(conn) == versions
+    assert db_migrations.migrate(conn) == []
+    assert db_migrations.current_version(conn) == versions[-1]
+    assert [row[0] for row in conn.execute(f"SELECT version FROM {db_migrations.VERSION_TABLE} ORDER BY version")] \
+        == versions
+
+
+def test_failed_migration_leaves_the_previous_version(tmp_path):
+    conn = sq.connect(str(tmp_path / 'new.db'))
+    db_migrations.migrate(conn)
+    version = db_migrations.current_version(conn)
+
+    def failing(conn):
+        conn.execute("CREATE TABLE Partial (x)")
+        raise sq.OperationalError('failed')
+
+    try:
+        db_migrations.migrate(conn, db_migrations.MIGRATIONS + [(version + 1, 'failing', failing)])
+    except sq.OperationalError:
+        pass
+    assert db_migrations.current_version(conn) == version
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'Partial'").fetchall() == []
+
+
+def test_migrate_keeps_stored_trade_dates_and_user_views(tmp_path):
+    conn = _legacy_db(str(tmp_path / 'legacy.db'))
+    view_before = conn.execute("SELECT tradeDate FROM trader1 ORDER BY rowid").fetchall()
+
+    db_migrations.migrate(conn)
+
+    assert conn.execute("SELECT tradeDate, tradeDay FROM IBFlexQueryCZK ORDER BY rowid").fetchall() == [
+        (20240131, '2024-01-31'), (20240205, '2024-02-05'), (20231229, '2023-12-29')
+    ]
+    assert conn.execute("SELECT tradeDate FROM trader1 ORDER BY rowid").fetchall() == view_before \
+        == [('2024-01-31',), ('2024-02-05',), ('2023-12-29',)]
+
+
+def test_strategy_summary_follows_trades(tmp_path):
+    conn = _legacy_db(str(tmp_path / 'legacy.db'))
+    db_migrations.migrate(conn)
+    conn.execute("INSERT INTO DeltaNeutralStrategies (ticker, date_open) VALUES ('GOOG', '2024-01-01')")
+    summary = "SELECT tradeCount, realizedPnL, netCash FROM StrategyPnLSummary WHERE ticker = 'GOOG'"
+
+    assert conn.execute(summary).fetchone() == (2, 120.0, 120.0)
+    conn.execute("INSERT INTO IBFlexQueryCZK (tradeDate, underlyingSymbol, tradeID, fifoPnlRealized, netCash) "
+                 "VALUES (20240301, 'GOOG', 4, 10.0, 5.0)")
+    assert conn.execute(summary).fetchone() == (3, 130.0, 125.0)
+    conn.execute("DELETE FROM IBFlexQueryCZK WHERE tradeID = 1")
+    assert conn.execute(summary).fetchone() == (2, 10.0, -125.0)
+    conn.execute("UPDATE DeltaNeutralStrategies SET date_close = '2024-02-28'")
+    assert conn.execute(summary).fetchone() == (1, 0.0, -130.0)
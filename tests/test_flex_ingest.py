@@ -0,0 +1,77 @@
+# test_flex_ingest.py
+import sqlite3 as sq
+import pytest
+
+pytest.importorskip('ib_insync')
+import flex_ingest
+
+# Table as written by the former to_sql: no key, Flex column names
+LEGACY_TABLE = """
+    CREATE TABLE IBFlexQueryCZK (
+        tradeID INTEGER, tradeDate TEXT, symbol TEXT, quantity REAL, tradePrice REAL,
+        netCash REAL, openCloseIndicator TEXT, notes TEXT, fifoPnlRealized REAL, buySell TEXT
+    )
+"""
+# Pairs of rows of one trade as found in IBFlexQuery_OLD.db: the complete row
+# first, a copy from an earlier report (not yet closed or realized) later
+LEGACY_ROWS = [
+    (5192078609, '2024-01-31', 'SPX', -1, 13.6, 1352.79, 'C', 'Ep', 1352.787183, 'SELL'),
+    (966728861, '2023-05-17', 'AAPL', -1, 2.24, 223.58, 'C', '', 503.82976, 'SELL'),
+    (966533866, '2023-05-16', 'AAPL', 1, 2.1, -210.5, 'O', '', 0.0, 'BUY'),
+    (1, '2023-01-01', 'MSFT', 1, 300.0, -300.0, 'O', '', 0.0, 'BUY'),
+    (5192078609, '2024-01-31', 'SPX', -1, 13.6, 1352.79, 'C', 'Ep', 0.0, None),
+    (966728861, '2023-05-17', 'AAPL', -1, 2.24, 223.58, None, None, 0.0, None),
+    (966533866, '2023-05-16', 'AAPL', 1, 2.1, -210.5, None, None, 0.0, None),
+]
+
+
+def _legacy_db(rows):
+    conn = sq.connect(':memory:')
+    conn.execute(LEGACY_TABLE)
+    conn.executemany(f"INSERT INTO IBFlexQueryCZK VALUES ({', '.join('?' * 10)})", rows)
+    conn.commit()
+    return conn
+
+
+def test_ensure_trade_key_keeps_the_most_complete_copy():
+    conn = _legacy_db(LEGACY_ROWS)
+    flex_ingest.ensure_trade_key(conn)
+
+    rows = {row[0]: row[1:] for row in conn.execute(
+        "SELECT tradeID, openCloseIndicator, fifoPnlRealized, buySell FROM IBFlexQueryCZK")}
+    assert rows == {
+        5192078609: ('C', 1352.787183, 'SELL'),
+        966728861: ('C', 503.82976, 'SELL'),
+        966533866: ('O', 0.0, 'BUY'),
+        1: ('O', 0.0, 'BUY'),
+    }
+    assert conn.execute("SELECT SUM(fifoPnlRealized) FROM IBFlexQueryCZK").fetchone()[0] == \
+        pytest.approx(1352.787183 + 503.82976)
+    with pytest.raises(sq.IntegrityError):
+        conn.execute("INSERT INTO IBFlexQueryCZK (tradeID) VALUES (1)")
+
+
+def test_ensure_trade_key_refuses_different_trades_under_one_id():
+    rows = LEGACY_ROWS + [(1, '2023-01-02', 'MSFT', 2, 301.0, -602.0, 'O', '', 0.0, 'BUY')]
+    conn = _legacy_db(rows)
+    with pytest.raises(sq.IntegrityError, match=r'different trades under the same tradeID \(1: 1\)'):
+        flex_ingest.ensure_trade_key(conn)
+
+    assert conn.execute("SELECT COUNT(*) FROM IBFlexQueryCZK").fetchone()[0] == len(rows)
+    assert conn.execute("PRAGMA index_list(IBFlexQueryCZK)").fetchall() == []
+
+
+def test_ingest_trades_counts():
+    conn = _legacy_db(LEGACY_ROWS[:4])
+    trades = [
+        {'tradeID': '1', 'tradeDate': '20230101', 'symbol': 'MSFT', 'quantity': '1', 'tradePrice': '300',
+         'netCash': '-300', 'openCloseIndicator': 'O', 'notes': '', 'fifoPnlRealized': '0', 'buySell': 'BUY'},
+        {'tradeID': '966533866', 'tradeDate': '20230516', 'symbol': 'AAPL', 'quantity': '1', 'tradePrice': '2.1',
+         'netCash': '-210.6', 'openCloseIndicator': 'O', 'notes': '', 'fifoPnlRealized': '0', 'buySell': 'BUY'},
+        {'tradeID': '2', 'tradeDate': '20230201', 'symbol': 'MSFT', 'quantity': '-1', 'tradePrice': '310',
+         'netCash': '310', 'openCloseIndicator': 'C', 'notes': '', 'fifoPnlRealized': '10', 'buySell': 'SELL'},
+        {'tradeDate': '20230201', 'symbol': 'MSFT'},
+    ]
+    counts = flex_ingest.ingest_trades(conn, trades)
+    assert counts == {'inserted': 1, 'updated': 1, 'unchanged': 1, 'skipped': 1}
+    assert flex_ingest.ingest_trades(conn, trades) == {'inserted': 0, 'updated': 0, 'unchanged': 3, 'skipped': 1}
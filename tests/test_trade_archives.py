@@ -0,0 +1,59 @@
+# test_trade_archives.py
+import sqlite3 as sq
+import pytest
+
+pytest.importorskip('ib_insync')
+import trade_archives
+
+
+def _archive(path, rows):
+    """Archive as written by the former to_sql: tradeDate as 20240131, no key."""
+    conn = sq.connect(path)
+    conn.execute("""
+        CREATE TABLE IBFlexQueryCZK (
+            tradeID INTEGER, tradeDate INTEGER, underlyingSymbol TEXT, quantity REAL,
+            netCash REAL, openCloseIndicator TEXT, fifoPnlRealized REAL
+        )
+    """)
+    conn.executemany("INSERT INTO IBFlexQueryCZK VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def _copy_rows(copy):
+    conn = sq.connect(copy)
+    try:
+        return conn.execute(
+            "SELECT tradeID, tradeDate, tradeDay, netCash, openCloseIndicator, fifoPnlRealized FROM IBFlexQueryCZK ORDER BY rowid"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_copy_keeps_the_most_complete_row_of_a_trade(tmp_path):
+    path = str(tmp_path / 'IBFlexQuery_2023.db')
+    _archive(path, [
+        (966728861, 20230517, 'AAPL', -1, 223.58, 'C', 503.82976),
+        (966533866, 20230516, 'AAPL', 1, -210.5, 'O', 0.0),
+        (966728861, 20230517, 'AAPL', -1, 223.58, None, 0.0),
+        (966533866, 20230516, 'AAPL', 1, -210.5, None, 0.0),
+    ])
+    copy, first_date, last_date = trade_archives.prepare_archive(path, str(tmp_path / 'cache'))
+
+    assert (first_date, last_date) == ('2023-05-16', '2023-05-17')
+    assert _copy_rows(copy) == [
+        (966728861, 20230517, '2023-05-17', 223.58, 'C', 503.82976),
+        (966533866, 20230516, '2023-05-16', -210.5, 'O', 0.0),
+    ]
+
+
+def test_copy_keeps_all_rows_of_different_trades_under_one_id(tmp_path):
+    path = str(tmp_path / 'IBFlexQuery_2024.db')
+    rows = [
+        (1, 20240102, 'MSFT', 1, -300.0, 'O', 0.0),
+        (1, 20240103, 'MSFT', 2, -602.0, 'O', 0.0),
+    ]
+    _archive(path, rows)
+    copy = trade_archives.prepare_archive(path, str(tmp_path / 'cache'))[0]
+
+    assert [row[3] for row in _copy_rows(copy)] == [-300.0, -602.0]
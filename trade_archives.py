@@ -0,0 +1,264 @@
+# trade_archives.py
+import glob
+import hashlib
+import os
+import sqlite3 as sq
+from datetime import datetime
+import config
+import db_migrations
+from db_access import read_only_uri
+from flex_ingest import TABLE, KEY_COLUMN, conflicting_trades, redundant_copies_sql
+
+UNIFIED_VIEW = 'IBFlexQueryAll'
+MAX_ATTACHED = 10 # SQLite's default limit of attached databases per connection
+SOURCE_TABLE = 'ArchiveSource' # Metadata of an archive copy: which file (and version) it was built from
+COPY_FORMAT = 2 # Layout of the copies (2: tradeDate as stored, plus tradeDay); other copies are rebuilt
+
+
+def _columns(conn, schema):
+    """Columns of the trades table in a schema as {lowercase name: name}."""
+    return {row[1].lower(): row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({TABLE})")}
+
+
+def _source_version(path):
+    """Size and modification time of an archive file and its WAL; a change means the copy is stale."""
+    versions = []
+    for file in (path, path + '-wal'):
+        stat = os.stat(file) if os.path.exists(file) else None
+        versions += [stat.st_size, stat.st_mtime_ns] if stat else [0, 0]
+    return tuple(versions)
+
+
+def _copy_path(path, directory):
+    # The hash of the absolute path keeps archives of the same name in different directories apart
+    digest = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:12]
+    return os.path.join(directory, f"{os.path.splitext(os.path.basename(path))[0]}_{digest}.db")
+
+
+def _copy_period(copy, path, version):
+    """Trade date range recorded in an archive copy built from this version of the archive, or None."""
+    if not os.path.exists(copy):
+        return None
+    try:
+        conn = sq.connect(read_only_uri(copy), uri=True)
+        try:
+            row = conn.execute(
+                f"SELECT source, size, mtime, walSize, walMtime, firstDate, lastDate, format FROM {SOURCE_TABLE}"
+            ).fetchone()
+        finally:
+            conn.close()
+    except sq.Error:
+        return None # Incomplete or from an older version: build it again
+    if row is None or row[0] != os.path.abspath(path) or tuple(row[1:5]) != version or row[7] != COPY_FORMAT:
+        return None
+    return row[5], row[6]
+
+
+def _build_copy(path, copy, version):
+    """
+    Builds the read-optimized copy of an archive: trades as stored plus
+    tradeDay (tradeDate as 'YYYY-MM-DD', see db_migrations.TRADE_DAY_SQL),
+    one row per tradeId (the most complete one, as ensure_trade_key keeps;
+    rows of a tradeId that differ in the trade itself are all kept) and the
+    trade history and tradeId indexes. The archive is attached read-only;
+    the copy replaces the previous one only when complete.
+
+    Returns:
+        tuple: (first tradeDate, last tradeDate), or None if the archive has no trades table.
+    """
+    os.makedirs(os.path.dirname(copy) or '.', exist_ok=True)
+    staging = copy + '.tmp'
+    if os.path.exists(staging):
+        os.remove(staging)
+    conn = sq.connect(staging, timeout=config.DB_BUSY_TIMEOUT, uri=True)
+    built = False
+    try:
+        conn.execute("ATTACH DATABASE ? AS source", (read_only_uri(path),))
+        columns = _columns(conn, 'source')
+        if KEY_COLUMN.lower() not in columns or 'tradedate' not in columns:
+            return None
+        key = columns[KEY_COLUMN.lower()]
+        select = ', '.join(name for lower, name in columns.items() if lower != db_migrations.TRADE_DAY_COLUMN.lower())
+        select += f", {db_migrations.TRADE_DAY_SQL.format(column=columns['tradedate'])} AS {db_migrations.TRADE_DAY_COLUMN}"
+        conflicts = conflicting_trades(conn, columns, f"source.{TABLE}")
+        conn.execute(f"""
+            CREATE TABLE {TABLE} AS SELECT {select} FROM source.{TABLE}
+            WHERE rowid NOT IN ({redundant_copies_sql(columns, f"source.{TABLE}")})
+               OR {key} IN ({', '.join('?' * len(conflicts))})
+        """, conflicts)
+        duplicates = conn.execute(f"SELECT COUNT(*) FROM source.{TABLE}").fetchone()[0] \
+            - conn.execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0]
+        unique = 'UNIQUE ' if not conflicts else ''
+        conn.execute(f"CREATE {unique}INDEX idx_{TABLE}_{KEY_COLUMN} ON {TABLE} ({key})")
+        db_migrations.create_trade_history_index(conn)
+        period = conn.execute(
+            f"SELECT MIN({db_migrations.TRADE_DAY_COLUMN}), MAX({db_migrations.TRADE_DAY_COLUMN}) FROM {TABLE}"
+        ).fetchone()
+        conn.execute(f"""
+            CREATE TABLE {SOURCE_TABLE} (
+                source TEXT, size INTEGER, mtime INTEGER, walSize INTEGER, walMtime INTEGER,
+                firstDate TEXT, lastDate TEXT, builtAt TEXT, format INTEGER
+            )
+        """)
+        conn.execute(f"INSERT INTO {SOURCE_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (os.path.abspath(path), *version, *period, datetime.now().isoformat(timespec='seconds'),
+                      COPY_FORMAT))
+        conn.commit()
+        conn.execute("DETACH DATABASE source")
+        built = True
+    finally:
+        conn.close()
+        if not built:
+            os.remove(staging)
+    os.replace(staging, copy)
+    if conflicts:
+        print(f"WARNING: Trade archive {path} holds different trades under the same {KEY_COLUMN}, "
+              f"all their rows kept: {', '.join(map(str, conflicts))}")
+    print(f"DEBUG: Trade archive {path}: copy {copy} built, {duplicates} redundant copies of trades left out.")
+    return period
+
+
+def prepare_archive(path, directory=None):
+    """
+    Returns the read-optimized copy of an archive database, building it when
+    it is missing or the archive has changed since. The archive itself is
+    only read, never changed.
+
+    Args:
+        path (str): The archive database.
+        directory (str, optional): Directory of the copies. Defaults to config.TRADE_ARCHIVE_CACHE_DIR.
+
+    Returns:
+        tuple: (path of the copy, first tradeDate, last tradeDate), or None if
+               the archive has no trades table.
+
+    Raises:
+        sq.Error, OSError: The archive cannot be read or the copy cannot be written.
+    """
+    directory = config.TRADE_ARCHIVE_CACHE_DIR if directory is None else directory
+    copy = _copy_path(path, directory)
+    version = _source_version(path)
+    period = _copy_period(copy, path, version)
+    if period is None:
+        period = _build_copy(path, copy, version)
+    return (copy,) + tuple(period) if period else None
+
+
+def _branch(schema, columns, where, preceding):
+    """SELECT of one source, leaving out the trades of the sources with precedence."""
+    sql = f"SELECT {columns} FROM {schema}.{TABLE} AS t WHERE {where}"
+    for other in preceding:
+        sql += f" AND NOT EXISTS (SELECT 1 FROM {other}.{TABLE} AS p WHERE p.tradeId = t.tradeId)"
+    return sql
+
+
+class TradeArchives:
+    """
+    Older trades kept in separate archive databases (e.g. one file per year,
+    or one file spanning several years), attached to the connections of the
+    live database for the trade history.
+
+    The archives are never changed. Each one is read once into a copy in
+    config.TRADE_ARCHIVE_CACHE_DIR (tradeDay added, redundant copies of
+    trades left out, indexed), which is rebuilt whenever the archive changes and attached
+    read-only. The date range of every archive is read from its trades, so
+    trade queries go over the live table and only the archives overlapping
+    the queried window, and a decade of archives costs nothing for a strategy
+    opened this year. A trade stored in several sources (e.g. the live YTD
+    report and an archive of the same year) counts once: the live table takes
+    precedence, then the archives in configured order. All sources together
+    are also available as the TEMP view IBFlexQueryAll, with tradeDate as
+    'YYYY-MM-DD' whatever format each source stores.
+    """
+    def __init__(self, db_path, patterns=None, directory=None):
+        """
+        Args:
+            db_path (str): Path to the live database (never treated as an archive).
+            patterns (list[str], optional): Paths or glob patterns of the archive
+                                            databases. Defaults to config.TRADE_ARCHIVE_DATABASES.
+            directory (str, optional): Directory of the archive copies.
+                                       Defaults to config.TRADE_ARCHIVE_CACHE_DIR.
+        """
+        self.archives = [] # dicts: 'schema', 'path', 'copy', 'first_date', 'last_date'
+        patterns = config.TRADE_ARCHIVE_DATABASES if patterns is None else patterns
+
+        paths = []
+        for pattern in patterns:
+            for path in sorted(glob.glob(pattern)):
+                if os.path.abspath(path) != os.path.abspath(db_path) and path not in paths:
+                    paths.append(path)
+        if len(paths) > MAX_ATTACHED:
+            print(f"WARNING: Only {MAX_ATTACHED} trade archives can be attached, skipped: {paths[MAX_ATTACHED:]}")
+            paths = paths[:MAX_ATTACHED]
+
+        for path in paths:
+            try:
+                prepared = prepare_archive(path, directory)
+            except (sq.Error, OSError) as e:
+                print(f"WARNING: Trade archive {path} could not be read: {e}")
+                continue
+            if not prepared or prepared[1] is None:
+                print(f"WARNING: Trade archive {path} contains no trades, skipped.")
+                continue
+            copy, first_date, last_date = prepared
+            self.archives.append({'schema': f"archive{len(self.archives)}", 'path': path, 'copy': copy,
+                                  'first_date': first_date, 'last_date': last_date})
+            print(f"DEBUG: Trade archive {path} ({first_date} .. {last_date}) read from {copy}.")
+
+    def __bool__(self):
+        return bool(self.archives)
+
+    def attach(self, conn):
+        """
+        Attaches the archive copies read-only to a connection of the live
+        database (opened with uri=True, see db_access) and creates the TEMP
+        view IBFlexQueryAll. Archives attached before are replaced.
+        """
+        for row in conn.execute("PRAGMA database_list").fetchall():
+            if row[1].startswith('archive'):
+                conn.execute(f"DETACH DATABASE {row[1]}")
+        for archive in self.archives:
+            conn.execute(f"ATTACH DATABASE ? AS {archive['schema']}", (read_only_uri(archive['copy']),))
+        self._create_view(conn)
+
+    def overlapping(self, date_from, date_to):
+        """Schemas of the archives with trades between date_from and date_to ('YYYY-MM-DD')."""
+        return [a['schema'] for a in self.archives if a['first_date'] <= date_to and a['last_date'] >= date_from]
+
+    def union_sql(self, columns, where, params, date_from, date_to, include_main=True):
+        """
+        Builds a UNION ALL of the same SELECT over the live table and the
+        archives overlapping the window; add ORDER BY/LIMIT or wrap it in an
+        aggregate as needed.
+
+        Args:
+            columns (str): Selected columns, e.g. 'tradeDay, symbol'.
+            where (str): Condition with ? placeholders, e.g. 'underlyingSymbol = ?'.
+            params (tuple): Parameters of the condition.
+            date_from (str), date_to (str): Window the condition selects ('YYYY-MM-DD').
+            include_main (bool): False for only the trades that are in the archives alone.
+
+        Returns:
+            tuple: (sql, params), or (None, ()) if there is no source to read.
+        """
+        sources = ['main'] + self.overlapping(date_from, date_to)
+        branches = [_branch(schema, columns, where, sources[:i])
+                    for i, schema in enumerate(sources) if include_main or schema != 'main']
+        if not branches:
+            return None, ()
+        return " UNION ALL ".join(branches), tuple(params) * len(branches)
+
+    def _create_view(self, conn):
+        columns = list(_columns(conn, 'main').values())
+        sources = ['main'] + [a['schema'] for a in self.archives]
+        branches = []
+        for i, schema in enumerate(sources):
+            existing = _columns(conn, schema)
+            # Archives created by older versions may lack some columns
+            select = ', '.join(
+                f"{db_migrations.TRADE_DAY_COLUMN} AS {c}" if c.lower() == 'tradedate' else existing.get(c.lower(), f"NULL AS {c}")
+                for c in columns
+            )
+            branches.append(_branch(schema, select, '1 = 1', sources[:i]))
+        conn.execute(f"DROP VIEW IF EXISTS temp.{UNIFIED_VIEW}")
+        conn.execute(f"CREATE TEMP VIEW {UNIFIED_VIEW} AS {' UNION ALL '.join(branches)}")